@@ -1,7 +1,13 @@
+from lib.message import Message, MessageWriter
 from lib.config import DownloadConfig
 from lib.rdp.socket import RdpStream
-from lib.message import Message
+from lib.spool import FileSpool, partial_path
+from lib.filestat import FileStat
+from lib.session import Session
+from lib.striped import download_striped
+from typing import BinaryIO
 from sys import argv
+import io
 import os
 
 
@@ -9,26 +15,101 @@ if __name__ == "__main__":
     config = DownloadConfig(argv)
 
     name = config.name()
-    msg = Message.download(name)
+    dst = config.dst()
     winsize = config.winsize()
-
+    ackfreq = config.ackfreq()
+    fastrtx = config.fastrtx()
     log = config.verbose()
     ip, port = config.addr()
-    stream = RdpStream.connect(ip, port, log=log)
+
+    if config.streams() > 1:
+        def connect() -> Session:
+            stream = RdpStream.connect(ip, port, log=log, batch=config.batch(),
+                                       mss=config.mss(), probe=config.probe(), winsize=winsize)
+            return Session(stream, winsize, ackfreq, fastrtx)
+
+        try:
+            res = download_striped(connect, dst, name, config.streams(), config.codec())
+        except KeyboardInterrupt:
+            exit(0)
+
+        if not res.is_ok():
+            print(res.unwrap().decode())
+            exit(1)
+
+        exit(0)
+
+    offset = 0
+    if config.resume():
+        try:
+            offset = os.path.getsize(partial_path(dst + Message.download(name).path()))
+        except FileNotFoundError:
+            pass
+
+    msg = Message.download(name, range=(offset, None) if offset > 0 else None, codec=config.codec())
+    spools = []
+
+    def open_sink(res: Message) -> BinaryIO:
+        # Only the data of a successful response is a file,
+        # keep error descriptions in memory to print them.
+        if not res.is_ok():
+            return io.BytesIO()
+
+        spools.append(FileSpool(dst + res.path(), res.offset()))
+        return spools[-1]
+
+    # Downloads are idempotent, so the request may go along
+    # with the SYN even if the server ends up seeing it twice.
+    early_data = msg.encode() if config.early() else None
+    stream = RdpStream.connect(ip, port, log=log, batch=config.batch(), mss=config.mss(),
+                               probe=config.probe(), winsize=config.winsize(), early_data=early_data)
+    session = Session(stream, winsize, ackfreq, fastrtx)
+    writer = MessageWriter(open_sink)
     try:
-        stream.send(msg.encode(), winsize)
-        res = stream.recv(winsize)
+        if not stream.early_data_accepted():
+            stream.send(msg.encode(), winsize, fastrtx)
+
+        stream.recv_into(writer, winsize, ackfreq)
+        writer.finish()
+
+        res = writer.message()
+        if res is not None and offset > 0:
+            # The kept bytes may belong to another version of the file,
+            # start over unless they make it up along with the rest.
+            stat = session.stat(name)
+            if not (res.is_ok() and stat.is_ok()
+                    and FileStat.from_bytes(stat.unwrap()).sha256() == spools[-1].sha256()):
+                if res.is_ok():
+                    spools.pop().discard()
+                else:
+                    os.unlink(partial_path(dst + msg.path()))
+
+                writer = session.download(name, open_sink, codec=config.codec())
     except KeyboardInterrupt:
-        stream.close()
+        # Keep what arrived for a later download to carry on with.
+        for spool in spools:
+            spool.suspend()
+
+        session.close()
         exit(0)
+    except ValueError as e:
+        # Corrupt or cut short compressed data, nothing of it is
+        # worth carrying on with.
+        for spool in spools:
+            spool.discard()
 
-    stream.close()
-    msg = Message.from_bytes(res)
-    if msg.is_error():
-        print(msg.unwrap().decode())
+        session.close()
+        print(e)
         exit(1)
 
-    dst = config.dst()
-    os.makedirs(dst, exist_ok=True)
-    with open(dst + msg.path(), "wb") as f:
-        f.write(msg.unwrap())
+    session.close()
+    res = writer.message()
+    if res is None:
+        print("Invalid response")
+        exit(1)
+
+    if not res.is_ok():
+        print(writer.sink().getvalue().decode())
+        exit(1)
+
+    spools[-1].commit()
@@ -0,0 +1,250 @@
+from .spool import FileSpool
+from collections import deque
+from typing import BinaryIO, Optional
+import tempfile
+import hashlib
+import re
+import os
+
+"""
+                               PUT BODY
+
+     The manifest of the file, one line per chunk in order, then an
+     empty line and the data of the chunks marked with `+`, in order.
+     Chunks marked with `=` are taken from the store of the server.
+
+                 sha256 <file digest>\n
+                 = <chunk digest> <length>\n
+                 + <chunk digest> <length>\n
+                 \n
+                 <chunk data>
+"""
+
+# Files are split into chunks of this many bytes, the last one
+# may be shorter.
+CHUNK_SIZE = 1 << 18
+
+# Where the chunks are kept, inside the storage directory.
+STORE_DIR = ".chunks"
+
+# Longest manifest accepted before giving up on a PUT, enough
+# for files of many gigabytes.
+MAX_MANIFEST_SIZE = 1 << 24
+
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+def chunks_of(file: BinaryIO) -> tuple[list[tuple[str, int]], str]:
+    """
+    Returns the digest and length of every chunk of `file` from its
+    start on, along with the digest of the whole file.
+    """
+    chunks = []
+    whole = hashlib.sha256()
+    file.seek(0)
+    while chunk := file.read(CHUNK_SIZE):
+        chunks.append((hashlib.sha256(chunk).hexdigest(), len(chunk)))
+        whole.update(chunk)
+
+    file.seek(0)
+    return chunks, whole.hexdigest()
+
+
+class ChunkStore:
+    """
+    Chunks of files uploaded with PUT, each kept once under the store
+    directory of the storage no matter how many files it belongs to,
+    named by its SHA-256. Chunks are checked against their digest
+    before being added and renamed into place, so concurrent uploads
+    of the same chunk from any worker are harmless.
+    """
+
+    def __init__(self, storage: str):
+        self._dir = os.path.join(storage, STORE_DIR)
+
+    def _path(self, digest: str) -> str:
+        if DIGEST.fullmatch(digest) is None:
+            raise ValueError(f"Invalid chunk digest {digest}")
+
+        return os.path.join(self._dir, digest[:2], digest)
+
+    def has(self, digest: str) -> bool:
+        return os.path.isfile(self._path(digest))
+
+    def add(self, digest: str, data: bytes):
+        """
+        Raises `ValueError` if `data` does not match `digest`.
+        """
+        path = self._path(digest)
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} does not match its data")
+
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True, mode=0o777)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".chunk-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    def read(self, digest: str) -> bytes:
+        """
+        Raises `ValueError` if the store does not have the chunk.
+        """
+        try:
+            with open(self._path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError as e:
+            raise ValueError(f"Chunk {digest} is not in the store") from e
+
+    def missing(self, digests: list[str]) -> list[str]:
+        return [digest for digest in digests if not self.has(digest)]
+
+
+def manifest(chunks: list[tuple[str, int]], sha256: str, missing: set[str]) -> tuple[bytes, list[tuple[int, int]]]:
+    """
+    Returns the manifest of a file with the given chunks, sending those
+    `missing` from the store once each, along with the offset and length
+    of every chunk whose data has to follow it.
+    """
+    lines = [f"sha256 {sha256}"]
+    ranges = []
+    sent = set()
+    offset = 0
+    for digest, length in chunks:
+        if digest in missing and digest not in sent:
+            sent.add(digest)
+            lines.append(f"+ {digest} {length}")
+            ranges.append((offset, length))
+        else:
+            lines.append(f"= {digest} {length}")
+
+        offset += length
+
+    return ("\n".join(lines) + "\n\n").encode(), ranges
+
+
+class ChunkReader:
+    """
+    Reads the body of a PUT, its manifest followed by the given ranges
+    of `file`.
+    """
+
+    def __init__(self, file: BinaryIO, manifest: bytes, ranges: list[tuple[int, int]]):
+        self._file = file
+        self._head = memoryview(manifest)
+        self._ranges = deque(ranges)
+        self._left = 0
+
+    def read(self, size: int) -> bytes:
+        data = bytes(self._head[:size])
+        self._head = self._head[size:]
+        while len(data) < size and (self._left > 0 or self._ranges):
+            if self._left == 0:
+                offset, self._left = self._ranges.popleft()
+                self._file.seek(offset)
+
+            chunk = self._file.read(min(size - len(data), self._left))
+            if not chunk:
+                # The file shrank, the server finds out.
+                self._ranges.clear()
+                self._left = 0
+                break
+
+            self._left -= len(chunk)
+            data += chunk
+
+        return data
+
+
+class ChunkedUpload:
+    """
+    Receives the body of a PUT, adding the chunks that come with it to
+    the store as soon as each is complete, and writes the file out of
+    the store once it is over. Errors are reported then.
+    """
+
+    def __init__(self, store: ChunkStore):
+        self._store = store
+        self._buf = bytearray()
+        self._sha256: Optional[str] = None
+        self._chunks: Optional[list[tuple[str, int]]] = None
+        self._pending: deque[tuple[str, int]] = deque()
+        self._error: Optional[Exception] = None
+
+    def _parse(self, data: bytes):
+        lines = data.decode().splitlines()
+        if not lines or not lines[0].startswith("sha256 "):
+            raise ValueError("The manifest lacks the file digest")
+
+        self._sha256 = lines[0].split(" ", 1)[1]
+        self._chunks = []
+        for line in lines[1:]:
+            mark, digest, length = line.split(" ")
+            if mark not in ("=", "+"):
+                raise ValueError(f"Invalid manifest line {line}")
+
+            self._chunks.append((digest, int(length)))
+            if mark == "+":
+                self._pending.append((digest, int(length)))
+
+    def write(self, data: bytes) -> int:
+        if self._error is not None:
+            return len(data)
+
+        self._buf += data
+        try:
+            if self._chunks is None:
+                # Only look for the end of the manifest in what is new.
+                end = self._buf.find(b"\n\n", max(len(self._buf) - len(data) - 1, 0))
+                if end == -1:
+                    if len(self._buf) > MAX_MANIFEST_SIZE:
+                        raise ValueError("The manifest is too long")
+                    return len(data)
+
+                self._parse(bytes(self._buf[:end]))
+                del self._buf[:end + 2]
+
+            while self._pending and len(self._buf) >= self._pending[0][1]:
+                digest, length = self._pending.popleft()
+                self._store.add(digest, bytes(self._buf[:length]))
+                del self._buf[:length]
+        except (ValueError, OSError) as e:
+            self._error = e
+
+        return len(data)
+
+    def assemble(self, path: str):
+        """
+        Writes the file out of its chunks to `path`, raising `ValueError`
+        if the upload was malformed or its result does not match the
+        digest of the manifest, or `OSError` if writing fails.
+        """
+        if self._error is not None:
+            raise self._error
+
+        if self._chunks is None or self._pending or self._buf:
+            raise ValueError("The upload was cut short")
+
+        spool = FileSpool(path)
+        whole = hashlib.sha256()
+        try:
+            for digest, length in self._chunks:
+                chunk = self._store.read(digest)
+                if len(chunk) != length:
+                    raise ValueError(f"Chunk {digest} is not {length} bytes long")
+
+                spool.write(chunk)
+                whole.update(chunk)
+
+            if whole.hexdigest() != self._sha256:
+                raise ValueError("The file does not match its digest")
+        except ValueError:
+            spool.discard()
+            raise
+
+        spool.commit()
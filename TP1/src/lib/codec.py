@@ -0,0 +1,154 @@
+from __future__ import annotations
+from typing import BinaryIO, Optional
+import zlib
+import lzma
+import re
+
+# Bytes compressed at a time, and sampled from the start of
+# a file to tell whether it is worth compressing.
+CHUNK_SIZE = 1 << 16
+
+# A sample has to shrink at least to this fraction of its size.
+MAX_RATIO = 0.9
+
+# ALGORITHM[LEVEL]
+CODEC_NAME = re.compile(r"(zlib|lzma)(\d)?")
+
+
+class Codec:
+    """
+    A compression algorithm from the standard library along with its
+    level, named like `zlib`, `zlib9` or `lzma1`. Without a level each
+    algorithm uses its default one.
+    """
+
+    def __init__(self, algorithm: str, level: Optional[int] = None):
+        self._algorithm = algorithm
+        self._level = level
+
+    @classmethod
+    def from_str(cls, name: str) -> Codec:
+        match = CODEC_NAME.fullmatch(name)
+        if match is None:
+            raise ValueError(f"Unknown codec {name}")
+
+        algorithm, level = match.groups()
+        return cls(algorithm, int(level) if level is not None else None)
+
+    def compressor(self):
+        if self._algorithm == "zlib":
+            level = zlib.Z_DEFAULT_COMPRESSION if self._level is None else self._level
+            return zlib.compressobj(level)
+
+        preset = lzma.PRESET_DEFAULT if self._level is None else self._level
+        return lzma.LZMACompressor(preset=preset)
+
+    def decompressor(self):
+        if self._algorithm == "zlib":
+            return zlib.decompressobj()
+
+        return lzma.LZMADecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = self.compressor()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Raises `ValueError` if `data` is corrupt or cut short.
+        """
+        decompressor = self.decompressor()
+        try:
+            data = decompressor.decompress(data)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise ValueError(f"Corrupt compressed data: {e}") from e
+
+        if not decompressor.eof:
+            raise ValueError("The compressed data was cut short")
+
+        return data
+
+    def worth(self, sample: bytes) -> bool:
+        """
+        Returns whether compressing `sample` saves enough to bother,
+        already compressed data such as images or archives does not.
+        """
+        return len(sample) > 0 and len(self.compress(sample)) <= len(sample) * MAX_RATIO
+
+    def __str__(self) -> str:
+        return self._algorithm + (str(self._level) if self._level is not None else "")
+
+
+def codec_for(file: BinaryIO, codec: Optional[Codec]) -> Optional[Codec]:
+    """
+    Returns `codec` unless a sample of what is left of `file` does not
+    seem to shrink with it, which moves no further through the file.
+    """
+    if codec is None:
+        return None
+
+    pos = file.tell()
+    sample = file.read(CHUNK_SIZE)
+    file.seek(pos)
+    return codec if codec.worth(sample) else None
+
+
+class CompressReader:
+    """
+    Reads the contents of a file object compressed with a `Codec`, a
+    chunk at a time.
+    """
+
+    def __init__(self, reader: BinaryIO, codec: Codec):
+        self._reader = reader
+        self._compressor = codec.compressor()
+        self._buf = bytearray()
+        self._done = False
+
+    def read(self, size: int) -> bytes:
+        while len(self._buf) < size and not self._done:
+            chunk = self._reader.read(CHUNK_SIZE)
+            if chunk:
+                self._buf += self._compressor.compress(chunk)
+            else:
+                self._buf += self._compressor.flush()
+                self._done = True
+
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def close(self):
+        self._reader.close()
+
+
+class DecompressWriter:
+    """
+    Decompresses what is written to it with a `Codec` into a file object.
+    """
+
+    def __init__(self, sink: BinaryIO, codec: Codec):
+        self._sink = sink
+        self._decompressor = codec.decompressor()
+        self._error: Optional[Exception] = None
+
+    def write(self, data: bytes) -> int:
+        # Keep consuming the transfer after corrupt data, the
+        # error is reported once it is over.
+        if self._error is None:
+            try:
+                self._sink.write(self._decompressor.decompress(data))
+            except (zlib.error, lzma.LZMAError) as e:
+                self._error = e
+
+        return len(data)
+
+    def finish(self):
+        """
+        Raises `ValueError` if the data was corrupt or cut short.
+        """
+        if self._error is not None:
+            raise ValueError(f"Corrupt compressed data: {self._error}")
+
+        if not self._decompressor.eof:
+            raise ValueError("The compressed data was cut short")
@@ -1,3 +1,10 @@
+from .rdp.segment import MAX_SEG_SIZE, MAX_MSS, RDP_HEADER_SIZE
+from .rdp.sender import DUP_THRESH
+from .rdp.seq import MAX_WINSIZE
+from .codec import Codec
+from typing import Optional
+
+
 class InvalidArgs(Exception):
     pass
 
@@ -8,6 +15,11 @@ class Config:
         self._host = "127.0.0.1"
         self._port = 12000
         self._winsize = 1
+        self._ackfreq = 1
+        self._fastrtx = DUP_THRESH
+        self._batch = False
+        self._mss = MAX_SEG_SIZE
+        self._probe = False
 
         i = 1
         while i < len(args):
@@ -44,8 +56,50 @@ class Config:
                     except ValueError as e:
                         raise InvalidArgs("The given window size is not a number") from e
 
+                case "-a" | "--ackfreq":
+                    try:
+                        self._ackfreq = int(args[i + 1])
+                    except IndexError as e:
+                        raise InvalidArgs("No ACK frequency was provided") from e
+                    except ValueError as e:
+                        raise InvalidArgs("The given ACK frequency is not a number") from e
+
+                case "-f" | "--fastrtx":
+                    try:
+                        self._fastrtx = int(args[i + 1])
+                    except IndexError as e:
+                        raise InvalidArgs("No fast retransmit threshold was provided") from e
+                    except ValueError as e:
+                        raise InvalidArgs("The given fast retransmit threshold is not a number") from e
+
+                case "-b" | "--batch":
+                    self._batch = True
+
+                case "-m" | "--mss":
+                    try:
+                        self._mss = int(args[i + 1])
+                    except IndexError as e:
+                        raise InvalidArgs("No segment size was provided") from e
+                    except ValueError as e:
+                        raise InvalidArgs("The given segment size is not a number") from e
+
+                case "-P" | "--probe":
+                    self._probe = True
+
             i += 1
 
+        if not 1 <= self._winsize <= MAX_WINSIZE:
+            raise InvalidArgs(f"The window size must be between 1 and {MAX_WINSIZE}")
+
+        if self._ackfreq < 1:
+            raise InvalidArgs("The ACK frequency must be at least 1")
+
+        if self._fastrtx < 1:
+            raise InvalidArgs("The fast retransmit threshold must be at least 1")
+
+        if not RDP_HEADER_SIZE < self._mss <= MAX_MSS:
+            raise InvalidArgs(f"The segment size must be between {RDP_HEADER_SIZE + 1} and {MAX_MSS}")
+
     def addr(self) -> tuple[str, int]:
         return self._host, self._port
 
@@ -55,6 +109,25 @@ class Config:
     def winsize(self) -> int:
         return self._winsize
 
+    def ackfreq(self) -> int:
+        return self._ackfreq
+
+    def fastrtx(self) -> int:
+        return self._fastrtx
+
+    def batch(self) -> bool:
+        return self._batch
+
+    def mss(self) -> int:
+        return self._mss
+
+    def probe(self) -> bool:
+        return self._probe
+
+
+# Bytes of file contents each server process caches by default.
+DEFAULT_CACHE_SIZE = 64 << 20
+
 
 SERVER_HELP: str = """
 usage : {} [-h] [-v | -q] [-H ADDR] [-p PORT] [-s DIRPATH]
@@ -65,8 +138,17 @@ optional arguments:
     -q, --quiet    decrease output verbosity
     -H, --host     service IP address
     -p, --port     service port
-    -w, --winsize  window size for pipeline streaming
+    -w, --winsize  max window size for pipeline streaming
+    -a, --ackfreq  acknowledge every N in-order segments
+    -f, --fastrtx  SACKed segments above a hole before resending it
+    -b, --batch    batch datagram I/O with sendmmsg/recvmmsg (Linux)
+    -m, --mss      max segment size to negotiate, header included
+    -P, --probe    grow segments up to the MSS the path carries
     -s, --storage  storage dir path
+    -A, --aio      serve every client from a single asyncio event loop
+    -D, --demux    serve every client from the listening socket
+    -W, --workers  server processes sharing the address (SO_REUSEPORT)
+    -c, --cache    MiB of hot files kept in memory per process, 0 for none
 """
 
 
@@ -74,6 +156,10 @@ class ServerConfig(Config):
     def __init__(self, args: list[str]):
         super().__init__(args, SERVER_HELP)
         self._storage = "storage"
+        self._aio = False
+        self._demux = False
+        self._workers = 1
+        self._cache = DEFAULT_CACHE_SIZE
 
         i = 1
         while i < len(args):
@@ -83,16 +169,65 @@ class ServerConfig(Config):
                 except IndexError as e:
                     raise InvalidArgs("No storage directory was given") from e
 
+            elif args[i] == "-A" or args[i] == "--aio":
+                self._aio = True
+
+            elif args[i] == "-D" or args[i] == "--demux":
+                self._demux = True
+
+            elif args[i] == "-W" or args[i] == "--workers":
+                try:
+                    self._workers = int(args[i + 1])
+                except IndexError as e:
+                    raise InvalidArgs("No amount of workers was provided") from e
+                except ValueError as e:
+                    raise InvalidArgs("The given amount of workers is not a number") from e
+
+            elif args[i] == "-c" or args[i] == "--cache":
+                try:
+                    self._cache = int(args[i + 1]) << 20
+                except IndexError as e:
+                    raise InvalidArgs("No cache size was provided") from e
+                except ValueError as e:
+                    raise InvalidArgs("The given cache size is not a number") from e
+
             i += 1
 
+        if self._aio and (self._demux or self._batch):
+            raise InvalidArgs("The asyncio server does not support --demux or --batch")
+
+        if self._workers < 1:
+            raise InvalidArgs("The amount of workers must be at least 1")
+
+        if self._cache < 0:
+            raise InvalidArgs("The cache size can not be negative")
+
     def storage(self) -> str:
         return self._storage
 
+    def aio(self) -> bool:
+        return self._aio
+
+    def demux(self) -> bool:
+        return self._demux
+
+    def workers(self) -> int:
+        return self._workers
+
+    def cache(self) -> int:
+        """
+        Returns the budget of the file cache in bytes.
+        """
+        return self._cache
+
 
 class ClientConfig(Config):
     def __init__(self, args: list[str], help_msg: str):
         super().__init__(args, help_msg)
         self._name = None
+        self._resume = False
+        self._streams = 1
+        self._codec: Optional[Codec] = None
 
         i = 1
         while i < len(args):
@@ -102,14 +237,45 @@ class ClientConfig(Config):
                 except IndexError as e:
                     raise InvalidArgs("No file name was provided") from e
 
+            elif args[i] == "-r" or args[i] == "--resume":
+                self._resume = True
+
+            elif args[i] == "-S" or args[i] == "--streams":
+                try:
+                    self._streams = int(args[i + 1])
+                except IndexError as e:
+                    raise InvalidArgs("No stream count was provided") from e
+                except ValueError as e:
+                    raise InvalidArgs("The given stream count is not a number") from e
+
+            elif args[i] == "-z" or args[i] == "--compress":
+                try:
+                    self._codec = Codec.from_str(args[i + 1])
+                except IndexError as e:
+                    raise InvalidArgs("No codec was provided") from e
+                except ValueError as e:
+                    raise InvalidArgs("The codec must be zlib or lzma, optionally followed by a level") from e
+
             i += 1
 
         if self._name is None:
             raise InvalidArgs("No file name was provided")
 
+        if self._streams < 1:
+            raise InvalidArgs("The stream count must be at least 1")
+
     def name(self) -> str:
         return self._name
 
+    def resume(self) -> bool:
+        return self._resume
+
+    def streams(self) -> int:
+        return self._streams
+
+    def codec(self) -> Optional[Codec]:
+        return self._codec
+
 
 UPLOAD_HELP: str = """
 usage : {} [-h] [-v | -q] [-H ADDR] [-p PORT] [-s FILEPATH] [-n FILENAME]
@@ -120,9 +286,19 @@ optional arguments:
     -q, --quiet    decrease output verbosity
     -H, --host     server IP address
     -p, --port     server port
-    -w, --winsize  window size for pipeline streaming
+    -w, --winsize  max window size for pipeline streaming
+    -a, --ackfreq  acknowledge every N in-order segments
+    -f, --fastrtx  SACKed segments above a hole before resending it
+    -b, --batch    batch datagram I/O with sendmmsg/recvmmsg (Linux)
+    -m, --mss      max segment size to negotiate, header included
+    -P, --probe    grow segments up to the MSS the path carries
     -s, --src      source file path
     -n, --name     file name
+    -r, --resume   carry on with an interrupted upload of the file
+    -S, --streams  stripe the file over N parallel connections
+    -z, --compress compress the file with zlib or lzma, level optional (zlib9)
+    -D, --dedup    only send the chunks of the file the server lacks
+    -x, --delta    only send what differs from the server's copy (rsync)
 """
 
 
@@ -130,6 +306,8 @@ class UploadConfig(ClientConfig):
     def __init__(self, args: list[str]):
         super().__init__(args, UPLOAD_HELP)
         self._src = "."
+        self._dedup = False
+        self._delta = False
 
         i = 1
         while i < len(args):
@@ -139,11 +317,23 @@ class UploadConfig(ClientConfig):
                 except IndexError as e:
                     raise InvalidArgs("No src directory was provided") from e
 
+            elif args[i] == "-D" or args[i] == "--dedup":
+                self._dedup = True
+
+            elif args[i] == "-x" or args[i] == "--delta":
+                self._delta = True
+
             i += 1
 
     def src(self) -> str:
         return self._src
 
+    def dedup(self) -> bool:
+        return self._dedup
+
+    def delta(self) -> bool:
+        return self._delta
+
 
 DOWNLOAD_HELP: str = """
 usage : {} [-h] [-v | -q] [-H ADDR] [-p PORT] [-d FILEPATH] [-n FILENAME]
@@ -154,9 +344,18 @@ optional arguments:
     -q, --quiet    decrease output verbosity
     -H, --host     server IP address
     -p, --port     server port
-    -w, --winsize  window size for pipeline streaming
+    -w, --winsize  max window size for pipeline streaming
+    -a, --ackfreq  acknowledge every N in-order segments
+    -f, --fastrtx  SACKed segments above a hole before resending it
+    -b, --batch    batch datagram I/O with sendmmsg/recvmmsg (Linux)
+    -m, --mss      max segment size to negotiate, header included
+    -P, --probe    grow segments up to the MSS the path carries
     -d, --dst      destination file path
     -n, --name     file name
+    -r, --resume   carry on with an interrupted download of the file
+    -S, --streams  stripe the file over N parallel connections
+    -z, --compress let the server compress the file with zlib or lzma (lzma9)
+    -e, --early    send the request along with the SYN (0-RTT)
 """
 
 
@@ -164,6 +363,7 @@ class DownloadConfig(ClientConfig):
     def __init__(self, args: list[str]):
         super().__init__(args, DOWNLOAD_HELP)
         self._dst = "."
+        self._early = False
 
         i = 1
         while i < len(args):
@@ -173,7 +373,91 @@ class DownloadConfig(ClientConfig):
                 except IndexError as e:
                     raise InvalidArgs("No destination file path was given") from e
 
+            elif args[i] == "-e" or args[i] == "--early":
+                self._early = True
+
+            i += 1
+
+    def dst(self) -> str:
+        return self._dst
+
+    def early(self) -> bool:
+        return self._early
+
+
+SYNC_HELP: str = """
+usage : {} [-h] [-v | -q] [-H ADDR] [-p PORT] [-s DIRPATH] [-d DIRPATH]
+
+optional arguments:
+    -h, --help     show this help message and exit
+    -v, --verbose  increase output verbosity
+    -q, --quiet    decrease output verbosity
+    -H, --host     server IP address
+    -p, --port     server port
+    -w, --winsize  max window size for pipeline streaming
+    -a, --ackfreq  acknowledge every N in-order segments
+    -f, --fastrtx  SACKed segments above a hole before resending it
+    -b, --batch    batch datagram I/O with sendmmsg/recvmmsg (Linux)
+    -m, --mss      max segment size to negotiate, header included
+    -P, --probe    grow segments up to the MSS the path carries
+    -s, --src      source dir path
+    -d, --dst      destination dir path in the server's storage
+    -z, --compress compress files with zlib or lzma, level optional (zlib9)
+    -D, --dedup    only send the chunks of files the server lacks
+    -x, --delta    only send what differs from the server's copies (rsync)
+"""
+
+
+class SyncConfig(Config):
+    def __init__(self, args: list[str]):
+        super().__init__(args, SYNC_HELP)
+        self._src = "."
+        self._dst = "/"
+        self._codec: Optional[Codec] = None
+        self._dedup = False
+        self._delta = False
+
+        i = 1
+        while i < len(args):
+            if args[i] == "-s" or args[i] == "--src":
+                try:
+                    self._src = args[i + 1]
+                except IndexError as e:
+                    raise InvalidArgs("No src directory was provided") from e
+
+            elif args[i] == "-d" or args[i] == "--dst":
+                try:
+                    self._dst = args[i + 1]
+                except IndexError as e:
+                    raise InvalidArgs("No destination directory was given") from e
+
+            elif args[i] == "-z" or args[i] == "--compress":
+                try:
+                    self._codec = Codec.from_str(args[i + 1])
+                except IndexError as e:
+                    raise InvalidArgs("No codec was provided") from e
+                except ValueError as e:
+                    raise InvalidArgs("The codec must be zlib or lzma, optionally followed by a level") from e
+
+            elif args[i] == "-D" or args[i] == "--dedup":
+                self._dedup = True
+
+            elif args[i] == "-x" or args[i] == "--delta":
+                self._delta = True
+
             i += 1
 
+    def src(self) -> str:
+        return self._src
+
     def dst(self) -> str:
         return self._dst
+
+    def dedup(self) -> bool:
+        return self._dedup
+
+    def delta(self) -> bool:
+        return self._delta
+
+    def codec(self) -> Optional[Codec]:
+        return self._codec
@@ -0,0 +1,322 @@
+from __future__ import annotations
+from .spool import FileSpool
+from typing import BinaryIO, Collection, Optional
+from math import isqrt
+import hashlib
+import mmap
+import zlib
+import os
+
+"""
+                            SIGNATURES
+
+     The answer to SIGS, the file and block sizes followed by one line
+     per block of the file with its weak and strong checksums in hex.
+     The weak one is an Adler-32, which rolls along the data a byte at
+     a time, the strong one a 16 byte BLAKE2b. The last block may be
+     shorter.
+
+                 size 1048576\n
+                 block 4096\n
+                 <adler32> <blake2b>\n
+                 ...
+
+
+                              DELTA BODY
+
+     The digest of the new file and the block size, then instructions
+     to rebuild it: copying `count` blocks of the old file from block
+     `index` on, or taking `length` bytes of literal data that follow.
+
+                 sha256 <digest>\n
+                 block 4096\n
+                 B <index> <count>\n
+                 L <length>\n<data>
+                 ...
+"""
+
+# Bounds of the block size, which grows with the square root of
+# the file size to keep signatures short for large files.
+MIN_BLOCK_SIZE = 1 << 11
+MAX_BLOCK_SIZE = 1 << 17
+
+STRONG_SIZE = 16
+
+# Modulus of Adler-32.
+ADLER_MOD = 65521
+
+# Bytes copied at a time out of the old file.
+COPY_SIZE = 1 << 16
+
+# Longest instruction line accepted.
+MAX_LINE_SIZE = 256
+
+
+def block_size_for(size: int) -> int:
+    return min(max(isqrt(size), MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+
+def strong_of(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def signature_of(file: BinaryIO) -> bytes:
+    """
+    Returns the signature of `file`, read from its start.
+    """
+    size = file.seek(0, os.SEEK_END)
+    block_size = block_size_for(size)
+    lines = [f"size {size}", f"block {block_size}"]
+    file.seek(0)
+    while block := file.read(block_size):
+        lines.append(f"{zlib.adler32(block):08x} {strong_of(block).hex()}")
+
+    return "\n".join(lines).encode()
+
+
+class Signature:
+    """
+    Block checksums of the server's copy of a file, looked up by the
+    weak checksum first.
+    """
+
+    def __init__(self, size: int, block_size: int, blocks: list[tuple[int, bytes]]):
+        self._block_size = block_size
+        self._last_size = size - (len(blocks) - 1) * block_size
+        self._blocks = blocks
+        self._weak: dict[int, list[int]] = {}
+        for i, (weak, _) in enumerate(blocks):
+            self._weak.setdefault(weak, []).append(i)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Signature:
+        lines = data.decode().splitlines()
+        size = int(lines[0].split(" ", 1)[1])
+        block_size = int(lines[1].split(" ", 1)[1])
+        blocks = []
+        for line in lines[2:]:
+            weak, strong = line.split(" ")
+            blocks.append((int(weak, 16), bytes.fromhex(strong)))
+
+        return cls(size, block_size, blocks)
+
+    def block_size(self) -> int:
+        return self._block_size
+
+    def weak_sums(self) -> Collection[int]:
+        """
+        Returns the weak checksums of the blocks, to rule out most
+        offsets without a call to `find`.
+        """
+        return self._weak.keys()
+
+    def find(self, weak: int, data: mmap.mmap, start: int, end: int) -> Optional[int]:
+        """
+        Returns the index of a block whose checksums match `data` from
+        `start` to `end`, if any. Only a weak match takes a copy of it.
+        """
+        candidates = self._weak.get(weak)
+        if candidates is None:
+            return None
+
+        strong = strong_of(data[start:end])
+        for i in candidates:
+            size = self._block_size if i < len(self._blocks) - 1 else self._last_size
+            if self._blocks[i][1] == strong and end - start == size:
+                return i
+
+        return None
+
+
+def delta_ops(data: mmap.mmap, sig: Signature) -> list[tuple[str, int, int]]:
+    """
+    Matches the blocks of `sig` against `data`, rolling the weak checksum
+    a byte at a time past what does not match. Returns `("B", index,
+    count)` for runs of blocks and `("L", offset, length)` for literal
+    data of `data`.
+    """
+    ops = []
+    size = len(data)
+    block = sig.block_size()
+    lit = 0
+
+    def flush(end: int):
+        if end > lit:
+            ops.append(("L", lit, end - lit))
+
+    def copy(index: int):
+        if ops and ops[-1][0] == "B" and ops[-1][1] + ops[-1][2] == index:
+            ops[-1] = ("B", ops[-1][1], ops[-1][2] + 1)
+        else:
+            ops.append(("B", index, 1))
+
+    weak_sums = sig.weak_sums()
+    i = 0
+    if size >= block:
+        weak = zlib.adler32(data[:block])
+        a, b = weak & 0xffff, weak >> 16
+
+    while i + block <= size:
+        weak = (b << 16) | a
+        index = sig.find(weak, data, i, i + block) if weak in weak_sums else None
+        if index is not None:
+            flush(i)
+            copy(index)
+            i += block
+            lit = i
+            if i + block <= size:
+                weak = zlib.adler32(data[i:i + block])
+                a, b = weak & 0xffff, weak >> 16
+            continue
+
+        if i + block < size:
+            out, new = data[i], data[i + block]
+            a = (a - out + new) % ADLER_MOD
+            b = (b - block * out + a - 1) % ADLER_MOD
+
+        i += 1
+
+    # A shorter last block only matches the end of the data.
+    tail = size - lit
+    if 0 < tail < block:
+        index = sig.find(zlib.adler32(data[lit:]), data, lit, size)
+        if index is not None:
+            copy(index)
+            return ops
+
+    flush(size)
+    return ops
+
+
+class DeltaReader:
+    """
+    Reads the body of a DELTA for `data` out of its instructions.
+    """
+
+    def __init__(self, data: mmap.mmap, sha256: str, block_size: int, ops: list[tuple[str, int, int]]):
+        self._data = data
+        self._ops = iter(ops)
+        self._buf = bytearray(f"sha256 {sha256}\nblock {block_size}\n".encode())
+        self._lit: Optional[tuple[int, int]] = None
+
+    def read(self, size: int) -> bytes:
+        while len(self._buf) < size:
+            if self._lit is not None:
+                offset, length = self._lit
+                take = min(size - len(self._buf), length)
+                self._buf += self._data[offset:offset + take]
+                self._lit = (offset + take, length - take) if take < length else None
+                continue
+
+            op = next(self._ops, None)
+            if op is None:
+                break
+
+            kind, x, y = op
+            if kind == "B":
+                self._buf += f"B {x} {y}\n".encode()
+            else:
+                self._buf += f"L {y}\n".encode()
+                self._lit = (x, y)
+
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+
+class DeltaUpload:
+    """
+    Receives the body of a DELTA, rebuilding the file into a spool out
+    of its old copy and the literal data. Errors are reported once the
+    transfer is over.
+    """
+
+    def __init__(self, base: BinaryIO, spool: FileSpool):
+        self._base = base
+        self._spool = spool
+        self._digest = hashlib.sha256()
+        self._sha256: Optional[str] = None
+        self._block_size: Optional[int] = None
+        self._buf = bytearray()
+        self._literal = 0
+        self._error: Optional[Exception] = None
+
+    def _emit(self, data: bytes):
+        self._spool.write(data)
+        self._digest.update(data)
+
+    def _copy(self, index: int, count: int):
+        if self._block_size is None:
+            raise ValueError("The delta lacks the block size")
+
+        self._base.seek(index * self._block_size)
+        left = count * self._block_size
+        while left > 0 and (data := self._base.read(min(left, COPY_SIZE))):
+            self._emit(data)
+            left -= len(data)
+
+    def _run(self, line: str):
+        match line.split(" "):
+            case ["sha256", digest]:
+                self._sha256 = digest
+            case ["block", size]:
+                self._block_size = int(size)
+            case ["B", index, count]:
+                self._copy(int(index), int(count))
+            case ["L", length]:
+                self._literal = int(length)
+            case _:
+                raise ValueError(f"Invalid delta instruction {line}")
+
+    def write(self, data: bytes) -> int:
+        if self._error is not None:
+            return len(data)
+
+        self._buf += data
+        try:
+            while self._buf:
+                if self._literal > 0:
+                    take = min(len(self._buf), self._literal)
+                    self._emit(bytes(self._buf[:take]))
+                    del self._buf[:take]
+                    self._literal -= take
+                    continue
+
+                nl = self._buf.find(b"\n")
+                if nl == -1:
+                    if len(self._buf) > MAX_LINE_SIZE:
+                        raise ValueError("The delta instruction is too long")
+                    break
+
+                line = self._buf[:nl].decode()
+                del self._buf[:nl + 1]
+                self._run(line)
+        except (ValueError, OSError) as e:
+            self._error = e
+
+        return len(data)
+
+    def commit(self):
+        """
+        Moves the rebuilt file into place, raising `ValueError` if the
+        delta was malformed or the result does not match its digest.
+        """
+        self._base.close()
+        try:
+            if self._error is not None:
+                raise self._error
+
+            if self._literal > 0 or self._buf:
+                raise ValueError("The delta was cut short")
+
+            if self._digest.hexdigest() != self._sha256:
+                raise ValueError("The file does not match its digest")
+        except (ValueError, OSError):
+            self._spool.discard()
+            raise
+
+        self._spool.commit()
+
+    def discard(self):
+        self._base.close()
+        self._spool.discard()
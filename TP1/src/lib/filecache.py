@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+import os
+
+# Files larger than this fraction of the budget are never cached,
+# so that a single one cannot flush every other.
+MAX_ENTRY_FRACTION = 4
+
+
+class FileCache:
+    """
+    Contents of recently downloaded files, up to `budget` bytes in all,
+    evicting the least recently used first. Entries are checked against
+    the size, modification time and inode of their file on every lookup,
+    so replaced or modified files are read again. Files too large to
+    ever be cached bypass it and are only counted apart from the hits
+    and misses. Shared by every handler thread.
+    """
+
+    def __init__(self, budget: int):
+        self._budget = budget
+        self._size = 0
+        self._entries: OrderedDict[str, tuple[tuple[int, int, int], bytes]] = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._bypassed = 0
+
+    def _version(self, st: os.stat_result) -> tuple[int, int, int]:
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def _drop(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def get(self, path: str) -> Optional[bytes]:
+        """
+        Returns the contents of the file at `path`, reading them if they
+        are not cached, or `None` if the file is too large to be cached.
+        Raises `OSError` if the file cannot be read.
+        """
+        version = self._version(os.stat(path))
+        if version[0] > self._budget // MAX_ENTRY_FRACTION:
+            with self._lock:
+                self._bypassed += 1
+                # It may have been small enough before growing.
+                self._drop(path)
+
+            return None
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(path)
+                self._hits += 1
+                return entry[1]
+
+            self._misses += 1
+
+        with open(path, "rb") as f:
+            # What was read belongs to the file as it was when opened.
+            version = self._version(os.fstat(f.fileno()))
+            data = f.read()
+
+        with self._lock:
+            self._drop(path)
+            self._entries[path] = version, data
+            self._size += len(data)
+            while self._size > self._budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+        return data
+
+    def hits(self) -> int:
+        return self._hits
+
+    def misses(self) -> int:
+        return self._misses
+
+    def bypassed(self) -> int:
+        """
+        Returns how many lookups were for files too large to be cached.
+        """
+        return self._bypassed
+
+    def size(self) -> int:
+        """
+        Returns how many bytes of file contents are cached.
+        """
+        return self._size
+
+    def __str__(self) -> str:
+        with self._lock:
+            lookups = self._hits + self._misses
+            ratio = self._hits / lookups if lookups else 0
+            return f"{self._hits} hits, {self._misses} misses ({ratio:.0%}), {self._bypassed} bypassed, " \
+                   f"{len(self._entries)} files, {self._size}/{self._budget} bytes"
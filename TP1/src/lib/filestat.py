@@ -0,0 +1,62 @@
+from __future__ import annotations
+from .spool import partial_path, sha256_of
+from typing import Optional
+import os
+
+
+class FileStat:
+    """
+    What a STAT request answers about a file: its size and checksum if
+    it exists, and how many bytes of an interrupted upload of it are
+    kept. Encoded as one `key value` line per field.
+    """
+
+    def __init__(self, size: Optional[int], sha256: Optional[str], partial: int):
+        self._size = size
+        self._sha256 = sha256
+        self._partial = partial
+
+    @classmethod
+    def of(cls, path: str) -> FileStat:
+        """
+        Looks up the file at `path`, raising `FileNotFoundError` if
+        neither it nor an interrupted upload of it exist.
+        """
+        size = sha256 = None
+        if os.path.isfile(path):
+            size = os.path.getsize(path)
+            sha256 = sha256_of(path)
+
+        try:
+            partial = os.path.getsize(partial_path(path))
+        except FileNotFoundError:
+            if size is None:
+                raise
+
+            partial = 0
+
+        return cls(size, sha256, partial)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> FileStat:
+        fields = dict(line.split(" ", 1) for line in data.decode().splitlines() if " " in line)
+        size = int(fields["size"]) if "size" in fields else None
+        return cls(size, fields.get("sha256"), int(fields.get("partial", 0)))
+
+    def encode(self) -> bytes:
+        lines = []
+        if self._size is not None:
+            lines.append(f"size {self._size}")
+            lines.append(f"sha256 {self._sha256}")
+
+        lines.append(f"partial {self._partial}")
+        return "\n".join(lines).encode()
+
+    def size(self) -> Optional[int]:
+        return self._size
+
+    def sha256(self) -> Optional[str]:
+        return self._sha256
+
+    def partial(self) -> int:
+        return self._partial
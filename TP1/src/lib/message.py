@@ -1,5 +1,8 @@
 from __future__ import annotations
+from .codec import Codec, CompressReader, DecompressWriter
+from typing import BinaryIO, Callable, Optional
 from enum import Enum
+import re
 
 """
                        UPLOAD                        DOWNLOAD
@@ -11,14 +14,80 @@ from enum import Enum
                          OK                           ERROR
 
                  OK /file_name\ndata           ERR /file_name\ndata
+
+
+                              SESSIONS
+
+     A client may send many requests over the same connection, one
+     at a time. Each one may carry an ID after its method, which the
+     response echoes so that both can be matched.
+
+                 UP#7 /file_name\ndata          OK#7 /file_name\n
+
+
+                          RANGES AND STAT
+
+     UP and DOWN may carry a range after the method and the ID, an
+     offset and optionally a length, which the response echoes. A
+     ranged UP continues an interrupted upload of the file, a ranged
+     DOWN only sends the given bytes. A ranged UP with a length is a
+     stripe, written in place into the interrupted upload so that many
+     connections can fill it at once. STAT answers with the size and
+     checksum of the file and of its interrupted upload, if any.
+
+                 DOWN@1024+4096 /file_name\n    OK@1024+4096 /file_name\ndata
+                 STAT /file_name\n              OK /file_name\nsize 8192\n...
+
+
+                            COMPRESSION
+
+     A message may name a codec last in its method field, that its
+     data is compressed with. In a DOWN it is the codec the response
+     may be compressed with, which the server only does if the file
+     seems to shrink.
+
+                 UP~zlib /file_name\nzdata     DOWN~lzma /file_name\n
+                                                OK~lzma /file_name\nxzdata
+
+
+                           DEDUPLICATION
+
+     HAVE carries the digests of the chunks of a file, one per line,
+     and the server answers with those it does not have. PUT uploads
+     the file as a manifest of its chunks along with the data of the
+     missing ones, see `lib/chunks.py`.
+
+                 HAVE /file_name\ndigests      OK /file_name\ndigests
+                 PUT /file_name\nmanifest      OK /file_name\n
+
+
+                            DELTA UPLOADS
+
+     SIGS asks for the block signatures of the server's copy of a file.
+     DELTA uploads a new version of it as copies of those blocks and
+     literal data, see `lib/delta.py`.
+
+                 SIGS /file_name\n             OK /file_name\nsignatures
+                 DELTA /file_name\ndelta       OK /file_name\n
 """
 
+# Longest first line accepted before giving up on a message.
+MAX_HEAD_SIZE = 4096
+
+# METHOD[#ID][@OFFSET[+LENGTH]][~CODEC]
+METHOD_FIELD = re.compile(r"([A-Z]+)(?:#(\d+))?(?:@(\d+)(?:\+(\d+))?)?(?:~([a-z]+\d?))?")
+
 
 class Method(Enum):
     UPLOAD = 0
     DOWNLOAD = 1
     ERROR = 2
     OK = 3
+    STAT = 4
+    HAVE = 5
+    PUT = 6
+    SIGS = 7
+    DELTA = 8
 
     @classmethod
     def from_str(cls, s: str) -> Method:
@@ -31,6 +100,16 @@ class Method(Enum):
                 return cls.OK
             case "ERR":
                 return cls.ERROR
+            case "STAT":
+                return cls.STAT
+            case "HAVE":
+                return cls.HAVE
+            case "PUT":
+                return cls.PUT
+            case "SIGS":
+                return cls.SIGS
+            case "DELTA":
+                return cls.DELTA
             case _:
                 raise ValueError("Invalid method field")
 
@@ -44,6 +123,16 @@ class Method(Enum):
                 return "ERR"
             case Method.OK:
                 return "OK"
+            case Method.STAT:
+                return "STAT"
+            case Method.HAVE:
+                return "HAVE"
+            case Method.PUT:
+                return "PUT"
+            case Method.SIGS:
+                return "SIGS"
+            case Method.DELTA:
+                return "DELTA"
 
     def encode(self) -> bytes:
         return str(self).encode()
@@ -54,6 +143,9 @@ class MessageBuilder:
         self._method = Method.DOWNLOAD
         self._path = "/"
         self._data = bytes()
+        self._id = None
+        self._range = None
+        self._codec = None
 
     def method(self, value: Method) -> MessageBuilder:
         self._method = value
@@ -70,28 +162,61 @@ class MessageBuilder:
         self._data = value
         return self
 
+    def id(self, value: Optional[int]) -> MessageBuilder:
+        self._id = value
+        return self
+
+    def range(self, value: Optional[tuple[int, Optional[int]]]) -> MessageBuilder:
+        self._range = value
+        return self
+
+    def codec(self, value: Optional[Codec]) -> MessageBuilder:
+        self._codec = value
+        return self
+
     def build(self) -> Message:
-        return Message(self._method, self._path, self._data)
+        return Message(self._method, self._path, self._data, self._id, self._range, self._codec)
 
 
 class Message:
-    def __init__(self, method: Method, path: str, data: bytes):
+    def __init__(self, method: Method, path: str, data: bytes, req_id: Optional[int] = None,
+                 range: Optional[tuple[int, Optional[int]]] = None, codec: Optional[Codec] = None):
         self._method = method
         self._path = path
         self._data = data
+        self._id = req_id
+        self._range = range
+        self._codec = codec
 
     @classmethod
     def from_bytes(cls, data: bytes) -> Message:
         method_len = data.index(b" ")
-        method = data[:method_len].decode()
+        field = METHOD_FIELD.fullmatch(data[:method_len].decode())
+        if field is None:
+            raise ValueError("Invalid method field")
+
+        method, req_id, offset, length, codec = field.groups()
+        method = Method.from_str(method)
         nl = data.index(b"\n")
         path = data[method_len + 1:nl].decode()
         data = data[nl + 1:]
 
-        return cls.builder()                 \
-            .method(Method.from_str(method)) \
-            .path(path)                      \
-            .data(data)                      \
+        range = None
+        if offset is not None:
+            range = int(offset), int(length) if length is not None else None
+
+        if codec is not None:
+            codec = Codec.from_str(codec)
+            if method != Method.DOWNLOAD and data:
+                data = codec.decompress(data)
+
+        return cls.builder()                     \
+            .method(method)                      \
+            .path(path)                          \
+            .data(data)                          \
+            .id(int(req_id) if req_id else None) \
+            .range(range)                        \
+            .codec(codec)                        \
             .build()
 
     @classmethod
@@ -99,34 +224,90 @@ class Message:
         return MessageBuilder()
 
     @classmethod
-    def upload(cls, path: str, data: bytes) -> Message:
+    def upload(cls, path: str, data: bytes, req_id: Optional[int] = None,
+               range: Optional[tuple[int, Optional[int]]] = None, codec: Optional[Codec] = None) -> Message:
         return cls.builder()       \
             .method(Method.UPLOAD) \
             .path(path)            \
             .data(data)            \
+            .id(req_id)            \
+            .range(range)          \
+            .codec(codec)          \
             .build()
 
     @classmethod
-    def download(cls, path: str) -> Message:
+    def download(cls, path: str, req_id: Optional[int] = None,
+                 range: Optional[tuple[int, Optional[int]]] = None, codec: Optional[Codec] = None) -> Message:
         return cls.builder()         \
             .method(Method.DOWNLOAD) \
             .path(path)              \
+            .id(req_id)              \
+            .range(range)            \
+            .codec(codec)            \
+            .build()
+
+    @classmethod
+    def stat(cls, path: str, req_id: Optional[int] = None) -> Message:
+        return cls.builder()     \
+            .method(Method.STAT) \
+            .path(path)          \
+            .id(req_id)          \
+            .build()
+
+    @classmethod
+    def have(cls, path: str, data: bytes, req_id: Optional[int] = None) -> Message:
+        return cls.builder()     \
+            .method(Method.HAVE) \
+            .path(path)          \
+            .data(data)          \
+            .id(req_id)          \
             .build()
 
     @classmethod
-    def ok(cls, path: str, data: bytes) -> Message:
+    def put(cls, path: str, req_id: Optional[int] = None, codec: Optional[Codec] = None) -> Message:
+        return cls.builder()    \
+            .method(Method.PUT) \
+            .path(path)         \
+            .id(req_id)         \
+            .codec(codec)       \
+            .build()
+
+    @classmethod
+    def sigs(cls, path: str, req_id: Optional[int] = None) -> Message:
+        return cls.builder()     \
+            .method(Method.SIGS) \
+            .path(path)          \
+            .id(req_id)          \
+            .build()
+
+    @classmethod
+    def delta(cls, path: str, req_id: Optional[int] = None, codec: Optional[Codec] = None) -> Message:
+        return cls.builder()      \
+            .method(Method.DELTA) \
+            .path(path)           \
+            .id(req_id)           \
+            .codec(codec)         \
+            .build()
+
+    @classmethod
+    def ok(cls, path: str, data: bytes, req_id: Optional[int] = None,
+           range: Optional[tuple[int, Optional[int]]] = None, codec: Optional[Codec] = None) -> Message:
         return cls.builder()   \
             .method(Method.OK) \
             .path(path)        \
             .data(data)        \
+            .id(req_id)        \
+            .range(range)      \
+            .codec(codec)      \
             .build()
 
     @classmethod
-    def error(cls, path: str, data: bytes) -> Message:
+    def error(cls, path: str, data: bytes, req_id: Optional[int] = None) -> Message:
         return cls.builder()      \
             .method(Method.ERROR) \
             .path(path)           \
             .data(data)           \
+            .id(req_id)           \
             .build()
 
     def is_upload(self) -> bool:
@@ -141,18 +322,177 @@ class Message:
     def is_error(self) -> bool:
         return self._method == Method.ERROR
 
+    def is_stat(self) -> bool:
+        return self._method == Method.STAT
+
+    def is_have(self) -> bool:
+        return self._method == Method.HAVE
+
+    def is_put(self) -> bool:
+        return self._method == Method.PUT
+
+    def is_sigs(self) -> bool:
+        return self._method == Method.SIGS
+
+    def is_delta(self) -> bool:
+        return self._method == Method.DELTA
+
     def path(self) -> str:
         return self._path
 
+    def id(self) -> Optional[int]:
+        return self._id
+
+    def range(self) -> Optional[tuple[int, Optional[int]]]:
+        """
+        Returns the offset and length, `None` up to the end of the
+        file, the message is restricted to, if any.
+        """
+        return self._range
+
+    def offset(self) -> int:
+        return 0 if self._range is None else self._range[0]
+
+    def codec(self) -> Optional[Codec]:
+        return self._codec
+
+    def _compressed(self) -> bool:
+        return self._codec is not None and self._method != Method.DOWNLOAD
+
     def unwrap(self) -> bytes:
         return self._data
 
+    def _method_field(self) -> bytes:
+        method = self._method.encode()
+        if self._id is not None:
+            method += b"#" + str(self._id).encode()
+        if self._range is not None:
+            offset, length = self._range
+            method += b"@" + str(offset).encode()
+            if length is not None:
+                method += b"+" + str(length).encode()
+        if self._codec is not None:
+            method += b"~" + str(self._codec).encode()
+
+        return method
+
+    def _head(self) -> bytes:
+        return self._method_field() + b" " + self._path.encode() + b"\n"
+
     def encode(self) -> bytes:
         """
         Turns the message into bytes
         """
-        path = self._path.encode()
-        return self._method.encode() + b" " + path + b"\n" + self._data
+        if self._compressed():
+            return self._head() + self._codec.compress(self._data)
+
+        return self._head() + self._data
+
+    def reader(self, body: Optional[BinaryIO] = None) -> MessageReader:
+        """
+        Returns a file object which reads the encoded message followed
+        by the contents of `body`, if given, compressing them as they
+        are read if the message has a codec.
+        """
+        if self._compressed():
+            return MessageReader(self._head(), CompressReader(MessageReader(self._data, body), self._codec))
+
+        return MessageReader(self.encode(), body)
 
     def __str__(self) -> str:
-        return f"{self._method} {self._path} {len(self._data)}"
+        return f"{self._method_field().decode()} {self._path} {len(self._data)}"
+
+
+class MessageReader:
+    """
+    Reads an encoded message whose data continues in a file object,
+    so that it never has to be loaded whole.
+    """
+
+    def __init__(self, head: bytes, body: Optional[BinaryIO] = None):
+        self._head = memoryview(head)
+        self._body = body
+
+    def read(self, size: int) -> bytes:
+        if not self._head and self._body is not None:
+            # Past the head, hand out whatever the body does, which
+            # may be a view into it.
+            return self._body.read(size)
+
+        data = bytes(self._head[:size])
+        self._head = self._head[size:]
+        if len(data) < size and self._body is not None:
+            data += self._body.read(size - len(data))
+
+        return data
+
+
+class Discard:
+    """
+    File object which drops everything written to it.
+    """
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+
+class MessageWriter:
+    """
+    Parses a message as its bytes are written. Once the first line is
+    complete `open_sink` is called with the message, without data, and
+    everything that follows is written to the file object it returns,
+    decompressed if the message has a codec. Malformed messages are
+    discarded and leave `message` as `None`.
+    """
+
+    def __init__(self, open_sink: Callable[[Message], BinaryIO]):
+        self._open_sink = open_sink
+        self._head = bytearray()
+        self._msg = None
+        self._sink = None
+        self._decoder: Optional[DecompressWriter] = None
+
+    def write(self, data: bytes) -> int:
+        if self._decoder is not None:
+            self._decoder.write(data)
+            return len(data)
+
+        if self._sink is not None:
+            self._sink.write(data)
+            return len(data)
+
+        self._head.extend(data)
+        nl = self._head.find(b"\n")
+        if nl == -1:
+            if len(self._head) > MAX_HEAD_SIZE:
+                self._sink = Discard()
+            return len(data)
+
+        try:
+            self._msg = Message.from_bytes(bytes(self._head[:nl + 1]))
+        except (ValueError, IndexError):
+            self._sink = Discard()
+            return len(data)
+
+        self._sink = self._open_sink(self._msg)
+        if self._msg.codec() is not None and not self._msg.is_download():
+            self._decoder = DecompressWriter(self._sink, self._msg.codec())
+
+        rest = bytes(self._head[nl + 1:])
+        self._head = bytearray()
+        self.write(rest)
+        return len(data)
+
+    def finish(self):
+        """
+        Called once the whole message was written, raises `ValueError`
+        if its compressed data was corrupt or cut short.
+        """
+        if self._decoder is not None:
+            self._decoder.finish()
+
+    def message(self) -> Optional[Message]:
+        return self._msg
+
+    def sink(self) -> Optional[BinaryIO]:
+        return self._sink
@@ -0,0 +1,248 @@
+from __future__ import annotations
+from .segment import Segment, MAX_SEG_SIZE
+from socket import AF_INET
+from .connection import Connection, Step, T
+from .log.verbose import VerboseLogger
+from typing import AsyncIterator, BinaryIO, Callable, Optional
+from .log.quiet import QuietLogger
+from .cc.controller import CongestionController
+from .cc.reno import RenoController
+from .sender import DUP_THRESH
+from .endpoint import dont_fragment
+from functools import partial
+import asyncio
+
+# Datagrams queued on an endpoint before new ones are dropped,
+# playing the part of the kernel's socket receive buffer.
+MAX_QUEUED_DATAGRAMS = 4096
+
+
+class RdpProtocol(asyncio.DatagramProtocol):
+    """
+    Queues the datagrams that arrive to an endpoint so that the
+    RDP state machine can await them.
+    """
+
+    def __init__(self):
+        self._transport = None
+        self._queue = asyncio.Queue(MAX_QUEUED_DATAGRAMS)
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]):
+        try:
+            self._queue.put_nowait((data, addr))
+        except asyncio.QueueFull:
+            pass
+
+    def error_received(self, exc: Exception):
+        pass
+
+    def sendto(self, data: bytes, addr: tuple[str, int]):
+        self._transport.sendto(data, addr)
+
+    def sendseg(self, seg: Segment, addr: tuple[str, int]):
+        # Transports only take whole datagrams.
+        self._transport.sendto(seg.encode(), addr)
+
+    def sendsegs(self, segs: list[Segment], addr: tuple[str, int]):
+        for seg in segs:
+            self.sendseg(seg, addr)
+
+    async def recvfrom(self, timeout: Optional[float] = None) -> tuple[bytes, tuple[str, int]]:
+        """
+        Waits for the next datagram, raising `TimeoutError` after `timeout`
+        seconds if it is not `None`.
+        """
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError as e:
+            # Only an alias of `TimeoutError` from Python 3.11 on.
+            raise TimeoutError("timed out") from e
+
+    def dont_fragment(self):
+        dont_fragment(self._transport.get_extra_info("socket"))
+
+    def addr(self) -> tuple[str, int]:
+        return self._transport.get_extra_info("sockname")
+
+    def close(self):
+        self._transport.close()
+
+
+async def open_endpoint(addr: Optional[tuple[str, int]] = None, reuseport: bool = False) -> RdpProtocol:
+    """
+    Creates a new UDP endpoint on the running loop, bound to `addr` if given.
+    """
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_datagram_endpoint(
+        RdpProtocol, local_addr=addr, family=AF_INET, reuse_port=reuseport)
+    return protocol
+
+
+class AsyncRdpStream(Connection):
+    """
+    asyncio counterpart of `RdpStream`. Both run the same steps of the
+    protocol, only the way of waiting for datagrams differs.
+    """
+
+    @classmethod
+    async def connect(cls, ip: str, port: int, log: bool = False, mss: int = MAX_SEG_SIZE,
+                      probe: bool = False, isn: Optional[int] = None, winsize: int = 1,
+                      early_data: Optional[bytes] = None,
+                      cc: Callable[[], CongestionController] = RenoController) -> AsyncRdpStream:
+        """
+        Establishes a new connection to a RdpListener or AsyncRdpListener,
+        sizing segments, numbering them, announcing the receive window,
+        sending early data and controlling congestion as `RdpStream.connect`
+        does.
+        """
+        self = cls(await open_endpoint(), (ip, port), log, mss=mss, probe=probe, winsize=winsize, cc=cc)
+        await self._run(self._connect(isn, early_data))
+        return self
+
+    async def _run(self, step: Step[T]) -> T:
+        """
+        Runs a step of the protocol, awaiting the endpoint whenever it
+        waits for a datagram.
+        """
+        try:
+            wait = next(step)
+            while True:
+                try:
+                    datagram = await self._endpoint.recvfrom(wait)
+                except TimeoutError as e:
+                    wait = step.throw(e)
+                else:
+                    wait = step.send(datagram)
+        except StopIteration as e:
+            return e.value
+
+    async def recv(self, winsize: int = 1, ackfreq: int = 1) -> bytes:
+        """
+        Waits for a whole message from the other end.
+        """
+        receiver = self._receiver(winsize, ackfreq)
+        await self._run(self._recv_with(receiver))
+        return receiver.data()
+
+    async def recv_into(self, writer: BinaryIO, winsize: int = 1, ackfreq: int = 1) -> int:
+        """
+        Like `recv`, but hands the message to `writer` as it arrives in
+        order. Returns how many bytes were written.
+        """
+        receiver = self._receiver(winsize, ackfreq, writer)
+        await self._run(self._recv_with(receiver))
+        return receiver.written()
+
+    async def send(self, data: bytes, winsize: int = 1, fastrtx: int = DUP_THRESH):
+        """
+        Sends the bytes in `data` to the other end.
+        """
+        segs = Segment.make_segments(data, self._seq_ofs, self._data_size)
+        await self._run(self._send_segs(segs, winsize, fastrtx))
+
+    async def send_stream(self, reader: BinaryIO, winsize: int = 1, fastrtx: int = DUP_THRESH):
+        """
+        Like `send`, but reads the message from `reader` as the window opens.
+        """
+        segs = Segment.read_segments(reader, self._seq_ofs, self._data_size)
+        await self._run(self._send_segs(segs, winsize, fastrtx))
+
+    async def close(self):
+        if self._closed:
+            return
+
+        await self._run(self._close())
+        self._release()
+
+
+class AsyncRdpListener:
+    """
+    asyncio counterpart of `RdpListener`. Handshakes run as their own
+    tasks, so a slow or lossy peer does not hold back the others.
+    """
+
+    def __init__(self, endpoint: RdpProtocol, log: bool,
+                 mss: int = MAX_SEG_SIZE, probe: bool = False, winsize: int = 1,
+                 cc: Callable[[], CongestionController] = RenoController):
+        self._log = VerboseLogger() if log else QuietLogger()
+        self._endpoint = endpoint
+        self._logging = log
+        self._mss = mss
+        self._probe = probe
+        self._winsize = winsize
+        self._cc = cc
+        self._conns = set()
+        self._accepted = asyncio.Queue()
+        self._handshakes = set()
+        self._reader = asyncio.create_task(self._read_syns())
+
+    @classmethod
+    async def bind(cls, ip: str, port: int, log: bool = False, reuseport: bool = False,
+                   mss: int = MAX_SEG_SIZE, probe: bool = False, winsize: int = 1,
+                   cc: Callable[[], CongestionController] = RenoController) -> AsyncRdpListener:
+        """
+        Creates a new `AsyncRdpListener` and binds it to the given address,
+        shared with other processes if `reuseport` is set. `mss`, `probe`,
+        `winsize` and `cc` work as in `RdpStream.connect`.
+        """
+        self = cls(await open_endpoint((ip, port), reuseport), log, mss, probe, winsize, cc)
+        self._log.awaiting_connections(self.addr())
+        return self
+
+    async def _read_syns(self):
+        while True:
+            # Wait for SYN segments for new connections
+            seg_bytes, peer_addr = await self._endpoint.recvfrom()
+            try:
+                seg = Segment.from_bytes(seg_bytes)
+            except ValueError:
+                continue
+
+            self._log.recv(seg)
+
+            if seg.is_syn() and peer_addr not in self._conns:
+                self._conns.add(peer_addr)
+                task = asyncio.create_task(self._handshake(peer_addr, seg))
+                self._handshakes.add(task)
+                task.add_done_callback(self._handshakes.discard)
+
+    async def _handshake(self, peer_addr: tuple[str, int], syn: Segment):
+        # Send SYNACK to peer from a new endpoint, the peer
+        # can connect again once this stream is closed.
+        forget = partial(self._conns.discard, peer_addr)
+        stream = AsyncRdpStream(await open_endpoint(), peer_addr, self._logging, forget, self._mss, self._probe,
+                                self._winsize, self._cc)
+        stream._accept_syn(syn)
+        if not await stream._run(stream._handshake()):
+            # The peer is gone, drop the half open connection.
+            stream._release()
+            return
+
+        self._log.connection_established(peer_addr)
+        await self._accepted.put(stream)
+
+    async def accept(self) -> AsyncRdpStream:
+        """
+        Waits until a new connection is established with this listener.
+        """
+        return await self._accepted.get()
+
+    async def __aiter__(self) -> AsyncIterator[AsyncRdpStream]:
+        """
+        Returns an iterator over incoming connections.
+        """
+        while True:
+            yield await self.accept()
+
+    def addr(self) -> tuple[str, int]:
+        return self._endpoint.addr()
+
+    def close(self):
+        self._reader.cancel()
+        for task in self._handshakes:
+            task.cancel()
+
+        self._endpoint.close()
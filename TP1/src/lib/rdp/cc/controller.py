@@ -0,0 +1,33 @@
+from abc import ABC, abstractmethod
+
+
+class CongestionController(ABC):
+    @abstractmethod
+    def on_ack(self, acked: int):
+        """
+        Called when `acked` segments have been newly acknowledged,
+        either cumulatively or selectively.
+        """
+        pass
+
+    @abstractmethod
+    def on_loss(self):
+        """
+        Called when a loss is inferred from the peer's feedback
+        while the connection keeps receiving acknowledgements.
+        """
+        pass
+
+    @abstractmethod
+    def on_timeout(self):
+        """
+        Called when a retransmission timer expires.
+        """
+        pass
+
+    @abstractmethod
+    def cwnd(self) -> int:
+        """
+        Returns the number of segments allowed to be in flight.
+        """
+        pass
@@ -0,0 +1,32 @@
+from .controller import CongestionController
+
+INITIAL_CWND = 2
+MIN_SSTHRESH = 2
+
+
+class RenoController(CongestionController):
+    """
+    Slow start followed by additive increase, multiplicative decrease.
+    """
+
+    def __init__(self):
+        self._cwnd = float(INITIAL_CWND)
+        self._ssthresh = float("inf")
+
+    def on_ack(self, acked: int):
+        for _ in range(acked):
+            if self._cwnd < self._ssthresh:
+                self._cwnd += 1
+            else:
+                self._cwnd += 1 / self._cwnd
+
+    def on_loss(self):
+        self._ssthresh = max(self._cwnd / 2, MIN_SSTHRESH)
+        self._cwnd = self._ssthresh
+
+    def on_timeout(self):
+        self._ssthresh = max(self._cwnd / 2, MIN_SSTHRESH)
+        self._cwnd = 1.0
+
+    def cwnd(self) -> int:
+        return max(int(self._cwnd), 1)
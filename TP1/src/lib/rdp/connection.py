@@ -0,0 +1,501 @@
+from __future__ import annotations
+from .segment import Segment, RDP_HEADER_SIZE, MAX_SEG_SIZE, MAX_SEQ_NUM, OPT_MSS, OPT_ISN, OPT_WND, \
+    OPT_DATA_ACK, MAX_OPT_SIZE
+from .log.verbose import VerboseLogger
+from typing import BinaryIO, Callable, Generator, Iterable, Optional, TypeVar
+from .log.quiet import QuietLogger
+from .cc.controller import CongestionController
+from .cc.reno import RenoController
+from .rto import RtoEstimator
+from .sender import Sender
+from .receiver import Receiver
+from .seq import seq_add, seq_lt
+from .mtu import MtuProber
+from random import randrange
+from time import time
+import errno
+
+"""
+                             DRIVING A CONNECTION
+
+     The steps of the protocol are generators which never touch the
+     socket to wait. Every time one needs a datagram it yields how long
+     to wait for it, `None` to wait for as long as it takes, and is sent
+     back the datagram along with the address it came from. Errors of
+     the wait, such as a `TimeoutError`, are thrown into it instead. The
+     value it returns is the result of the step. Sends never block and
+     go straight to the endpoint.
+
+                 step = self._recv_seg(rto)
+                 wait = next(step)
+                 while True:
+                     wait = step.send(endpoint.recvfrom(wait))
+                 ...
+                 StopIteration(value=seg)
+
+     `RdpStream` drives them with blocking calls and `AsyncRdpStream`
+     by awaiting, so both run the very same protocol.
+"""
+
+MAX_TIMEOUT_COUNT = 20
+
+T = TypeVar("T")
+
+# A step of the protocol, see above.
+Step = Generator[Optional[float], tuple[bytes, tuple[str, int]], T]
+
+
+class Hangup(Exception):
+    pass
+
+
+class Connection:
+    """
+    State of one end of a connection and the steps of the protocol on
+    it, shared by the blocking and the asyncio streams. `endpoint` only
+    has to send segments right away, receiving is up to the subclass
+    driving the steps. The congestion window is driven by the controller
+    `cc` makes.
+    """
+
+    def __init__(self, endpoint, peer_addr: tuple[str, int], log: bool,
+                 on_close: Optional[Callable[[], None]] = None,
+                 mss: int = MAX_SEG_SIZE, probe: bool = False, winsize: int = 1,
+                 cc: Callable[[], CongestionController] = RenoController):
+        self._log = VerboseLogger() if log else QuietLogger()
+        self._endpoint = endpoint
+        self._peer_addr = peer_addr
+        self._on_close = on_close
+        self._rto = RtoEstimator()
+        self._cc = cc()
+        self._mss = mss
+        self._probe = probe
+        self._mtu = MtuProber(MAX_SEG_SIZE, MAX_SEG_SIZE, False)
+        self._winsize = winsize
+        # The receive window of the other end, `None` if it does not advertise one.
+        self._peer_wnd = None
+        # The message which came along with the SYN, for the first `recv`.
+        self._early = None
+        self._early_accepted = False
+        # Repeated while replying to early data, until the other end is heard from.
+        self._synack = None
+        self._handshake_ack = Segment.ack_seg(0)
+        self._closed = False
+        self._seq_ofs = 0
+
+        if probe:
+            self._endpoint.dont_fragment()
+
+    def _connect(self, isn: Optional[int], early_data: Optional[bytes]) -> Step[None]:
+        """
+        Sends SYN segments until the SYNACK of the other end arrives,
+        along with `early_data` if it fits.
+        """
+        self._seq_ofs = randrange(MAX_SEQ_NUM) if isn is None else isn
+        if early_data is not None and len(early_data) > MAX_OPT_SIZE:
+            # Too large for a SYN, it has to be sent once connected.
+            early_data = None
+
+        syn_seg = Segment.syn_seg(self._syn_options(), early_data)
+        transmissions = 0
+
+        while True:
+            self._sendall(syn_seg)
+            sent_at = time()
+            transmissions += 1
+            try:
+                # Wait for SYNACK from the new connection.
+                seg_bytes, peer_addr = yield self._rto.rto()
+            except TimeoutError:
+                self._rto.backoff()
+                continue
+
+            try:
+                seg = Segment.from_bytes(seg_bytes)
+            except ValueError:
+                continue
+
+            self._log.recv(seg)
+
+            if seg.is_syn() and seg.is_ack():
+                if transmissions == 1:
+                    self._rto.sample(time() - sent_at)
+
+                self._peer_addr = peer_addr
+                options = seg.options()
+                self._negotiate(options)
+                if early_data is not None and options.get(OPT_DATA_ACK) == len(early_data):
+                    # The message took the first sequence number,
+                    # acknowledge it so the handshake ACK cannot be
+                    # mistaken for one of the reply.
+                    self._early_accepted = True
+                    self._handshake_ack = Segment.ack_seg(self._seq_ofs)
+                    self._advance_seq_ofs(1)
+                break
+
+        self._sendall(self._handshake_ack)
+        self._log.connection_established(peer_addr)
+
+    def _accept_syn(self, seg: Segment):
+        """
+        Takes the options and early data of the SYN which opened the
+        connection.
+        """
+        self._negotiate(seg.options())
+        self._early = seg.early_data()
+
+    def _handshake(self) -> Step[bool]:
+        """
+        Sends SYNACK segments to the peer until it gets acknowledged,
+        giving up after `MAX_TIMEOUT_COUNT` attempts. If the SYN carried
+        early data the connection is ready right away, so that its reply
+        follows the SYNACK. Duplicate SYNs only get the SYNACK repeated.
+        Returns whether the connection was established.
+        """
+        syn_ack_seg = Segment.syn_ack_seg(self._syn_options())
+        transmissions = 0
+
+        if self._early is not None:
+            self._synack = syn_ack_seg
+            self._sendall(syn_ack_seg)
+            return True
+
+        while transmissions < MAX_TIMEOUT_COUNT:
+            self._sendall(syn_ack_seg)
+            sent_at = time()
+            transmissions += 1
+            try:
+                # Wait to receive ACK of SYNACK
+                seg_bytes = yield from self._recv_from_peer(self._rto.rto())
+            except TimeoutError:
+                self._rto.backoff()
+                continue
+            except Hangup:
+                break
+
+            try:
+                seg = Segment.from_bytes(seg_bytes)
+            except ValueError:
+                continue
+
+            self._log.recv(seg)
+
+            if seg.is_ack() and seg.seq_num() == 0:
+                if transmissions == 1:
+                    self._rto.sample(time() - sent_at)
+
+                return True
+
+        return False
+
+    def _syn_options(self) -> dict[int, int]:
+        options = {OPT_MSS: self._mss, OPT_ISN: self._seq_ofs, OPT_WND: self._winsize}
+        if self._early is not None:
+            options[OPT_DATA_ACK] = len(self._early)
+
+        return options
+
+    def _negotiate(self, options: dict[int, int]):
+        """
+        Settles the segment size with the options of the other end's SYN
+        or SYNACK. Peers which send no options only take `MAX_SEG_SIZE`.
+        """
+        limit = min(self._mss, options.get(OPT_MSS, MAX_SEG_SIZE))
+        probing = self._probe and OPT_MSS in options
+        self._mtu = MtuProber(min(limit, MAX_SEG_SIZE), limit, probing)
+        self._seq_ofs = options.get(OPT_ISN, 0)
+        self._peer_wnd = options.get(OPT_WND)
+
+    def _take_early(self, receiver: Receiver):
+        """
+        Hands the message which came along with the SYN, if any, to
+        `receiver`. Its acknowledgement is left to the reply.
+        """
+        if self._early is None:
+            return
+
+        early_seg = Segment.builder() \
+            .lst(True)                \
+            .seq_num(self._seq_ofs)   \
+            .data(self._early)        \
+            .build()
+
+        self._early = None
+        receiver.on_segment(early_seg, time())
+        self._seq_ofs = receiver.seq_ofs()
+
+    def _data_size(self) -> int:
+        return self._mtu.size() - RDP_HEADER_SIZE
+
+    def _validate_open(self):
+        if self._closed:
+            raise Hangup("The socket has already been closed")
+
+    def _sendall(self, seg: Segment):
+        """
+        Sends the segment through the socket.
+        """
+        self._log.send(seg)
+        self._endpoint.sendseg(seg, self.peer_addr())
+
+    def _sendall_many(self, segs: list[Segment]):
+        """
+        Sends the segments through the socket, in as few calls as the
+        endpoint allows.
+        """
+        if not segs:
+            return
+
+        for seg in segs:
+            self._log.send(seg)
+
+        self._endpoint.sendsegs(segs, self.peer_addr())
+
+    def _send_probe(self, probe: Segment):
+        """
+        Sends a path MTU probe. One larger than the host is able to send
+        only lowers the upper bound of the sizes left to probe.
+        """
+        try:
+            self._sendall(probe)
+        except OSError as e:
+            if e.errno != errno.EMSGSIZE:
+                raise
+
+            self._mtu.on_too_big()
+
+    def _recv_from_peer(self, timeout: Optional[float] = None) -> Step[bytes]:
+        """
+        Waits up to `timeout` seconds in all for the next datagram from
+        our peer, dropping those from anyone else.
+        """
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            wait = None if deadline is None else deadline - time()
+            if wait is not None and wait <= 0:
+                raise TimeoutError("timed out")
+
+            try:
+                seg, addr = yield wait
+            except ConnectionAbortedError as e:
+                raise Hangup("The connection was dropped for being idle") from e
+
+            if self._peer_addr == addr:
+                return seg
+
+    def _recv_seg(self, timeout: Optional[float] = None, copy: bool = True) -> Step[Segment]:
+        """
+        Waits for a new segment from the other end. If a SYNACK segment
+        arrives will try and finish establishing the connection with the
+        other end. Without `copy` the data of the segment is only valid
+        until the next datagram is received. Datagrams which are not
+        segments are dropped.
+        """
+        while True:
+            try:
+                seg = Segment.from_bytes((yield from self._recv_from_peer(timeout)), copy)
+            except ValueError:
+                continue
+
+            self._log.recv(seg)
+
+            if seg.is_syn() and seg.is_ack():
+                # Our handshake ACK didn't reach
+                # the other side, resend and retry.
+                self._sendall(self._handshake_ack)
+                continue
+
+            if self._synack is not None:
+                if seg.is_syn():
+                    # The other end is still waiting for our SYNACK.
+                    self._sendall(self._synack)
+                    continue
+
+                self._synack = None
+
+            return seg
+
+    def _advance_seq_ofs(self, quantity: int):
+        self._seq_ofs = seq_add(self._seq_ofs, quantity)
+
+    def _receiver(self, winsize: int, ackfreq: int, writer: Optional[BinaryIO] = None) -> Receiver:
+        return Receiver(self._seq_ofs, winsize, ackfreq, writer, self._peer_wnd is not None)
+
+    def _recv_with(self, receiver: Receiver) -> Step[None]:
+        """
+        Receives a message into `receiver`. In-order segments are
+        acknowledged every `ackfreq` segments or after `ACK_DELAY`
+        seconds, while gaps, duplicates and the last segment are
+        acknowledged right away.
+        """
+        self._validate_open()
+        self._take_early(receiver)
+
+        while not receiver.done():
+            ack_seg = receiver.poll(time())
+            if ack_seg is not None:
+                self._sendall(ack_seg)
+
+            deadline = receiver.ack_deadline()
+            wait = None if deadline is None else deadline - time()
+            if wait is not None and wait <= 0:
+                continue
+
+            try:
+                seg = yield from self._recv_seg(wait, copy=False)
+            except TimeoutError:
+                continue
+
+            if seg.is_fin():
+                raise Hangup("The other end closed the connection")
+
+            if seg.is_ack() or seg.is_sac():
+                continue
+
+            ack_seg = receiver.on_segment(seg, time())
+            self._seq_ofs = receiver.seq_ofs()
+            if ack_seg is not None:
+                self._sendall(ack_seg)
+
+    def _send_segs(self, segs: Iterable[Segment], winsize: int, fastrtx: int) -> Step[None]:
+        """
+        Sends `segs` as a message. The amount of segments in flight is
+        driven by the congestion window and never exceeds `winsize`. A
+        segment is resent as soon as `fastrtx` segments after it are
+        known to have arrived.
+        """
+        self._validate_open()
+        sender = Sender(segs, self._seq_ofs, winsize, self._rto, self._cc, fastrtx, self._mtu, self._peer_wnd)
+
+        while True:
+            segs = sender.poll(time())
+            if segs and segs[-1].is_prb():
+                self._sendall_many(segs[:-1])
+                self._send_probe(segs[-1])
+            else:
+                self._sendall_many(segs)
+
+            # Only block until the earliest retransmission is due.
+            deadline = sender.next_deadline()
+            wait = self._rto.rto() if deadline is None else deadline - time()
+            if wait <= 0:
+                continue
+
+            try:
+                res = yield from self._recv_seg(wait)
+            except TimeoutError:
+                if self._synack is not None:
+                    self._sendall(self._synack)
+                continue
+
+            if res.is_ack() or res.is_sac():
+                self._advance_seq_ofs(sender.on_feedback(res, time()))
+                self._peer_wnd = sender.rwnd()
+                if sender.done():
+                    return
+
+            elif res.is_prb():
+                # A late probe from the last time the other side sent.
+                continue
+
+            elif res.is_fin():
+                raise Hangup("The other end closed the connection")
+
+            elif seq_lt(res.seq_num(), self._seq_ofs):
+                # The other side is still sending a data
+                # segment from a previous call to recv.
+                ack_seg = Segment.ack_seg(seq_add(self._seq_ofs, -1))
+                self._sendall(ack_seg)
+
+            else:
+                # We didn't receive their last ACK and
+                # are still trying to send the last segment.
+                self._advance_seq_ofs(sender.remaining())
+                return
+
+    def _close(self) -> Step[None]:
+        """
+        Sends FIN segments until the other end acknowledges one or
+        closes as well, giving up after `MAX_TIMEOUT_COUNT` timeouts
+        in a row.
+        """
+        fin_seg = Segment.fin_seg(self._seq_ofs)
+        timeouts = 0
+
+        while timeouts < MAX_TIMEOUT_COUNT:
+            self._sendall(fin_seg)
+
+            try:
+                # The timeout is not backed off here so that closing
+                # a connection with a dead peer stays bounded.
+                res = yield from self._recv_seg(self._rto.rto())
+                timeouts = 0
+            except TimeoutError:
+                timeouts += 1
+                continue
+            except Hangup:
+                break
+
+            if res.is_fin():
+                ack_seg = Segment.ack_seg(res.seq_num())
+                self._sendall(ack_seg)
+                break
+
+            if res.is_ack() and not res.is_prb() and res.seq_num() == fin_seg.seq_num():
+                break
+
+    def _release(self):
+        """
+        Frees the resources of the stream without talking to the peer.
+        """
+        self._closed = True
+        self._endpoint.close()
+        if self._on_close is not None:
+            self._on_close()
+
+    def rto(self) -> float:
+        """
+        Returns the current retransmission timeout of the connection.
+        """
+        return self._rto.rto()
+
+    def srtt(self) -> Optional[float]:
+        """
+        Returns the smoothed round trip time of the connection, or
+        `None` if no sample has been taken yet.
+        """
+        return self._rto.srtt()
+
+    def cwnd(self) -> int:
+        """
+        Returns the current congestion window of the connection in segments.
+        """
+        return self._cc.cwnd()
+
+    def peer_winsize(self) -> Optional[int]:
+        """
+        Returns the last receive window advertised by the other end, or
+        `None` if it does not advertise one.
+        """
+        return self._peer_wnd
+
+    def early_data_accepted(self) -> bool:
+        """
+        Returns whether the other end took the message sent along with
+        the SYN, so that it must not be sent again.
+        """
+        return self._early_accepted
+
+    def mss(self) -> int:
+        """
+        Returns the size of the segments sent, header included.
+        """
+        return self._mtu.size()
+
+    def addr(self) -> tuple[str, int]:
+        self._validate_open()
+        return self._endpoint.addr()
+
+    def peer_addr(self) -> tuple[str, int]:
+        self._validate_open()
+        return self._peer_addr
@@ -0,0 +1,206 @@
+from __future__ import annotations
+from socket import socket
+from .segment import Segment, MAX_SEG_SIZE, RDP_HEADER_SIZE
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+from typing import Optional
+from time import time
+
+MAX_CONNS = 1024
+MAX_QUEUED_SEGMENTS = 1024
+IDLE_TIMEOUT = 30.0
+REAP_INTERVAL = 1.0
+
+
+class DemuxEndpoint:
+    """
+    One connection multiplexed over the socket of a `ConnTable`. Sends go
+    straight to the shared socket while received datagrams are handed
+    over by the table's reader thread through a bounded queue.
+    """
+
+    def __init__(self, table: ConnTable, peer_addr: tuple[str, int]):
+        self._table = table
+        self._peer_addr = peer_addr
+        self._queue = Queue(MAX_QUEUED_SEGMENTS)
+        self._last_seen = time()
+        self._aborted = False
+        self._header = bytearray(RDP_HEADER_SIZE)
+
+    def _deliver(self, data: bytes, addr: tuple[str, int], now: float):
+        self._last_seen = now
+        try:
+            self._queue.put_nowait((data, addr))
+        except Full:
+            pass
+
+    def _abort(self):
+        """
+        Wakes up whoever is waiting on this endpoint so that it notices
+        the connection is gone.
+        """
+        self._aborted = True
+        while True:
+            try:
+                self._queue.put_nowait(None)
+                return
+            except Full:
+                try:
+                    self._queue.get_nowait()
+                except Empty:
+                    pass
+
+    def _idle_since(self) -> float:
+        return self._last_seen
+
+    def sendto(self, data: bytes, addr: tuple[str, int]):
+        self._table.sendto(data, addr)
+
+    def sendseg(self, seg: Segment, addr: tuple[str, int]):
+        seg.pack_header_into(self._header)
+        self._table.sendmsg([self._header, seg.unwrap()], addr)
+
+    def sendsegs(self, segs: list[Segment], addr: tuple[str, int]):
+        for seg in segs:
+            self.sendseg(seg, addr)
+
+    def recvfrom(self, timeout: Optional[float] = None) -> tuple[bytes, tuple[str, int]]:
+        """
+        Blocks until a datagram from the peer arrives, raising `socket.timeout`
+        after `timeout` seconds if it is not `None` and `ConnectionAbortedError`
+        if the connection was reaped.
+        """
+        if self._aborted:
+            raise ConnectionAbortedError("The connection was reaped")
+
+        try:
+            item = self._queue.get(timeout=timeout)
+        except Empty as e:
+            # `socket.timeout` is an alias of `TimeoutError`.
+            raise TimeoutError("timed out") from e
+
+        if item is None:
+            raise ConnectionAbortedError("The connection was reaped")
+
+        return item
+
+    def dont_fragment(self):
+        # The socket is shared, the listener sets it up for every peer.
+        pass
+
+    def addr(self) -> tuple[str, int]:
+        return self._table.addr()
+
+    def close(self):
+        self._table.remove(self._peer_addr, self)
+
+
+class ConnTable:
+    """
+    Demultiplexes every datagram arriving to one bound socket into the
+    `DemuxEndpoint` of its peer. A reader thread dispatches datagrams,
+    registers a new connection for every SYN from an unknown peer and
+    reaps the connections which stayed idle for `IDLE_TIMEOUT` seconds.
+    Anything else from an unknown peer, such as the next request of a
+    reaped connection, is answered with a FIN so that it gives up. At
+    most `MAX_CONNS` connections are kept at once. Datagrams larger
+    than `bufsize` are truncated.
+    """
+
+    def __init__(self, skt: socket, bufsize: int = MAX_SEG_SIZE):
+        self._skt = skt
+        self._bufsize = bufsize
+        self._addr = skt.getsockname()
+        self._conns = {}
+        self._lock = Lock()
+        self._new_conns = Queue(MAX_CONNS)
+        self._reader = Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        self._skt.settimeout(REAP_INTERVAL)
+        next_reap = time() + REAP_INTERVAL
+
+        while True:
+            try:
+                data, addr = self._skt.recvfrom(self._bufsize)
+            except TimeoutError:
+                pass
+            except OSError:
+                if self._skt.fileno() == -1:
+                    # The listener was closed.
+                    return
+            else:
+                try:
+                    self._dispatch(data, addr, time())
+                except Exception:
+                    # Drop the datagram, one bad peer must not stop
+                    # the reader every connection depends on.
+                    pass
+
+            now = time()
+            if now >= next_reap:
+                self._reap(now)
+                next_reap = now + REAP_INTERVAL
+
+    def _dispatch(self, data: bytes, addr: tuple[str, int], now: float):
+        with self._lock:
+            endpoint = self._conns.get(addr)
+            if endpoint is None:
+                try:
+                    seg = Segment.from_bytes(data)
+                except ValueError:
+                    return
+
+                if not seg.is_syn():
+                    self.sendto(Segment.fin_seg(seg.seq_num()).encode(), addr)
+                    return
+
+                if seg.is_ack() or len(self._conns) >= MAX_CONNS:
+                    return
+
+                endpoint = DemuxEndpoint(self, addr)
+                try:
+                    self._new_conns.put_nowait((endpoint, seg, addr))
+                except Full:
+                    # Too many connections waiting to be accepted,
+                    # the peer retries its SYN.
+                    return
+
+                self._conns[addr] = endpoint
+                return
+
+        endpoint._deliver(data, addr, now)
+
+    def _reap(self, now: float):
+        with self._lock:
+            idle = [addr for addr, endpoint in self._conns.items()
+                    if now - endpoint._idle_since() > IDLE_TIMEOUT]
+            endpoints = [self._conns.pop(addr) for addr in idle]
+
+        for endpoint in endpoints:
+            endpoint._abort()
+
+    def next_conn(self) -> tuple[DemuxEndpoint, Segment, tuple[str, int]]:
+        """
+        Blocks until a SYN from a new peer arrives, returning the endpoint
+        registered for it along with that SYN.
+        """
+        return self._new_conns.get()
+
+    def remove(self, addr: tuple[str, int], endpoint: DemuxEndpoint):
+        with self._lock:
+            if self._conns.get(addr) is endpoint:
+                del self._conns[addr]
+
+    def sendto(self, data: bytes, addr: tuple[str, int]):
+        self._skt.sendto(data, addr)
+
+    def sendmsg(self, buffers: list[bytes], addr: tuple[str, int]):
+        self._skt.sendmsg(buffers, [], 0, addr)
+
+    def addr(self) -> tuple[str, int]:
+        return self._addr
+
+    def __len__(self) -> int:
+        return len(self._conns)
@@ -0,0 +1,66 @@
+from socket import socket, AF_INET, SOCK_DGRAM, IPPROTO_IP
+from .segment import Segment, MAX_SEG_SIZE, RDP_HEADER_SIZE
+from typing import Optional
+import sys
+
+# Not exported by the socket module, values from <linux/in.h>.
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_PROBE = 3
+
+
+def dont_fragment(skt: socket):
+    """
+    Sets the DF bit on every datagram sent through `skt` and ignores the
+    kernel's path MTU cache, so that probes too large for the path get
+    dropped instead of fragmented. Only supported on Linux.
+    """
+    if sys.platform.startswith("linux"):
+        skt.setsockopt(IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+
+
+class UdpEndpoint:
+    """
+    A UDP socket owned by a single connection. Segments are sent with
+    their header and data as separate buffers and datagrams are read
+    into a buffer of the endpoint, so neither way copies the data.
+    Datagrams larger than `bufsize` are truncated.
+    """
+
+    def __init__(self, addr: Optional[tuple[str, int]] = None, bufsize: int = MAX_SEG_SIZE):
+        self._skt = socket(AF_INET, SOCK_DGRAM)
+        if addr is not None:
+            self._skt.bind(addr)
+
+        self._header = bytearray(RDP_HEADER_SIZE)
+        self._arena = bytearray(bufsize)
+        self._view = memoryview(self._arena)
+
+    def sendto(self, data: bytes, addr: tuple[str, int]):
+        self._skt.sendto(data, addr)
+
+    def sendseg(self, seg: Segment, addr: tuple[str, int]):
+        seg.pack_header_into(self._header)
+        self._skt.sendmsg([self._header, seg.unwrap()], [], 0, addr)
+
+    def sendsegs(self, segs: list[Segment], addr: tuple[str, int]):
+        for seg in segs:
+            self.sendseg(seg, addr)
+
+    def recvfrom(self, timeout: Optional[float] = None) -> tuple[memoryview, tuple[str, int]]:
+        """
+        Blocks until a datagram arrives, raising `socket.timeout` after
+        `timeout` seconds if it is not `None`. The returned view is only
+        valid until the next call.
+        """
+        self._skt.settimeout(timeout)
+        size, addr = self._skt.recvfrom_into(self._arena)
+        return self._view[:size], addr
+
+    def dont_fragment(self):
+        dont_fragment(self._skt)
+
+    def addr(self) -> tuple[str, int]:
+        return self._skt.getsockname()
+
+    def close(self):
+        self._skt.close()
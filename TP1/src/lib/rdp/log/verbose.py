@@ -10,9 +10,13 @@ class VerboseLogger(Logger):
 
     def _seg_kind(self, seg) -> str:
         kind = ""
+        if seg.is_prb():
+            return "PRBACK" if seg.is_ack() else "PRB"
         if seg.is_syn():
             kind += "SYN"
-        if seg.is_ack():
+        if seg.is_ack() and seg.is_sac():
+            kind += "SACK"
+        elif seg.is_ack():
             kind += "ACK"
         elif seg.is_fin():
             kind += "FIN"
@@ -23,10 +27,21 @@ class VerboseLogger(Logger):
 
         return kind
 
+    def _seg_blocks(self, seg) -> str:
+        if not (seg.is_ack() and seg.is_sac()):
+            return ""
+
+        blocks = ", ".join(f"{first}-{last}" for first, last in seg.sack_blocks())
+        return f"[{blocks}]"
+
+    def _seg_window(self, seg) -> str:
+        window = seg.window()
+        return "" if window is None else f"{{wnd={window}}}"
+
     def recv(self, seg):
         kind = self._seg_kind(seg)
-        print(f"[RECV] {kind}({seg.seq_num()})")
+        print(f"[RECV] {kind}({seg.seq_num()}){self._seg_blocks(seg)}{self._seg_window(seg)}")
 
     def send(self, seg):
         kind = self._seg_kind(seg)
-        print(f"[SEND] {kind}({seg.seq_num()})")
+        print(f"[SEND] {kind}({seg.seq_num()}){self._seg_blocks(seg)}{self._seg_window(seg)}")
@@ -0,0 +1,227 @@
+from socket import AF_INET, inet_aton, inet_ntoa
+from .segment import Segment, MAX_SEG_SIZE, RDP_HEADER_SIZE
+from .endpoint import UdpEndpoint
+from typing import Optional
+from time import time
+import ctypes
+import select
+import struct
+import errno
+import sys
+import os
+
+# Datagrams moved by a single sendmmsg or recvmmsg call, fewer
+# if they are larger than MAX_SEG_SIZE so the arenas stay the same.
+BATCH_SIZE = 64
+
+MSG_DONTWAIT = 0x40
+SOCKADDR_IN_SIZE = 16
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def has_mmsg() -> bool:
+    """
+    Returns whether sendmmsg and recvmmsg are available on this platform.
+    """
+    return _libc is not None
+
+
+def _addr_of(buf: bytearray) -> int:
+    return ctypes.addressof((ctypes.c_char * len(buf)).from_buffer(buf))
+
+
+class BatchEndpoint(UdpEndpoint):
+    """
+    A `UdpEndpoint` which sends a whole window of segments with one
+    sendmmsg call and reads every pending datagram with one recvmmsg
+    call, handing them out one by one afterwards. Where those calls are
+    not available it behaves like a plain `UdpEndpoint`.
+    """
+
+    def __init__(self, addr: Optional[tuple[str, int]] = None, bufsize: int = MAX_SEG_SIZE):
+        super().__init__(addr, bufsize)
+        self._batched = has_mmsg()
+        if not self._batched:
+            return
+
+        self._slot = bufsize
+        self._slots = max(BATCH_SIZE * MAX_SEG_SIZE // bufsize, 1)
+
+        self._skt.setblocking(False)
+        self._poll = select.poll()
+        self._poll.register(self._skt.fileno(), select.POLLIN)
+
+        # Every message owns a slot of `bufsize` bytes in each arena.
+        self._send_arena = bytearray(self._slots * self._slot)
+        self._send_iovs = (iovec * self._slots)()
+        self._send_msgs = (mmsghdr * self._slots)()
+        self._send_name = ctypes.create_string_buffer(SOCKADDR_IN_SIZE)
+        self._send_to = None
+
+        self._recv_arena = bytearray(self._slots * self._slot)
+        self._recv_view = memoryview(self._recv_arena)
+        self._recv_iovs = (iovec * self._slots)()
+        self._recv_msgs = (mmsghdr * self._slots)()
+        self._recv_names = ctypes.create_string_buffer(self._slots * SOCKADDR_IN_SIZE)
+        self._pending = []
+        self._next_pending = 0
+        self._last_name = None
+        self._last_peer = None
+
+        send_base = _addr_of(self._send_arena)
+        recv_base = _addr_of(self._recv_arena)
+        names_base = ctypes.addressof(self._recv_names)
+
+        for i in range(self._slots):
+            self._send_iovs[i].iov_base = send_base + i * self._slot
+            hdr = self._send_msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._send_name)
+            hdr.msg_namelen = SOCKADDR_IN_SIZE
+            hdr.msg_iov = ctypes.pointer(self._send_iovs[i])
+            hdr.msg_iovlen = 1
+
+            self._recv_iovs[i].iov_base = recv_base + i * self._slot
+            self._recv_iovs[i].iov_len = self._slot
+            hdr = self._recv_msgs[i].msg_hdr
+            hdr.msg_name = names_base + i * SOCKADDR_IN_SIZE
+            hdr.msg_iov = ctypes.pointer(self._recv_iovs[i])
+            hdr.msg_iovlen = 1
+
+    def _set_dest(self, addr: tuple[str, int]):
+        if self._send_to == addr:
+            return
+
+        ip, port = addr
+        self._send_name.raw = struct.pack("=H", AF_INET) + struct.pack("!H", port) + inet_aton(ip) + bytes(8)
+        self._send_to = addr
+
+    def _wait(self, events: int, deadline: Optional[float]):
+        self._poll.modify(self._skt.fileno(), events)
+        wait = None if deadline is None else max(deadline - time(), 0) * 1000
+        if not self._poll.poll(wait):
+            # `socket.timeout` is an alias of `TimeoutError`.
+            raise TimeoutError("timed out")
+
+    def sendseg(self, seg: Segment, addr: tuple[str, int]):
+        self.sendsegs([seg], addr)
+
+    def sendsegs(self, segs: list[Segment], addr: tuple[str, int]):
+        if not self._batched:
+            return super().sendsegs(segs, addr)
+
+        self._set_dest(addr)
+        for bot in range(0, len(segs), self._slots):
+            batch = segs[bot:bot + self._slots]
+            for i, seg in enumerate(batch):
+                # One copy into the arena instead of a Python object per datagram.
+                ofs = i * self._slot
+                data = seg.unwrap()
+                seg.pack_header_into(self._send_arena, ofs)
+                self._send_arena[ofs + RDP_HEADER_SIZE:ofs + RDP_HEADER_SIZE + len(data)] = data
+                self._send_iovs[i].iov_len = RDP_HEADER_SIZE + len(data)
+
+            self._sendmmsg(len(batch))
+
+    def _sendmmsg(self, count: int):
+        sent = 0
+        while sent < count:
+            msgs = ctypes.byref(self._send_msgs, sent * ctypes.sizeof(mmsghdr))
+            res = _libc.sendmmsg(self._skt.fileno(), msgs, count - sent, 0)
+            if res >= 0:
+                sent += res
+                continue
+
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._wait(select.POLLOUT, None)
+            elif err != errno.EINTR:
+                raise OSError(err, os.strerror(err))
+
+    def _recvmmsg(self) -> int:
+        for i in range(self._slots):
+            self._recv_msgs[i].msg_hdr.msg_namelen = SOCKADDR_IN_SIZE
+
+        res = _libc.recvmmsg(self._skt.fileno(), self._recv_msgs, self._slots, MSG_DONTWAIT, None)
+        if res >= 0:
+            return res
+
+        err = ctypes.get_errno()
+        if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+            return 0
+
+        raise OSError(err, os.strerror(err))
+
+    def _peer_of(self, i: int) -> tuple[str, int]:
+        name = ctypes.string_at(ctypes.addressof(self._recv_names) + i * SOCKADDR_IN_SIZE, 8)
+        # Almost every datagram comes from the same peer.
+        if name != self._last_name:
+            port, = struct.unpack("!H", name[2:4])
+            self._last_name = name
+            self._last_peer = inet_ntoa(name[4:8]), port
+
+        return self._last_peer
+
+    def recvfrom(self, timeout: Optional[float] = None) -> tuple[memoryview, tuple[str, int]]:
+        """
+        Returns the next pending datagram, reading every datagram the
+        socket has queued once they run out. The returned view is only
+        valid until the next call.
+        """
+        if not self._batched:
+            return super().recvfrom(timeout)
+
+        if self._next_pending == len(self._pending):
+            deadline = None if timeout is None else time() + timeout
+            count = self._recvmmsg()
+            while count == 0:
+                self._wait(select.POLLIN, deadline)
+                count = self._recvmmsg()
+
+            self._pending = [(i, self._recv_msgs[i].msg_len) for i in range(count)]
+            self._next_pending = 0
+
+        i, size = self._pending[self._next_pending]
+        self._next_pending += 1
+        ofs = i * self._slot
+        return self._recv_view[ofs:ofs + size], self._peer_of(i)
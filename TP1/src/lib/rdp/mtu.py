@@ -0,0 +1,85 @@
+from .segment import Segment
+from typing import Optional
+
+# Sizes closer than this to the largest confirmed one are not probed.
+PROBE_GRANULARITY = 32
+# Losses of a probe before its size is deemed too large for the path.
+MAX_PROBE_LOSSES = 3
+
+
+class MtuProber:
+    """
+    Packetization layer path MTU discovery as described in RFC 4821.
+    Segments start at `base` bytes and, if `probing` is set, a binary
+    search between the largest size the peer confirmed and `limit`
+    sends one probe at a time. A probe is lost if its echo does not
+    arrive within an RTO, and a size which gets lost `MAX_PROBE_LOSSES`
+    times in a row, or which the host refuses to send, becomes the new
+    upper bound. Without probing the segments take `limit` bytes right
+    away.
+    """
+
+    def __init__(self, base: int, limit: int, probing: bool):
+        self._size = base if probing else limit
+        self._limit = limit
+        self._candidate = None
+        self._pending = False
+        self._deadline = 0.0
+        self._losses = 0
+
+    def poll(self, now: float, rto: float) -> Optional[Segment]:
+        """
+        Returns the probe to send at `now`, if any.
+        """
+        if self._pending:
+            if now < self._deadline:
+                return None
+
+            self._pending = False
+            self._losses += 1
+            if self._losses == MAX_PROBE_LOSSES:
+                self._limit = self._candidate - 1
+                self._candidate = None
+                self._losses = 0
+
+        if self._candidate is None:
+            if self._limit - self._size < PROBE_GRANULARITY:
+                return None
+
+            self._candidate = (self._size + self._limit + 1) // 2
+
+        self._pending = True
+        self._deadline = now + rto
+        return Segment.probe_seg(self._candidate)
+
+    def on_echo(self, size: int):
+        """
+        Handles the other end confirming a probe of `size` bytes arrived.
+        """
+        if size != self._candidate:
+            return
+
+        self._size = size
+        self._candidate = None
+        self._pending = False
+        self._losses = 0
+
+    def on_too_big(self):
+        """
+        Handles the host refusing to send the pending probe because it
+        exceeds the local interface MTU, no need to wait for its losses.
+        """
+        if self._candidate is None:
+            return
+
+        self._limit = self._candidate - 1
+        self._candidate = None
+        self._pending = False
+        self._losses = 0
+
+    def size(self) -> int:
+        """
+        Returns the largest segment size, header included, known to
+        make it through the path.
+        """
+        return self._size
@@ -0,0 +1,159 @@
+from __future__ import annotations
+from .segment import Segment, RDP_HEADER_SIZE, MAX_SACK_BLOCKS
+from .seq import seq_add, seq_diff
+from typing import BinaryIO, Optional
+from bisect import bisect_right
+
+ACK_DELAY = 0.01
+
+
+class Receiver:
+    """
+    Reassembly state for a single call to `RdpStream.recv`. In-order
+    segments are acknowledged every `ackfreq` segments or after
+    `ACK_DELAY` seconds, while gaps, duplicates and the last segment
+    are acknowledged right away. In-order data is handed to `writer`
+    as soon as it arrives if one is given, otherwise it is gathered
+    in memory. Segments may be views of the buffer they were read
+    into, in-order data goes from it to `writer` without a copy and
+    only segments kept past a gap are copied out. If `advertise` is
+    set, every acknowledgement tells the other end how many segments
+    past it fit in the window. The ranges received past the first
+    hole are kept sorted as segments arrive, so building a SACK only
+    looks at the first `MAX_SACK_BLOCKS` of them.
+    """
+
+    def __init__(self, seq_ofs: int, winsize: int, ackfreq: int,
+                 writer: Optional[BinaryIO] = None, advertise: bool = False):
+        self._seq_ofs = seq_ofs
+        self._winsize = winsize
+        self._advertise = advertise
+        self._ackfreq = ackfreq
+        self._data = bytearray()
+        self._write = self._data.extend if writer is None else writer.write
+        self._written = 0
+        self._received = {}
+        # Segments handed out so far, positions below are relative to
+        # the start of the message so that they never wrap around.
+        self._delivered = 0
+        # Inclusive `[first, last]` positions of the ranges in `_received`.
+        self._blocks: list[list[int]] = []
+        self._pending = 0
+        self._ack_deadline = None
+        self._done = False
+
+    def _window(self) -> Optional[int]:
+        # Out of order segments are kept within the window, so the
+        # whole of it is free past the cumulative ACK.
+        return self._winsize if self._advertise else None
+
+    def _mark(self, pos: int):
+        """
+        Adds the segment at position `pos`, past the first hole, to
+        the ranges received, merging it with its neighbours.
+        """
+        i = bisect_right(self._blocks, pos, key=lambda block: block[0])
+        before = self._blocks[i - 1] if i > 0 else None
+        after = self._blocks[i] if i < len(self._blocks) else None
+
+        if before is not None and before[1] >= pos:
+            return
+
+        if before is not None and before[1] == pos - 1:
+            before[1] = pos
+            if after is not None and after[0] == pos + 1:
+                before[1] = after[1]
+                del self._blocks[i]
+        elif after is not None and after[0] == pos + 1:
+            after[0] = pos
+        else:
+            self._blocks.insert(i, [pos, pos])
+
+    def _ack(self) -> Segment:
+        """
+        Builds the acknowledgement for the current state of the receive
+        window: a plain cumulative ACK if there are no holes, or one
+        which also carries the ranges received past the first hole.
+        """
+        self._pending = 0
+        self._ack_deadline = None
+
+        ack_num = seq_add(self._seq_ofs, -1)
+        if not self._blocks:
+            return Segment.ack_seg(ack_num, self._window())
+
+        blocks = []
+        for first, last in self._blocks[:MAX_SACK_BLOCKS]:
+            blocks.append((seq_add(self._seq_ofs, first - self._delivered),
+                           seq_add(self._seq_ofs, last - self._delivered)))
+
+        return Segment.sack_seg(ack_num, blocks, self._window())
+
+    def on_segment(self, seg: Segment, now: float) -> Optional[Segment]:
+        """
+        Handles a data segment from the other end and returns the
+        acknowledgement to send right away, if any.
+        """
+        if seg.is_prb():
+            return Segment.probe_ack_seg(RDP_HEADER_SIZE + len(seg.unwrap()))
+
+        ahead = seq_diff(seg.seq_num(), self._seq_ofs)
+        if ahead >= self._winsize:
+            return None
+
+        delayable = ahead == 0 and not self._received
+        if ahead == 0:
+            # Written out right below.
+            self._received[seg.seq_num()] = seg
+        elif ahead > 0 and seg.seq_num() not in self._received:
+            self._received[seg.seq_num()] = seg.detach()
+            self._mark(self._delivered + ahead)
+
+        while self._seq_ofs in self._received:
+            seg = self._received.pop(self._seq_ofs)
+            self._seq_ofs = seq_add(self._seq_ofs, 1)
+            self._delivered += 1
+            self._write(seg.unwrap())
+            self._written += len(seg.unwrap())
+            self._pending += 1
+
+            if seg.is_lst():
+                self._done = True
+                self._pending = 0
+                self._ack_deadline = None
+                return Segment.ack_seg(seg.seq_num(), self._window())
+
+        if self._blocks and self._blocks[0][0] < self._delivered:
+            # Filling the first hole delivers the whole first range.
+            self._blocks.pop(0)
+
+        if delayable and self._pending < self._ackfreq:
+            if self._ack_deadline is None:
+                self._ack_deadline = now + ACK_DELAY
+            return None
+
+        return self._ack()
+
+    def poll(self, now: float) -> Optional[Segment]:
+        """
+        Returns the delayed acknowledgement if it is due at `now`.
+        """
+        if self._ack_deadline is not None and self._ack_deadline <= now:
+            return self._ack()
+
+        return None
+
+    def ack_deadline(self) -> Optional[float]:
+        return self._ack_deadline
+
+    def seq_ofs(self) -> int:
+        return self._seq_ofs
+
+    def done(self) -> bool:
+        return self._done
+
+    def data(self) -> bytearray:
+        return self._data
+
+    def written(self) -> int:
+        return self._written
@@ -0,0 +1,55 @@
+from typing import Optional
+
+INITIAL_RTO = 0.25
+MIN_RTO = 0.02
+MAX_RTO = 4.0
+CLOCK_GRANULARITY = 0.02
+
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+
+class RtoEstimator:
+    """
+    Retransmission timeout estimator as described in RFC 6298.
+    Keeps a smoothed RTT and its variance from the samples taken
+    on ACK and SAC arrivals and doubles the timeout on every expiry
+    until a new valid sample arrives.
+    """
+
+    def __init__(self):
+        self._srtt: Optional[float] = None
+        self._rttvar = 0.0
+        self._rto = INITIAL_RTO
+        self._backoff = 1
+
+    def sample(self, rtt: float):
+        """
+        Feeds a new round trip time measurement into the estimator.
+        Following Karn's rule, callers must not sample segments
+        that have been retransmitted.
+        """
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar = (1 - BETA) * self._rttvar + BETA * abs(self._srtt - rtt)
+            self._srtt = (1 - ALPHA) * self._srtt + ALPHA * rtt
+
+        rto = self._srtt + max(CLOCK_GRANULARITY, K * self._rttvar)
+        self._rto = min(max(rto, MIN_RTO), MAX_RTO)
+        self._backoff = 1
+
+    def backoff(self):
+        """
+        Exponentially backs off the timeout after a retransmission.
+        """
+        if self._rto * self._backoff < MAX_RTO:
+            self._backoff *= 2
+
+    def rto(self) -> float:
+        return min(self._rto * self._backoff, MAX_RTO)
+
+    def srtt(self) -> Optional[float]:
+        return self._srtt
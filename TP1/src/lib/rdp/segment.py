@@ -1,16 +1,38 @@
 from __future__ import annotations
-from typing import Iterator
+from typing import BinaryIO, Callable, Iterator, Optional
+import struct
 
 MAX_SEG_SIZE = 1028
 RDP_HEADER_SIZE = 4
 RDP_DATA_SIZE = MAX_SEG_SIZE - RDP_HEADER_SIZE
 MAX_SEQ_NUM = 2 ** 24
+# Largest UDP payload over IPv4.
+MAX_MSS = 65507
 
 ACK_MASK = 1 << 7
 SYN_MASK = 1 << 6
 LST_MASK = 1 << 5
 FIN_MASK = 1 << 4
 SAC_MASK = 1 << 3
+PRB_MASK = 1 << 2
+WND_MASK = 1 << 1
+
+OPT_MSS = 1
+OPT_ISN = 2
+OPT_WND = 3
+OPT_DATA = 4
+OPT_DATA_ACK = 5
+
+WINDOW_SIZE = 3
+# The length of an option takes a single byte.
+MAX_OPT_SIZE = 255
+
+SACK_BLOCK_SIZE = 6
+MAX_SACK_BLOCKS = 16
+
+# The flags byte and the sequence number read as one big endian word.
+HEADER = struct.Struct(">I")
+SEQ_NUM_MASK = MAX_SEQ_NUM - 1
 
 """
                            RDP HEADER
@@ -18,14 +40,72 @@ SAC_MASK = 1 << 3
                      1                   2                   3
  0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
 +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
-|A|S|L|F|S|     |                                               |
-|C|Y|S|I|A|FLAGS|                    SEQ NUM                    |
-|K|N|T|N|C|     |                                               |
+|A|S|L|F|S|P|W| |                                               |
+|C|Y|S|I|A|R|N| |                    SEQ NUM                    |
+|K|N|T|N|C|B|D| |                                               |
 +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
 |                                                               |
 .                             DATA                              .
 .                                                               .
 
+
+                        SACK BLOCKS (ACK + SAC)
+
+ A segment with both the ACK and SAC flags set carries a cumulative
+ ACK in its SEQ NUM and, as data, up to MAX_SACK_BLOCKS ranges of
+ segments received above it.
+
+ 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
++-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+|1|0|0|0|1|     |                 CUMULATIVE ACK                |
++-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+|             BLOCK 1 FIRST             |   BLOCK 1 LAST  ...   |
++-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+.                                                               .
+
+
+                        ADVERTISED WINDOW (WND)
+
+ An ACK, with or without SACK blocks, may have the WND flag set. Its
+ data then starts with the amount of segments past the cumulative ACK
+ its sender is willing to take, followed by the blocks if any. It is
+ only sent to peers which announced OPT_WND in their SYN or SYNACK.
+
+ 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
++-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+|1|0|0|0|S|0|1| |                 CUMULATIVE ACK                |
++-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+|                  WINDOW               |   SACK BLOCKS ...     |
++-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+
+
+                         SYN AND SYNACK OPTIONS
+
+ SYN and SYNACK segments may carry options as data, each one a kind
+ byte, a length byte and a big endian value of that length. Unknown
+ kinds are skipped. OPT_MSS holds the largest segment, header
+ included, the sender of the option is able to receive. OPT_ISN holds
+ the sequence number of the first data segment, picked by the client
+ and echoed by the server. Without it the sequence starts at 0.
+ OPT_WND holds the receive window, in segments, of its sender.
+ OPT_DATA, only in a SYN, holds a whole message sent before the
+ handshake completes, taking the sequence number announced by OPT_ISN.
+ The server takes it by answering with OPT_DATA_ACK, which holds its
+ length, and may reply right away. Otherwise the client sends the
+ message again once connected.
+
+ 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
++-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+|     KIND      |    LENGTH     |          VALUE ...            |
++-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+
+
+                               PROBES
+
+ A segment with the PRB flag set is padded to the size being probed
+ and is answered right away with PRB + ACK carrying, in its SEQ NUM,
+ the size of the probe that arrived. Probes take no sequence number.
+
 """
 
 
@@ -36,6 +116,8 @@ class SegmentBuilder:
         self._lst = False
         self._fin = False
         self._sac = False
+        self._prb = False
+        self._wnd = False
         self._seq_num = 0
         self._data = bytes()
 
@@ -59,6 +141,14 @@ class SegmentBuilder:
         self._sac = value
         return self
 
+    def prb(self, value: bool) -> SegmentBuilder:
+        self._prb = value
+        return self
+
+    def wnd(self, value: bool) -> SegmentBuilder:
+        self._wnd = value
+        return self
+
     def seq_num(self, value: int) -> SegmentBuilder:
         self._seq_num = value
         return self
@@ -68,61 +158,122 @@ class SegmentBuilder:
         return self
 
     def build(self) -> Segment:
-        return Segment(self._ack, self._syn, self._lst, self._fin, self._sac, self._seq_num, self._data)
+        return Segment(self._ack, self._syn, self._lst, self._fin, self._sac, self._seq_num, self._data, self._prb,
+                       self._wnd)
 
 
 class Segment:
-    def __init__(self, ack: bool, syn: bool, lst: bool, fin: bool, sac: bool, seq_num: int, data: bytes):
-        self._ack = ack
-        self._syn = syn
-        self._lst = lst
-        self._fin = fin
-        self._sac = sac
+    __slots__ = ("_flags", "_seq_num", "_data")
+
+    def __init__(self, ack: bool, syn: bool, lst: bool, fin: bool, sac: bool, seq_num: int, data: bytes,
+                 prb: bool = False, wnd: bool = False):
+        self._flags = ACK_MASK * ack | SYN_MASK * syn | LST_MASK * lst | FIN_MASK * fin | SAC_MASK * sac \
+            | PRB_MASK * prb | WND_MASK * wnd
         self._seq_num = seq_num
         self._data = data
 
     @classmethod
-    def from_bytes(cls, seg_bytes: bytes) -> Segment:
-        flags = seg_bytes[0]
-        ack = flags & ACK_MASK != 0
-        syn = flags & SYN_MASK != 0
-        lst = flags & LST_MASK != 0
-        fin = flags & FIN_MASK != 0
-        sac = flags & SAC_MASK != 0
-        seq_num = int.from_bytes(seg_bytes[1:4], "big")
-        data = seg_bytes[RDP_HEADER_SIZE:]
-        return cls.builder()  \
-            .ack(ack)         \
-            .syn(syn)         \
-            .lst(lst)         \
-            .fin(fin)         \
-            .sac(sac)         \
-            .seq_num(seq_num) \
-            .data(data)       \
-            .build()
+    def _raw(cls, flags: int, seq_num: int, data: bytes) -> Segment:
+        seg = cls.__new__(cls)
+        seg._flags = flags
+        seg._seq_num = seq_num
+        seg._data = data
+        return seg
+
+    @classmethod
+    def from_bytes(cls, seg_bytes: bytes, copy: bool = True) -> Segment:
+        """
+        Decodes a segment from any bytes-like object. The data is copied
+        out only if there is any, so `seg_bytes` may be a view of a
+        buffer which is reused afterwards. Without `copy` the data stays
+        a view of `seg_bytes`, see `detach`. Raises `ValueError` if
+        `seg_bytes` is too short to hold a header.
+        """
+        if len(seg_bytes) < RDP_HEADER_SIZE:
+            raise ValueError("The datagram is too short to be a segment")
+
+        header, = HEADER.unpack_from(seg_bytes)
+        data = b""
+        if len(seg_bytes) > RDP_HEADER_SIZE:
+            data = memoryview(seg_bytes)[RDP_HEADER_SIZE:]
+            if copy:
+                data = bytes(data)
+
+        return cls._raw(header >> 24, header & SEQ_NUM_MASK, data)
 
     @classmethod
     def builder(cls) -> SegmentBuilder:
         return SegmentBuilder()
 
     @classmethod
-    def ack_seg(cls, seq_num: int) -> Segment:
-        return cls.builder()  \
-            .seq_num(seq_num) \
-            .ack(True)        \
+    def _encode_window(cls, window: Optional[int]) -> bytes:
+        return b"" if window is None else window.to_bytes(WINDOW_SIZE, "big")
+
+    @classmethod
+    def ack_seg(cls, seq_num: int, window: Optional[int] = None) -> Segment:
+        """
+        Builds a cumulative ACK of `seq_num` which, if `window` is
+        given, also advertises the receive window.
+        """
+        return cls.builder()                  \
+            .seq_num(seq_num)                 \
+            .ack(True)                        \
+            .wnd(window is not None)          \
+            .data(cls._encode_window(window)) \
             .build()
 
     @classmethod
-    def syn_seg(cls) -> Segment:
-        return cls.builder()  \
-            .syn(True)        \
+    def _encode_options(cls, options: Optional[dict[int, int]], early_data: Optional[bytes] = None) -> bytes:
+        data = bytearray()
+        for kind, value in (options or {}).items():
+            length = max((value.bit_length() + 7) // 8, 1)
+            data.append(kind)
+            data.append(length)
+            data.extend(value.to_bytes(length, "big"))
+
+        if early_data is not None:
+            data.append(OPT_DATA)
+            data.append(len(early_data))
+            data.extend(early_data)
+
+        return bytes(data)
+
+    @classmethod
+    def syn_seg(cls, options: Optional[dict[int, int]] = None,
+                early_data: Optional[bytes] = None) -> Segment:
+        """
+        Builds a SYN carrying `options` and, if given, `early_data`
+        which has to fit in `MAX_OPT_SIZE` bytes.
+        """
+        return cls.builder()                                \
+            .syn(True)                                      \
+            .data(cls._encode_options(options, early_data)) \
             .build()
 
     @classmethod
-    def syn_ack_seg(cls) -> Segment:
-        return cls.builder()  \
-            .ack(True)        \
-            .syn(True)        \
+    def syn_ack_seg(cls, options: Optional[dict[int, int]] = None) -> Segment:
+        return cls.builder()                    \
+            .ack(True)                          \
+            .syn(True)                          \
+            .data(cls._encode_options(options)) \
+            .build()
+
+    @classmethod
+    def probe_seg(cls, size: int) -> Segment:
+        """
+        Builds a probe which takes `size` bytes on the wire.
+        """
+        return cls.builder()                     \
+            .prb(True)                           \
+            .data(bytes(size - RDP_HEADER_SIZE)) \
+            .build()
+
+    @classmethod
+    def probe_ack_seg(cls, size: int) -> Segment:
+        return cls.builder() \
+            .ack(True)       \
+            .prb(True)       \
+            .seq_num(size)   \
             .build()
 
     @classmethod
@@ -139,20 +290,48 @@ class Segment:
             .seq_num(seq_num) \
             .build()
 
+    @classmethod
+    def sack_seg(cls, seq_num: int, blocks: list[tuple[int, int]],
+                 window: Optional[int] = None) -> Segment:
+        """
+        Builds a cumulative ACK of `seq_num` which also acknowledges
+        the inclusive ranges of sequence numbers in `blocks` and, if
+        `window` is given, advertises the receive window.
+        """
+        data = bytearray(cls._encode_window(window))
+
+        for first, last in blocks[:MAX_SACK_BLOCKS]:
+            data.extend(first.to_bytes(3, "big"))
+            data.extend(last.to_bytes(3, "big"))
+
+        return cls.builder()         \
+            .ack(True)               \
+            .sac(True)               \
+            .wnd(window is not None) \
+            .seq_num(seq_num)        \
+            .data(data)              \
+            .build()
+
     def is_syn(self) -> bool:
-        return self._syn
+        return self._flags & SYN_MASK != 0
 
     def is_ack(self) -> bool:
-        return self._ack
+        return self._flags & ACK_MASK != 0
 
     def is_lst(self) -> bool:
-        return self._lst
+        return self._flags & LST_MASK != 0
 
     def is_fin(self) -> bool:
-        return self._fin
+        return self._flags & FIN_MASK != 0
 
     def is_sac(self) -> bool:
-        return self._sac
+        return self._flags & SAC_MASK != 0
+
+    def is_prb(self) -> bool:
+        return self._flags & PRB_MASK != 0
+
+    def is_wnd(self) -> bool:
+        return self._flags & WND_MASK != 0
 
     def seq_num(self) -> int:
         return self._seq_num
@@ -160,39 +339,117 @@ class Segment:
     def unwrap(self) -> bytes:
         return self._data
 
-    @classmethod
-    def _seg_data_size_chunks(cls, data: bytes) -> Iterator[bytes]:
-        for i in range(0, len(data), RDP_DATA_SIZE):
-            bot = i
-            top = min(i + RDP_DATA_SIZE, len(data))
-            yield data[bot:top]
+    def detach(self) -> Segment:
+        """
+        Returns the segment with a copy of its data if it is a view, so
+        that it outlives the buffer it was read into.
+        """
+        if isinstance(self._data, memoryview):
+            return Segment._raw(self._flags, self._seq_num, bytes(self._data))
+
+        return self
+
+    def sack_blocks(self) -> list[tuple[int, int]]:
+        """
+        Returns the ranges carried by a SACK blocks segment.
+        """
+        blocks = []
+        start = WINDOW_SIZE if self.is_wnd() else 0
+        for i in range(start, len(self._data) - SACK_BLOCK_SIZE + 1, SACK_BLOCK_SIZE):
+            first = int.from_bytes(self._data[i:i + 3], "big")
+            last = int.from_bytes(self._data[i + 3:i + 6], "big")
+            blocks.append((first, last))
+
+        return blocks
+
+    def window(self) -> Optional[int]:
+        """
+        Returns the receive window advertised by an ACK, if any.
+        """
+        if not self.is_wnd():
+            return None
+
+        return int.from_bytes(self._data[:WINDOW_SIZE], "big")
+
+    def _raw_options(self) -> Iterator[tuple[int, bytes]]:
+        i = 0
+        while i + 2 <= len(self._data):
+            kind, length = self._data[i], self._data[i + 1]
+            value = self._data[i + 2:i + 2 + length]
+            if len(value) < length:
+                return
+
+            yield kind, value
+            i += 2 + length
+
+    def options(self) -> dict[int, int]:
+        """
+        Returns the options carried by a SYN or SYNACK segment, but
+        for the early data.
+        """
+        return {kind: int.from_bytes(value, "big") for kind, value in self._raw_options() if kind != OPT_DATA}
+
+    def early_data(self) -> Optional[bytes]:
+        """
+        Returns the message carried by a SYN segment, if any.
+        """
+        for kind, value in self._raw_options():
+            if kind == OPT_DATA:
+                return bytes(value)
+
+        return None
 
     @classmethod
-    def make_segments(cls, data: bytes, seq_ofs: int) -> Iterator[Segment]:
-        lst_pos = (len(data) - 1) // RDP_DATA_SIZE
-        for i, data in enumerate(cls._seg_data_size_chunks(data)):
-            yield cls.builder()       \
-                .lst(i == lst_pos)    \
-                .seq_num(seq_ofs + i) \
-                .data(data)           \
-                .build()
+    def make_segments(cls, data: bytes, seq_ofs: int,
+                      data_size: Callable[[], int] = lambda: RDP_DATA_SIZE) -> Iterator[Segment]:
+        """
+        Lazily splits `data` into segments of `data_size()` bytes, asked
+        again for every segment so that it may grow during the transfer.
+        Empty data still yields a single empty last segment.
+        """
+        # Slices of a memoryview share the buffer of `data`.
+        data = memoryview(data)
+        bot = 0
+        i = 0
+        while True:
+            top = min(bot + data_size(), len(data))
+            yield cls._raw(LST_MASK * (top == len(data)), (seq_ofs + i) % MAX_SEQ_NUM, data[bot:top])
 
-    def encode(self) -> bytes:
+            if top == len(data):
+                return
+
+            bot = top
+            i += 1
+
+    @classmethod
+    def read_segments(cls, reader: BinaryIO, seq_ofs: int,
+                      data_size: Callable[[], int] = lambda: RDP_DATA_SIZE) -> Iterator[Segment]:
         """
-        Turns the segment into bytes
+        Lazily splits the contents of `reader` into segments, reading one
+        chunk ahead so the last one can be flagged. An empty reader still
+        yields a single empty last segment.
         """
-        data = bytearray()
+        data = reader.read(data_size())
+        i = 0
+        while True:
+            next_data = reader.read(data_size())
+            yield cls._raw(LST_MASK * (not next_data), (seq_ofs + i) % MAX_SEQ_NUM, data)
 
-        ack = ACK_MASK * self.is_ack()
-        syn = SYN_MASK * self.is_syn()
-        lst = LST_MASK * self.is_lst()
-        fin = FIN_MASK * self.is_fin()
-        sac = SAC_MASK * self.is_sac()
-        flags = int.to_bytes(ack | syn | lst | fin | sac, 1, "big")
-        data.extend(flags)
+            if not next_data:
+                return
 
-        seq_num = self.seq_num().to_bytes(3, "big")
-        data.extend(seq_num)
+            data = next_data
+            i += 1
 
-        data.extend(self.unwrap())
-        return data
+    def pack_header_into(self, buf: bytearray, offset: int = 0):
+        """
+        Writes the header of the segment into `buf` at `offset`, so that
+        it can be sent along with the data without joining them.
+        """
+        HEADER.pack_into(buf, offset, self._flags << 24 | self._seq_num & SEQ_NUM_MASK)
+
+    def encode(self) -> bytes:
+        """
+        Turns the segment into bytes
+        """
+        return HEADER.pack(self._flags << 24 | self._seq_num & SEQ_NUM_MASK) + self._data
@@ -0,0 +1,277 @@
+from __future__ import annotations
+from .cc.controller import CongestionController
+from .timers import DeadlineQueue
+from .mtu import MtuProber
+from .rto import RtoEstimator
+from .segment import Segment
+from .seq import seq_add, seq_diff
+from typing import Iterable, Optional
+
+DUP_THRESH = 3
+
+
+class Sender:
+    """
+    Selective repeat sender state for a single call to `RdpStream.send`.
+    Every outstanding segment has a retransmission deadline in a heap,
+    so each ACK, SAC or expiry costs O(log n) instead of a window scan.
+    A hole with `dupthresh` selectively acknowledged segments above it
+    is considered lost and fast retransmitted without waiting for its
+    timer to expire. Segments are pulled from `segs` as the window
+    opens and dropped once acknowledged, so only the window is kept
+    in memory. If a `prober` is given, its probes go out along with
+    the data. If `rwnd` is given, the window also stays within the
+    receive window of the other end, updated from its ACKs.
+    """
+
+    def __init__(self, segs: Iterable[Segment], seq_ofs: int, winsize: int,
+                 rto: RtoEstimator, cc: CongestionController,
+                 dupthresh: int = DUP_THRESH, prober: Optional[MtuProber] = None,
+                 rwnd: Optional[int] = None):
+        self._source = iter(segs)
+        self._segs = {}
+        # Unknown until the last segment is pulled from the source.
+        self._total = None
+        self._seq_ofs = seq_ofs
+        self._winsize = winsize
+        self._rwnd = rwnd
+        self._dupthresh = dupthresh
+        self._rto = rto
+        self._cc = cc
+        self._prober = prober
+        self._timers = DeadlineQueue()
+        self._sent_at = {}
+        self._retransmitted = set()
+        self._sacked = set()
+        self._base = 0
+        self._next = 0
+        # Every hole below `_scan` was already fast retransmitted,
+        # `_sacked_past_scan` counts the SACKed segments from there on.
+        self._scan = 0
+        self._sacked_past_scan = 0
+        # Segments sent before the last loss belong to the same
+        # loss event and must not shrink the window again.
+        self._recovery_time = 0
+
+    def _index(self, seq_num: int) -> int:
+        # Measured from the base, which is always within half the
+        # sequence space of anything the other end acknowledges.
+        return self._base + seq_diff(seq_num, seq_add(self._seq_ofs, self._base))
+
+    def _limit(self) -> int:
+        """
+        Returns the most segments the other end is able to take.
+        """
+        if self._rwnd is None:
+            return self._winsize
+
+        # A window of 0 is never advertised, but the
+        # sender must not stall waiting for one to open.
+        return max(min(self._winsize, self._rwnd), 1)
+
+    def _window_top(self) -> int:
+        winsize = min(self._limit(), self._cc.cwnd())
+        top = self._base + winsize
+        return top if self._total is None else min(top, self._total)
+
+    def _pull(self) -> bool:
+        """
+        Takes the next segment from the source, returning `False` if
+        there are none left.
+        """
+        if self._total is not None:
+            return False
+
+        seg = next(self._source, None)
+        if seg is None:
+            self._total = self._next
+            return False
+
+        self._segs[self._next] = seg
+        if seg.is_lst():
+            self._total = self._next + 1
+
+        return True
+
+    def _detect_losses(self) -> list[int]:
+        """
+        Advances the scan over the window, returning the holes that have
+        at least `dupthresh` SACKed segments above them. Every segment is
+        scanned once, so the cost is amortized O(1) per segment.
+        """
+        if self._scan < self._base:
+            self._scan = self._base
+
+        # Early retransmit: with few segments in flight there may never
+        # be `dupthresh` of them above a hole, lower it accordingly.
+        in_flight = self._next - self._base
+        dupthresh = min(self._dupthresh, max(in_flight - 1, 1))
+
+        lost = []
+        while self._scan < self._next:
+            if self._scan in self._sacked:
+                self._sacked_past_scan -= 1
+            elif self._sacked_past_scan >= dupthresh:
+                lost.append(self._scan)
+            else:
+                break
+
+            self._scan += 1
+
+        return lost
+
+    def poll(self, now: float) -> list[Segment]:
+        """
+        Returns the segments that have to be put on the wire at `now`:
+        the ones inferred lost from SACK information, the ones whose
+        retransmission timer expired and the new ones the window allows.
+        """
+        lost = self._detect_losses()
+        if any(self._sent_at[i] > self._recovery_time for i in lost):
+            self._cc.on_loss()
+            self._recovery_time = now
+
+        expired = [i for i in self._timers.pop_expired(now) if i not in lost]
+        if any(self._sent_at[i] > self._recovery_time for i in expired):
+            self._rto.backoff()
+            self._cc.on_timeout()
+            self._recovery_time = now
+
+        top = self._window_top()
+        rto = self._rto.rto()
+        to_send = []
+
+        for i in lost:
+            self._retransmitted.add(i)
+            to_send.append(i)
+
+        for i in expired:
+            if i < top:
+                self._retransmitted.add(i)
+                to_send.append(i)
+            else:
+                # Outside the shrunk window, keep it waiting.
+                self._timers.schedule(i, now + rto)
+
+        while self._next < top and self._pull():
+            to_send.append(self._next)
+            self._next += 1
+
+        for i in to_send:
+            self._sent_at[i] = now
+            self._timers.schedule(i, now + rto)
+
+        segs = [self._segs[i] for i in to_send]
+        probe = self._prober.poll(now, rto) if self._prober is not None else None
+        if probe is not None:
+            # Last, so that it is sent on its own and a probe too
+            # large to leave the host does not hold back the data.
+            segs.append(probe)
+
+        return segs
+
+    def next_deadline(self) -> Optional[float]:
+        return self._timers.earliest()
+
+    def _grow(self, acked: int):
+        # Only a window that is actually limiting the sender
+        # may keep growing, `_limit()` bounds it otherwise.
+        if self._cc.cwnd() < self._limit():
+            self._cc.on_ack(acked)
+
+    def on_sac(self, seq_num: int, now: float):
+        """
+        Marks a single segment as received by the other end.
+        """
+        i = self._index(seq_num)
+        if not self._base <= i < self._next or i in self._sacked:
+            return
+
+        if i not in self._retransmitted:
+            self._rto.sample(now - self._sent_at[i])
+
+        self._sacked.add(i)
+        self._timers.cancel(i)
+        if i >= self._scan:
+            self._sacked_past_scan += 1
+
+        self._grow(1)
+
+    def on_ack(self, seq_num: int, now: float) -> int:
+        """
+        Marks every segment up to `seq_num` as received by the other end
+        and returns by how many segments the window slid.
+        """
+        top = self._index(seq_num)
+        if not self._base <= top < self._next:
+            return 0
+
+        # Karn's rule: only take a sample if none of the newly
+        # acknowledged segments was ever retransmitted.
+        clean = True
+        acked = 0
+        sent_at = self._sent_at[top]
+
+        for i in range(self._base, top + 1):
+            clean = clean and i not in self._retransmitted
+            if i in self._sacked:
+                self._sacked.discard(i)
+                if i >= self._scan:
+                    self._sacked_past_scan -= 1
+            else:
+                acked += 1
+
+            self._retransmitted.discard(i)
+            del self._segs[i]
+            del self._sent_at[i]
+            self._timers.cancel(i)
+
+        if clean:
+            self._rto.sample(now - sent_at)
+
+        advanced = top + 1 - self._base
+        self._base = top + 1
+        self._grow(acked)
+        return advanced
+
+    def on_feedback(self, seg: Segment, now: float) -> int:
+        """
+        Handles an ACK, SAC, SACK blocks or probe echo segment from the
+        other end and returns by how many segments the window slid.
+        """
+        if seg.is_prb():
+            if self._prober is not None:
+                self._prober.on_echo(seg.seq_num())
+            return 0
+
+        window = seg.window()
+        if window is not None:
+            self._rwnd = window
+
+        if seg.is_ack() and seg.is_sac():
+            for first, last in seg.sack_blocks():
+                for i in range(seq_diff(last, first) + 1):
+                    self.on_sac(seq_add(first, i), now)
+
+            return self.on_ack(seg.seq_num(), now)
+
+        if seg.is_sac():
+            self.on_sac(seg.seq_num(), now)
+            return 0
+
+        return self.on_ack(seg.seq_num(), now)
+
+    def remaining(self) -> int:
+        """
+        Returns the amount of segments sent but not yet acknowledged.
+        """
+        return self._next - self._base
+
+    def rwnd(self) -> Optional[int]:
+        """
+        Returns the last receive window advertised by the other end.
+        """
+        return self._rwnd
+
+    def done(self) -> bool:
+        return self._base == self._total
@@ -0,0 +1,30 @@
+from .segment import MAX_SEQ_NUM
+
+"""
+Sequence numbers live in a circular space of MAX_SEQ_NUM values, so
+they are compared by their distance rather than by their value, as in
+RFC 1982. Any two numbers less than half the space apart compare as
+expected across a wrap, which holds as long as windows stay below
+MAX_WINSIZE.
+"""
+
+MAX_WINSIZE = MAX_SEQ_NUM // 2 - 1
+
+
+def seq_add(seq_num: int, n: int) -> int:
+    """
+    Returns the sequence number `n` places after `seq_num`.
+    """
+    return (seq_num + n) % MAX_SEQ_NUM
+
+
+def seq_diff(a: int, b: int) -> int:
+    """
+    Returns how many places `a` is after `b`, negative if it is before.
+    """
+    diff = (a - b) % MAX_SEQ_NUM
+    return diff - MAX_SEQ_NUM if diff >= MAX_SEQ_NUM // 2 else diff
+
+
+def seq_lt(a: int, b: int) -> bool:
+    return seq_diff(a, b) < 0
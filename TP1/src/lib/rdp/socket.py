@@ -1,288 +1,211 @@
 from __future__ import annotations
-from .segment import Segment, MAX_SEG_SIZE, RDP_HEADER_SIZE, MAX_SEQ_NUM
-from socket import socket, AF_INET, SOCK_DGRAM, timeout
+from .segment import Segment, MAX_SEG_SIZE
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_REUSEPORT
+from .connection import Connection, Hangup, Step, T
 from .log.verbose import VerboseLogger
-from typing import Iterator, Optional
+from typing import BinaryIO, Callable, Iterator, Optional, Union
+from .demux import ConnTable, DemuxEndpoint
+from .endpoint import UdpEndpoint, dont_fragment
+from .mmsg import BatchEndpoint
 from .log.quiet import QuietLogger
-from time import time
-
-TIMEOUT = 0.08
-MAX_TIMEOUT_COUNT = 20
-
-
-class Hangup(Exception):
-    pass
-
-
-class RdpStream:
-    def __init__(self, peer_addr: tuple[str, int], log: bool):
-        self._log = VerboseLogger() if log else QuietLogger()
-        self._skt = socket(AF_INET, SOCK_DGRAM)
-        self._addr = self._skt.getsockname()
-        self._peer_addr = peer_addr
-        self._closed = False
-        self._seq_ofs = 0
+from .cc.controller import CongestionController
+from .cc.reno import RenoController
+from .sender import DUP_THRESH
+from functools import partial
+
+
+class RdpStream(Connection):
+    """
+    One end of a connection whose calls block the thread until they are
+    done, waiting for datagrams on its endpoint.
+    """
+
+    def __init__(self, peer_addr: tuple[str, int], log: bool,
+                 endpoint: Optional[Union[UdpEndpoint, DemuxEndpoint]] = None,
+                 on_close: Optional[Callable[[], None]] = None,
+                 mss: int = MAX_SEG_SIZE, probe: bool = False, winsize: int = 1,
+                 cc: Callable[[], CongestionController] = RenoController):
+        endpoint = endpoint if endpoint is not None else UdpEndpoint(bufsize=mss)
+        super().__init__(endpoint, peer_addr, log, on_close, mss, probe, winsize, cc)
 
     @classmethod
-    def connect(cls, ip: str, port: int, log: bool = False) -> RdpStream:
-        """
-        Establishes a new connection to a RdpListener.
-        """
-        self = cls((ip, port), log)
-        syn_seg = Segment.syn_seg()
-        self._skt.settimeout(TIMEOUT)
-
-        while True:
-            self._sendall(syn_seg)
-            try:
-                # Wait for SYNACK from the new connection.
-                seg_bytes, peer_addr = self._skt.recvfrom(RDP_HEADER_SIZE)
-            except timeout:
-                continue
-
-            seg = Segment.from_bytes(seg_bytes)
-            self._log.recv(seg)
-
-            if seg.is_syn() and seg.is_ack():
-                self._peer_addr = peer_addr
-                break
-
-        ack_seg = Segment.ack_seg(0)
-        self._sendall(ack_seg)
-        self._log.connection_established(peer_addr)
+    def connect(cls, ip: str, port: int, log: bool = False, batch: bool = False,
+                mss: int = MAX_SEG_SIZE, probe: bool = False, isn: Optional[int] = None,
+                winsize: int = 1, early_data: Optional[bytes] = None,
+                cc: Callable[[], CongestionController] = RenoController) -> RdpStream:
+        """
+        Establishes a new connection to a RdpListener. If `batch` is set,
+        datagrams are sent and received in batches where supported.
+        Segments take up to `mss` bytes, as long as the other end accepts
+        them, and if `probe` is set they start at `MAX_SEG_SIZE` and grow
+        as probes find out the path carries them. The sequence numbers
+        start at `isn`, a random one if not given. `winsize` is the
+        receive window announced to the other end until the first ACK
+        tells it the one of each call to `recv`. If given, `early_data`
+        goes along with the SYN as the first message when it fits, check
+        `early_data_accepted` to know whether it still has to be sent.
+        `cc` makes the congestion controller of the connection.
+        """
+        endpoint = BatchEndpoint(bufsize=mss) if batch else None
+        self = cls((ip, port), log, endpoint, mss=mss, probe=probe, winsize=winsize, cc=cc)
+        self._run(self._connect(isn, early_data))
         return self
 
-    def _validate_open(self):
-        if self._closed:
-            raise Hangup("The socket has already been closed")
-
-    def _sendall(self, seg: Segment):
+    def _run(self, step: Step[T]) -> T:
         """
-        Sends all the contents in `data` through the socket.
+        Runs a step of the protocol, blocking on the endpoint whenever
+        it waits for a datagram.
         """
-        data = seg.encode()
-        self._log.send(seg)
-        sent = 0
-        while sent < len(data):
-            sent += self._skt.sendto(data[sent:], self.peer_addr())
+        try:
+            wait = next(step)
+            while True:
+                try:
+                    datagram = self._endpoint.recvfrom(wait)
+                except (TimeoutError, ConnectionAbortedError) as e:
+                    wait = step.throw(e)
+                else:
+                    wait = step.send(datagram)
+        except StopIteration as e:
+            return e.value
 
-    def _recv_from_peer(self) -> bytes:
+    def recv(self, winsize: int = 1, ackfreq: int = 1) -> bytes:
         """
-        Read the socket for the next message from our peer connection.
+        Blocks the main thread until a whole message arrives through the
+        socket. In-order segments are acknowledged every `ackfreq` segments
+        or after `ACK_DELAY` seconds, while gaps, duplicates and the last
+        segment are acknowledged right away.
         """
-        while True:
-            seg, addr = self._skt.recvfrom(MAX_SEG_SIZE)
-            if self.peer_addr() == addr:
-                return seg
+        receiver = self._receiver(winsize, ackfreq)
+        self._run(self._recv_with(receiver))
+        return receiver.data()
 
-    def _recv_seg(self) -> Segment:
+    def recv_into(self, writer: BinaryIO, winsize: int = 1, ackfreq: int = 1) -> int:
         """
-        Blocks the main thread until a new segment arrives through the socket.
-        If a SYNACK segment arrives will try and finish establishing the
-        connection with the other end.
+        Like `recv`, but hands the message to `writer` as it arrives in
+        order instead of keeping it in memory. Returns how many bytes
+        were written.
         """
-        seg_bytes = self._recv_from_peer()
-        seg = Segment.from_bytes(seg_bytes)
-        self._log.recv(seg)
-
-        if seg.is_syn() and seg.is_ack():
-            # Our handshake ACK didn't reach
-            # the other side, resend and retry.
-            ack_seg = Segment.ack_seg(0)
-            self._sendall(ack_seg)
-            return self._recv_seg()
-
-        return seg
-
-    def _advance_seq_ofs(self, quantity: int):
-        self._seq_ofs = (self._seq_ofs + quantity) % MAX_SEQ_NUM
+        receiver = self._receiver(winsize, ackfreq, writer)
+        self._run(self._recv_with(receiver))
+        return receiver.written()
 
-    def _settimeout(self, timeout: Optional[float]):
-        self._skt.settimeout(timeout)
-
-    def recv(self, winsize: int = 1) -> bytes:
+    def send(self, data: bytes, winsize: int = 1, fastrtx: int = DUP_THRESH):
         """
-        Blocks the main thread until a new segment arrives through the socket.
+        Sends the bytes in `data` through the socket. The amount of
+        segments in flight is driven by the congestion window and never
+        exceeds `winsize`. A segment is resent as soon as `fastrtx`
+        segments after it are known to have arrived.
         """
-        self._validate_open()
-        self._settimeout(None)
-        data = bytearray()
-        received = {}
-
-        while True:
-            seg = self._recv_seg()
-
-            if seg.is_fin():
-                raise Hangup("The other end closed the connection")
-
-            if not seg.is_ack() and seg.seq_num() < self._seq_ofs + winsize:
-                received[seg.seq_num()] = seg
-                if seg.seq_num() > self._seq_ofs:
-                    sac_seg = Segment.sac_seg(seg.seq_num())
-                    self._sendall(sac_seg)
-                    continue
+        segs = Segment.make_segments(data, self._seq_ofs, self._data_size)
+        self._run(self._send_segs(segs, winsize, fastrtx))
 
-                while self._seq_ofs in received:
-                    seg = received.pop(self._seq_ofs)
-                    self._advance_seq_ofs(1)
-                    data.extend(seg.unwrap())
-
-                    if seg.is_lst():
-                        ack_seg = Segment.ack_seg(seg.seq_num())
-                        self._sendall(ack_seg)
-                        return data
-
-                ack_seg = Segment.ack_seg(self._seq_ofs - 1)
-                self._sendall(ack_seg)
-
-    def send(self, data: bytes, winsize: int = 1):
+    def send_stream(self, reader: BinaryIO, winsize: int = 1, fastrtx: int = DUP_THRESH):
         """
-        Sends the bytes in `data` through the socket.
+        Like `send`, but reads the message from `reader` as the window
+        opens instead of taking it whole.
         """
-        self._validate_open()
-        segs_to_send = list(Segment.make_segments(data, self._seq_ofs))
-        winsize = min(winsize, len(segs_to_send))
-        send_time = [0] * len(segs_to_send)
-
-        a = 0
-        b = winsize
-        ackd = set()
-
-        while True:
-            self._settimeout(None)
-            for i in range(a, b):
-                seg = segs_to_send[i]
-                if seg.seq_num() not in ackd:
-                    now = time()
-                    if now - send_time[i] >= TIMEOUT:
-                        self._sendall(seg)
-                        send_time[i] = now
-
-            try:
-                self._settimeout(TIMEOUT)
-                res = self._recv_seg()
-            except timeout:
-                continue
-
-            if res.is_sac() and res.seq_num() < self._seq_ofs + winsize:
-                ackd.add(res.seq_num())
-
-            elif res.is_ack() and res.seq_num() < self._seq_ofs + winsize:
-                for seq_num in range(self._seq_ofs, res.seq_num() + 1):
-                    ackd.discard(seq_num)
-                    self._advance_seq_ofs(1)
-                    a += 1
-                    b = min(b + 1, len(segs_to_send))
-
-                if segs_to_send[a - 1].is_lst():
-                    return
-
-            elif not res.is_ack() and not res.is_sac():
-                if res.seq_num() < self._seq_ofs:
-                    # The other side is still sending a data
-                    # segment from a previous call to recv.
-                    ack_seg = Segment.ack_seg(self._seq_ofs - 1)
-                    self._sendall(ack_seg)
-                else:
-                    # We didn't receive their last ACK
-                    # and are still trying to send the
-                    # last segment.
-                    self._advance_seq_ofs(len(segs_to_send) - a)
-                    return
-
-    def addr(self) -> tuple[str, int]:
-        self._validate_open()
-        return self._addr
-
-    def peer_addr(self) -> tuple[str, int]:
-        self._validate_open()
-        return self._peer_addr
+        segs = Segment.read_segments(reader, self._seq_ofs, self._data_size)
+        self._run(self._send_segs(segs, winsize, fastrtx))
 
     def close(self):
         if self._closed:
             return
 
-        fin_seg = Segment.fin_seg(self._seq_ofs)
-        timeouts = 0
-
-        while timeouts < MAX_TIMEOUT_COUNT:
-            self._settimeout(None)
-            self._sendall(fin_seg)
-
-            try:
-                self._settimeout(TIMEOUT)
-                res = self._recv_seg()
-                timeouts = 0
-            except timeout:
-                timeouts += 1
-                continue
-
-            if res.is_fin():
-                ack_seg = Segment.ack_seg(res.seq_num())
-                self._sendall(ack_seg)
-                break
-
-            if res.is_ack() and res.seq_num() == fin_seg.seq_num():
-                break
-
-        self._closed = True
-        self._skt.close()
+        self._run(self._close())
+        self._release()
 
 
 class RdpListener:
-    def __init__(self, addr: tuple[str, int], log: bool):
+    def __init__(self, addr: tuple[str, int], log: bool, demux: bool = False,
+                 reuseport: bool = False, batch: bool = False,
+                 mss: int = MAX_SEG_SIZE, probe: bool = False, winsize: int = 1,
+                 cc: Callable[[], CongestionController] = RenoController):
         self._log = VerboseLogger() if log else QuietLogger()
         self._skt = socket(AF_INET, SOCK_DGRAM)
+        if reuseport:
+            self._skt.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+        if probe:
+            dont_fragment(self._skt)
+
         self._skt.bind(addr)
         self._logging = log
         self._conns = set()
+        self._batch = batch
+        self._mss = mss
+        self._probe = probe
+        self._winsize = winsize
+        self._cc = cc
+        self._table = ConnTable(self._skt, mss) if demux else None
         self._addr = addr
 
     @classmethod
-    def bind(cls, ip: str, port: int, log: bool = False) -> RdpListener:
+    def bind(cls, ip: str, port: int, log: bool = False, demux: bool = False,
+             reuseport: bool = False, batch: bool = False,
+             mss: int = MAX_SEG_SIZE, probe: bool = False, winsize: int = 1,
+             cc: Callable[[], CongestionController] = RenoController) -> RdpListener:
         """
         Creates a new `RdpListener` and binds it to the given address.
+        If `demux` is set, every connection is served from the listener's
+        own socket instead of a new one per peer. If `reuseport` is set,
+        other processes may bind listeners to the same address and the
+        kernel spreads the peers among them. If `batch` is set, the
+        socket of every connection sends and receives datagrams in
+        batches where supported. `mss` and `probe` bound the segment size,
+        `winsize` is announced and `cc` makes the congestion controller of
+        every connection as in `RdpStream.connect`.
         """
-        return cls((ip, port), log)
+        return cls((ip, port), log, demux, reuseport, batch, mss, probe, winsize, cc)
 
-    def accept(self) -> RdpStream:
+    def _next_stream(self) -> RdpStream:
         """
-        Blocks the main thread until a new connection arrives to this socket
-        and returns a new `RdpStream` which links to that connection.
+        Blocks until a SYN from a new peer arrives and returns the
+        not yet established `RdpStream` for it.
         """
-        self._log.awaiting_connections(self.addr())
+        if self._table is not None:
+            endpoint, seg, peer_addr = self._table.next_conn()
+            self._log.recv(seg)
+            stream = RdpStream(peer_addr, self._logging, endpoint, mss=self._mss, probe=self._probe,
+                               winsize=self._winsize, cc=self._cc)
+            stream._accept_syn(seg)
+            return stream
 
         while True:
             # Wait for SYN segments for new connections
-            seg_bytes, peer_addr = self._skt.recvfrom(RDP_HEADER_SIZE)
-            seg = Segment.from_bytes(seg_bytes)
+            seg_bytes, peer_addr = self._skt.recvfrom(self._mss)
+            try:
+                seg = Segment.from_bytes(seg_bytes)
+            except ValueError:
+                continue
+
             self._log.recv(seg)
 
             if seg.is_syn() and peer_addr not in self._conns:
                 self._conns.add(peer_addr)
-                break
+                # Send SYNACK to peer from a new socket, the peer
+                # can connect again once this stream is closed.
+                forget = partial(self._conns.discard, peer_addr)
+                endpoint = BatchEndpoint(bufsize=self._mss) if self._batch else None
+                stream = RdpStream(peer_addr, self._logging, endpoint, forget, self._mss, self._probe,
+                                   self._winsize, self._cc)
+                stream._accept_syn(seg)
+                return stream
 
-        # Send SYNACK to peer from a new socket
-        stream = RdpStream(peer_addr, log=self._logging)
-        syn_ack_seg = Segment.syn_ack_seg()
+    def accept(self) -> RdpStream:
+        """
+        Blocks the main thread until a new connection arrives to this socket
+        and returns a new `RdpStream` which links to that connection.
+        """
+        self._log.awaiting_connections(self.addr())
 
         while True:
-            stream._settimeout(None)
-            stream._sendall(syn_ack_seg)
-            try:
-                # Wait to receive ACK of SYNACK
-                stream._settimeout(TIMEOUT)
-                seg_bytes = stream._recv_from_peer()
-            except timeout:
-                continue
-
-            seg = Segment.from_bytes(seg_bytes)
-            self._log.recv(seg)
-
-            if seg.is_ack() and seg.seq_num() == 0:
+            stream = self._next_stream()
+            if stream._run(stream._handshake()):
                 break
 
-        self._log.connection_established(peer_addr)
+            # The peer is gone, drop the half open connection.
+            stream._release()
+
+        self._log.connection_established(stream.peer_addr())
         return stream
 
     def __iter__(self) -> Iterator[RdpStream]:
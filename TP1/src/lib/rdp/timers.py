@@ -0,0 +1,56 @@
+from heapq import heappush, heappop
+from typing import Hashable, Optional
+
+
+class DeadlineQueue:
+    """
+    Min-heap of deadlines indexed by key. Scheduling is O(log n) and
+    cancelling is O(1): stale heap entries are dropped lazily once
+    they reach the top of the heap.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+
+    def schedule(self, key: Hashable, deadline: float):
+        """
+        Sets the deadline of `key`, replacing any previous one.
+        """
+        self._deadlines[key] = deadline
+        heappush(self._heap, (deadline, key))
+
+    def cancel(self, key: Hashable):
+        self._deadlines.pop(key, None)
+
+    def _discard_stale(self):
+        while self._heap:
+            deadline, key = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                return
+
+            heappop(self._heap)
+
+    def earliest(self) -> Optional[float]:
+        """
+        Returns the closest deadline, or `None` if nothing is scheduled.
+        """
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now: float) -> list:
+        """
+        Removes and returns the keys whose deadline is not after `now`.
+        """
+        expired = []
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return expired
+
+            _, key = heappop(self._heap)
+            del self._deadlines[key]
+            expired.append(key)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
@@ -0,0 +1,138 @@
+from .rdp.socket import RdpStream
+from .message import Message, MessageWriter
+from .codec import Codec
+from .chunks import ChunkReader, chunks_of, manifest
+from .delta import DeltaReader, Signature, delta_ops
+from .spool import sha256_of
+import mmap
+import os
+from typing import BinaryIO, Callable, Optional
+
+
+class Session:
+    """
+    Client side of a connection which serves many requests. The stream
+    carries one message at a time in either direction, so requests go
+    out one after the other, each with an ID its response has to echo.
+    Servers which predate sessions answer without an ID.
+    """
+
+    def __init__(self, stream: RdpStream, winsize: int, ackfreq: int, fastrtx: int):
+        self._stream = stream
+        self._winsize = winsize
+        self._ackfreq = ackfreq
+        self._fastrtx = fastrtx
+        self._next_id = 0
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def _check(self, req_id: int, res: Message):
+        if res.id() is not None and res.id() != req_id:
+            raise ValueError(f"Got the response to request {res.id()} instead of {req_id}")
+
+    def _range(self, offset: int, length: Optional[int]) -> Optional[tuple[int, Optional[int]]]:
+        return (offset, length) if offset > 0 or length is not None else None
+
+    def stat(self, path: str) -> Message:
+        """
+        Asks for the size and checksum of `path` and returns the response.
+        """
+        req_id = self._new_id()
+        self._stream.send(Message.stat(path, req_id).encode(), self._winsize, self._fastrtx)
+        res = Message.from_bytes(self._stream.recv(self._winsize, self._ackfreq))
+        self._check(req_id, res)
+        return res
+
+    def upload(self, path: str, reader: BinaryIO, offset: int = 0, length: Optional[int] = None,
+               codec: Optional[Codec] = None) -> Message:
+        """
+        Uploads the contents of `reader` to `path`, compressed with
+        `codec` if given, and returns the response. With an `offset`
+        they continue an interrupted upload of `path` from that byte on.
+        With a `length` they are a stripe of `path`, which is only
+        complete once uploaded from the end of its last stripe on.
+        """
+        req_id = self._new_id()
+        msg = Message.upload(path, bytes(), req_id, self._range(offset, length), codec)
+        self._stream.send_stream(msg.reader(reader), self._winsize, self._fastrtx)
+        res = Message.from_bytes(self._stream.recv(self._winsize, self._ackfreq))
+        self._check(req_id, res)
+        return res
+
+    def upload_dedup(self, path: str, file: BinaryIO, codec: Optional[Codec] = None) -> Message:
+        """
+        Uploads `file` to `path` like `upload`, but only sends the chunks
+        of it the server does not have yet, asking for them first.
+        """
+        chunks, sha256 = chunks_of(file)
+        req_id = self._new_id()
+        digests = "\n".join(digest for digest, _ in chunks).encode()
+        self._stream.send(Message.have(path, digests, req_id).encode(), self._winsize, self._fastrtx)
+        res = Message.from_bytes(self._stream.recv(self._winsize, self._ackfreq))
+        self._check(req_id, res)
+        if not res.is_ok():
+            return res
+
+        head, ranges = manifest(chunks, sha256, set(res.unwrap().decode().split()))
+        req_id = self._new_id()
+        msg = Message.put(path, req_id, codec)
+        self._stream.send_stream(msg.reader(ChunkReader(file, head, ranges)), self._winsize, self._fastrtx)
+        res = Message.from_bytes(self._stream.recv(self._winsize, self._ackfreq))
+        self._check(req_id, res)
+        return res
+
+    def upload_delta(self, path: str, file: BinaryIO, codec: Optional[Codec] = None) -> Message:
+        """
+        Uploads `file` to `path` like `upload`, but only sends what
+        differs from the server's copy of it, rsync style. The whole
+        file is sent if the server has no copy.
+        """
+        req_id = self._new_id()
+        self._stream.send(Message.sigs(path, req_id).encode(), self._winsize, self._fastrtx)
+        res = Message.from_bytes(self._stream.recv(self._winsize, self._ackfreq))
+        self._check(req_id, res)
+        if not res.is_ok():
+            return self.upload(path, file, codec=codec)
+
+        sig = Signature.from_bytes(res.unwrap())
+        size = os.fstat(file.fileno()).st_size
+        # Mapping the file leaves reading it to the page cache, blocks
+        # are compared and sent straight out of it.
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else bytes()
+        try:
+            ops = delta_ops(data, sig)
+            body = DeltaReader(data, sha256_of(file.name), sig.block_size(), ops)
+            req_id = self._new_id()
+            msg = Message.delta(path, req_id, codec)
+            self._stream.send_stream(msg.reader(body), self._winsize, self._fastrtx)
+        finally:
+            if size > 0:
+                data.close()
+
+        res = Message.from_bytes(self._stream.recv(self._winsize, self._ackfreq))
+        self._check(req_id, res)
+        return res
+
+    def download(self, path: str, open_sink: Callable[[Message], BinaryIO],
+                 offset: int = 0, length: Optional[int] = None, codec: Optional[Codec] = None) -> MessageWriter:
+        """
+        Downloads `length` bytes, or up to the end, of `path` from byte
+        `offset` on, writing the data of the response to the file object
+        `open_sink` returns for it as in `MessageWriter`. The server may
+        compress them with `codec`, if given.
+        """
+        req_id = self._new_id()
+        msg = Message.download(path, req_id, self._range(offset, length), codec)
+        writer = MessageWriter(open_sink)
+        self._stream.send(msg.encode(), self._winsize, self._fastrtx)
+        self._stream.recv_into(writer, self._winsize, self._ackfreq)
+        writer.finish()
+        if writer.message() is not None:
+            self._check(req_id, writer.message())
+
+        return writer
+
+    def close(self):
+        self._stream.close()
@@ -0,0 +1,226 @@
+from __future__ import annotations
+from typing import BinaryIO, Optional, Union
+import tempfile
+import mmap
+import hashlib
+import os
+
+# Bytes read at a time when hashing a file.
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def partial_path(path: str) -> str:
+    """
+    Returns where an interrupted transfer of `path` is kept.
+    """
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, f".{basename}.part")
+
+
+def sha256_of(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class FileRange:
+    """
+    Reads at most `length` bytes of a file, or up to its end if `None`.
+    """
+
+    def __init__(self, file: BinaryIO, length: Optional[int]):
+        self._file = file
+        self._left = length
+
+    def read(self, size: int) -> bytes:
+        if self._left is None:
+            return self._file.read(size)
+
+        data = self._file.read(min(size, self._left))
+        self._left -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class MappedFile:
+    """
+    Reads the contents of a file mapped into memory, or already in
+    memory, as views into them instead of copies, so that downloads
+    are sent straight out of the page cache. Files of the storage are
+    only ever replaced by renaming, never written in place, so the
+    mapping stays the same for as long as a transfer reads it.
+    """
+
+    def __init__(self, data: Union[bytes, mmap.mmap]):
+        self._data = data
+        self._view = memoryview(data)
+        self._pos = 0
+
+    @classmethod
+    def open(cls, path: str) -> MappedFile:
+        with open(path, "rb") as f:
+            # Empty files cannot be mapped.
+            if os.fstat(f.fileno()).st_size == 0:
+                return cls(bytes())
+
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def read(self, size: int = -1) -> memoryview:
+        end = len(self._view) if size < 0 else min(self._pos + size, len(self._view))
+        data = self._view[self._pos:end]
+        self._pos = max(self._pos, end)
+        return data
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        if isinstance(self._data, mmap.mmap):
+            try:
+                self._data.close()
+            except BufferError:
+                # Segments of an interrupted transfer still point into
+                # it, the mapping goes away along with the last one.
+                pass
+
+
+class RangeWriter:
+    """
+    Writes from `offset` on into a file which other writers may be
+    filling at other offsets at the same time, creating it if needed.
+    """
+
+    def __init__(self, path: str, offset: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True, mode=0o777)
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        self._offset = offset
+        self._error: Optional[OSError] = None
+
+    def write(self, data: bytes) -> int:
+        # Like `FileSpool`, errors are reported once the transfer is over.
+        view = memoryview(data)
+        while view and self._error is None:
+            try:
+                written = os.pwrite(self._fd, view, self._offset)
+                self._offset += written
+                view = view[written:]
+            except OSError as e:
+                self._error = e
+
+        return len(data)
+
+    def close(self):
+        """
+        Closes the file, raising the first error that happened while
+        writing to it.
+        """
+        os.close(self._fd)
+        if self._error is not None:
+            raise self._error
+
+
+class FileSpool:
+    """
+    Writes a file under a temporary name next to its destination and
+    renames it into place on `commit`, so that readers never see it
+    half written and concurrent writers never interleave. A spool which
+    gets `suspend`ed is kept as the partial file of its destination,
+    and a new one given an `offset` carries on writing from there.
+    """
+
+    def __init__(self, path: str, offset: int = 0):
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True, mode=0o777)
+        fd, self._tmp_path = tempfile.mkstemp(dir=dirname, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+        self._path = path
+        self._error: Optional[OSError] = None
+
+        if offset > 0:
+            self._resume(offset)
+
+    def _resume(self, offset: int):
+        self._file.close()
+        try:
+            # Renaming claims the partial file, so that no one
+            # else carries on with it at the same time.
+            os.replace(partial_path(self._path), self._tmp_path)
+        except OSError:
+            os.unlink(self._tmp_path)
+            raise
+
+        self._file = open(self._tmp_path, "r+b")
+        size = self._file.seek(0, os.SEEK_END)
+        if size < offset:
+            self.suspend()
+            raise OSError(f"Only {size} bytes were transferred before")
+
+        self._file.truncate(offset)
+        self._file.seek(offset)
+
+    def write(self, data: bytes) -> int:
+        # Keep consuming the transfer after a failed write, the
+        # error is reported once it is over.
+        if self._error is None:
+            try:
+                self._file.write(data)
+            except OSError as e:
+                self._error = e
+
+        return len(data)
+
+    def sha256(self) -> str:
+        """
+        Returns the checksum of what was written so far.
+        """
+        self._file.flush()
+        return sha256_of(self._tmp_path)
+
+    def commit(self):
+        """
+        Moves the written file to its destination, raising the first
+        error that happened while writing it.
+        """
+        try:
+            self._file.close()
+            if self._error is not None:
+                raise self._error
+
+            os.chmod(self._tmp_path, 0o644)
+            os.replace(self._tmp_path, self._path)
+        except OSError:
+            os.unlink(self._tmp_path)
+            raise
+
+    def suspend(self):
+        """
+        Keeps what was written so far as the partial file of the
+        destination, for a later transfer to carry on with.
+        """
+        self._file.close()
+        try:
+            os.replace(self._tmp_path, partial_path(self._path))
+        except OSError:
+            self.discard()
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.unlink(self._tmp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,136 @@
+from .spool import FileSpool, FileRange, RangeWriter, partial_path
+from .message import Message
+from .filestat import FileStat
+from .session import Session
+from .codec import Codec, codec_for
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Optional
+import io
+import os
+
+# Smallest stripe worth a connection of its own, smaller files
+# are split over fewer streams.
+MIN_STRIPE_SIZE = 1 << 20
+
+
+def stripes(size: int, streams: int) -> list[tuple[int, int]]:
+    """
+    Splits `size` bytes into at most `streams` contiguous `(offset, length)`
+    ranges of about the same length, none shorter than `MIN_STRIPE_SIZE`
+    unless there is only one.
+    """
+    count = max(min(streams, size // MIN_STRIPE_SIZE), 1)
+    bounds = [size * i // count for i in range(count + 1)]
+    return [(bounds[i], bounds[i + 1] - bounds[i]) for i in range(count)]
+
+
+def _run(connect: Callable[[], Session], transfer: Callable[[Session], Message]) -> Message:
+    session = connect()
+    try:
+        return transfer(session)
+    finally:
+        session.close()
+
+
+def _first_error(results: list[Message]) -> Message:
+    return next((res for res in results if not res.is_ok()), results[-1])
+
+
+def upload_striped(connect: Callable[[], Session], path: str, name: str, streams: int,
+                   codec: Optional[Codec] = None) -> Message:
+    """
+    Uploads the file at `path` as `name` over up to `streams` connections
+    opened by `connect`, each sending a stripe which the server writes
+    in place into the partial file of `name`. Once every stripe is in,
+    an upload from the end of the file moves it to its destination.
+    Stripes are compressed with `codec` if the file seems to shrink.
+    Returns the first error response, or the last response.
+    """
+    size = os.path.getsize(path)
+    ranges = stripes(size, streams)
+    with open(path, "rb") as f:
+        codec = codec_for(f, codec)
+        if len(ranges) == 1:
+            return _run(connect, lambda session: session.upload(name, f, codec=codec))
+
+    def upload_stripe(stripe: tuple[int, int]) -> Message:
+        offset, length = stripe
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return _run(connect, lambda session: session.upload(name, FileRange(f, length), offset, length, codec))
+
+    with ThreadPoolExecutor(len(ranges)) as pool:
+        res = _first_error(list(pool.map(upload_stripe, ranges)))
+
+    if not res.is_ok():
+        return res
+
+    return _run(connect, lambda session: session.upload(name, io.BytesIO(), size))
+
+
+def download_striped(connect: Callable[[], Session], dst: str, name: str, streams: int,
+                     codec: Optional[Codec] = None) -> Message:
+    """
+    Downloads `name` into the directory `dst` over up to `streams`
+    connections opened by `connect`, each writing its stripe in place
+    into the partial file of the destination, which is moved into place
+    once every stripe is in. The server may compress the stripes with
+    `codec`. Returns the first error response, or the last response.
+    """
+    res = _run(connect, lambda session: session.stat(name))
+    if not res.is_ok():
+        return res
+
+    size = FileStat.from_bytes(res.unwrap()).size()
+    if size is None:
+        return Message.error(name, b"The file does not exist")
+
+    path = dst + Message.download(name).path()
+    partial = partial_path(path)
+    if size == 0:
+        FileSpool(path).commit()
+        return res
+
+    def download_stripe(stripe: tuple[int, int]) -> Message:
+        offset, length = stripe
+        sink = None
+
+        def open_sink(res: Message) -> BinaryIO:
+            nonlocal sink
+            # Keep error descriptions in memory to return them.
+            sink = RangeWriter(partial, res.offset()) if res.is_ok() else io.BytesIO()
+            return sink
+
+        try:
+            writer = _run(connect, lambda session: session.download(name, open_sink, offset, length, codec))
+        except ValueError as e:
+            # Corrupt or cut short compressed data.
+            try:
+                sink.close()
+            except OSError:
+                pass
+            return Message.error(name, str(e).encode())
+
+        res = writer.message()
+        if res is None:
+            return Message.error(name, b"Invalid response")
+
+        if not res.is_ok():
+            return Message.error(name, writer.sink().getvalue())
+
+        try:
+            writer.sink().close()
+        except OSError as e:
+            return Message.error(name, f"OSError raised: {e}".encode())
+
+        return res
+
+    ranges = stripes(size, streams)
+    with ThreadPoolExecutor(len(ranges)) as pool:
+        res = _first_error(list(pool.map(download_stripe, ranges)))
+
+    if res.is_ok():
+        # Claims the partial file, cut down to the size of the file.
+        FileSpool(path, size).commit()
+
+    return res
@@ -6,11 +6,24 @@ local f_syn = ProtoField.bool("custom_rdp.syn", "SYN", 8, nil, 0x40)
 local f_lst = ProtoField.bool("custom_rdp.lst", "LST", 8, nil, 0x20)
 local f_fin = ProtoField.bool("custom_rdp.fin", "FIN", 8, nil, 0x10)
 local f_sac = ProtoField.bool("custom_rdp.sack", "SACK", 8, nil, 0x08)
+local f_prb = ProtoField.bool("custom_rdp.prb", "PRB", 8, nil, 0x04)
+local f_wnd = ProtoField.bool("custom_rdp.wnd", "WND", 8, nil, 0x02)
 local f_seq_num = ProtoField.uint24("custom_rdp.seq_num", "Sequence Number")
+local f_window = ProtoField.uint24("custom_rdp.window", "Window")
+local f_sack_first = ProtoField.uint24("custom_rdp.sack_first", "First")
+local f_sack_last = ProtoField.uint24("custom_rdp.sack_last", "Last")
+local f_opt_kind = ProtoField.uint8("custom_rdp.opt_kind", "Kind")
+local f_opt_len = ProtoField.uint8("custom_rdp.opt_len", "Length")
+local f_opt_value = ProtoField.uint32("custom_rdp.opt_value", "Value")
 local f_data = ProtoField.bytes("custom_rdp.data", "Data")
 local f_data_ascii = ProtoField.string("custom_rdp.data_ascii", "Data (ASCII)")
 
-custom_rdp_proto.fields = { f_ack, f_syn, f_lst, f_fin, f_sac, f_seq_num, f_data, f_data_ascii }
+custom_rdp_proto.fields = {
+    f_ack, f_syn, f_lst, f_fin, f_sac, f_prb, f_wnd, f_seq_num, f_window, f_sack_first, f_sack_last,
+    f_opt_kind, f_opt_len, f_opt_value, f_data, f_data_ascii
+}
+
+local option_names = { [1] = "MSS", [2] = "ISN", [3] = "WND", [4] = "DATA", [5] = "DATA ACK" }
 
 function custom_rdp_proto.dissector(buffer, pinfo, tree)
 
@@ -20,7 +33,7 @@ function custom_rdp_proto.dissector(buffer, pinfo, tree)
 
     local flags = buffer(0, 1):uint()
     local seq_num = buffer(1, 3):uint()
-    local has_flags = bit32.band(flags, 0xF8) ~= 0
+    local has_flags = bit32.band(flags, 0xFC) ~= 0
     local has_data = buffer:len() > 4
     local has_no_extra_flags = bit32.band(flags, 0x70) ~= 0
 
@@ -39,9 +52,62 @@ function custom_rdp_proto.dissector(buffer, pinfo, tree)
     subtree:add(f_lst, buffer(0, 1))
     subtree:add(f_fin, buffer(0, 1))
     subtree:add(f_sac, buffer(0, 1))
+    subtree:add(f_prb, buffer(0, 1))
+    subtree:add(f_wnd, buffer(0, 1))
     subtree:add(f_seq_num, buffer(1, 3))
 
-    if has_data then
+    local is_sack = bit32.band(flags, 0x88) == 0x88
+    local is_syn = bit32.band(flags, 0x40) == 0x40
+    local is_prb = bit32.band(flags, 0x04) == 0x04
+    local is_wnd = bit32.band(flags, 0x82) == 0x82
+    local blocks_at = 4
+
+    if is_wnd and buffer:len() >= 7 then
+        subtree:add(f_window, buffer(4, 3))
+        blocks_at = 7
+        has_data = buffer:len() > 7
+    end
+
+    if is_syn and has_data then
+        local options = subtree:add(buffer(4), "Options")
+        local i = 4
+        while i + 2 <= buffer:len() do
+            local kind = buffer(i, 1):uint()
+            local len = buffer(i + 1, 1):uint()
+            if i + 2 + len > buffer:len() then
+                break
+            end
+
+            local name = option_names[kind] or string.format("Unknown (%d)", kind)
+            if kind == 4 then
+                local option = options:add(buffer(i, 2 + len), string.format("%s: %d bytes", name, len))
+                option:add(f_opt_kind, buffer(i, 1))
+                option:add(f_opt_len, buffer(i + 1, 1))
+                if len > 0 then
+                    option:add(f_data, buffer(i + 2, len))
+                    option:add(f_data_ascii, buffer(i + 2, len), buffer(i + 2, len):string())
+                end
+            elseif len == 0 or len > 4 then
+                break
+            else
+                local option = options:add(buffer(i, 2 + len), string.format("%s: %d", name, buffer(i + 2, len):uint()))
+                option:add(f_opt_kind, buffer(i, 1))
+                option:add(f_opt_len, buffer(i + 1, 1))
+                option:add(f_opt_value, buffer(i + 2, len))
+            end
+
+            i = i + 2 + len
+        end
+    elseif is_prb and has_data then
+        subtree:add(buffer(4), string.format("Probe of %d bytes", buffer:len()))
+    elseif is_sack and has_data then
+        local blocks = subtree:add(buffer(blocks_at), "SACK Blocks")
+        for i = blocks_at, buffer:len() - 6, 6 do
+            local block = blocks:add(buffer(i, 6), string.format("Block: %d-%d", buffer(i, 3):uint(), buffer(i + 3, 3):uint()))
+            block:add(f_sack_first, buffer(i, 3))
+            block:add(f_sack_last, buffer(i + 3, 3))
+        end
+    elseif has_data and not is_wnd then
         local data_field = buffer(4)
         subtree:add(f_data, data_field)
         
@@ -1,55 +1,309 @@
 from lib.rdp.socket import RdpListener, RdpStream, Hangup
+from lib.rdp.aio import AsyncRdpListener, AsyncRdpStream
 from lib.config import ServerConfig
-from lib.message import Message
+from lib.message import Message, MessageWriter, Discard
+from typing import BinaryIO, Optional
+from lib.filestat import FileStat
+from lib.codec import codec_for
+from lib.chunks import ChunkStore, ChunkedUpload
+from lib.delta import DeltaUpload, signature_of
+from lib.filecache import FileCache
+from lib.spool import FileSpool, FileRange, MappedFile, RangeWriter, partial_path
 from threading import Thread
+import io
 from sys import argv
+import asyncio
 import signal
 import os
 
 
-def handle_client(stream: RdpStream, storage: str, winsize: int):
-    try:
-        msg_bytes = stream.recv(winsize)
-    except Hangup:
-        stream.close()
-        return
+class Request:
+    """
+    Receives a request as it arrives, spooling uploaded data straight
+    to a temporary file of the storage directory. Concurrent uploads,
+    from any worker, never interleave and downloads never see a half
+    written file. Interrupted uploads are kept for a ranged upload to
+    carry on with. Uploads of a range with a length are stripes, which
+    go straight to their place in the partial file of the destination
+    while other stripes fill the rest of it. Compressed uploads are
+    decompressed on the way, and downloads get compressed if asked to
+    and the file seems to shrink. PUT uploads go through the chunk
+    store, so that chunks it already has are never sent again. DELTA
+    uploads rebuild the file out of its current copy. Downloads are
+    served out of `cache` if given, or else out of a mapping of the
+    file, and their segments point into either without copies.
+    """
+
+    def __init__(self, storage: str, cache: Optional[FileCache] = None):
+        self._storage = storage
+        self._cache = cache
+        self._spool: Optional[FileSpool] = None
+        self._stripe: Optional[RangeWriter] = None
+        self._error: Optional[OSError] = None
+        self._store = ChunkStore(storage)
+        self._chunked: Optional[ChunkedUpload] = None
+        self._delta: Optional[DeltaUpload] = None
+        self._digests = io.BytesIO()
+        self._writer = MessageWriter(self._open_sink)
+
+    def _open_sink(self, msg: Message) -> BinaryIO:
+        if msg.is_have():
+            return self._digests
+
+        if msg.is_put():
+            self._chunked = ChunkedUpload(self._store)
+            return self._chunked
 
-    msg = Message.from_bytes(msg_bytes)
-    path = msg.path()
+        if msg.is_delta():
+            try:
+                path = self._storage + msg.path()
+                spool = FileSpool(path)
+                try:
+                    base = open(path, "rb")
+                except OSError:
+                    spool.discard()
+                    raise
+
+                self._delta = DeltaUpload(base, spool)
+                return self._delta
+            except OSError as e:
+                self._error = e
+                return Discard()
+
+        if not msg.is_upload():
+            return Discard()
 
-    if msg.is_upload():
         try:
-            os.makedirs(storage, exist_ok=True, mode=0o777)
-            with open(storage + path, "wb") as f:
-                f.write(msg.unwrap())
-                response = Message.ok(path, bytes())
+            offset, length = msg.range() or (0, None)
+            if length is not None:
+                self._stripe = RangeWriter(partial_path(self._storage + msg.path()), offset)
+                return self._stripe
+
+            self._spool = FileSpool(self._storage + msg.path(), offset)
+            return self._spool
         except OSError as e:
-            response = Message.error(path, f"OSError raised: {e}".encode())
+            self._error = e
+            return Discard()
+
+    def _open(self, path: str) -> BinaryIO:
+        if self._cache is not None:
+            data = self._cache.get(path)
+            if data is not None:
+                return MappedFile(data)
+
+        return MappedFile.open(path)
+
+    def writer(self) -> MessageWriter:
+        return self._writer
+
+    def respond(self) -> tuple[Message, Optional[BinaryIO]]:
+        """
+        Completes the request and returns the response along with the
+        file its data has to be read from, which the caller must close.
+        """
+        msg = self._writer.message()
+        if msg is None:
+            return Message.error("/", b"Invalid request"), None
+
+        path = msg.path()
+        req_id = msg.id()
+
+        if msg.is_upload():
+            try:
+                if self._error is not None:
+                    raise self._error
+
+                self._writer.finish()
+                if self._stripe is not None:
+                    self._stripe.close()
+                else:
+                    self._spool.commit()
+                return Message.ok(path, bytes(), req_id, msg.range()), None
+            except OSError as e:
+                return Message.error(path, f"OSError raised: {e}".encode(), req_id), None
+            except ValueError as e:
+                self._discard()
+                return Message.error(path, str(e).encode(), req_id), None
+
+        elif msg.is_download():
+            try:
+                body = self._open(self._storage + path)
+            except OSError:
+                return Message.error(path, b"The file does not exist", req_id), None
+
+            offset, length = msg.range() or (0, None)
+            if offset > body.seek(0, os.SEEK_END):
+                body.close()
+                return Message.error(path, b"The range starts past the end of the file", req_id), None
 
-    elif msg.is_download():
+            body.seek(offset)
+            # Already compressed files are sent as they are.
+            codec = codec_for(body, msg.codec())
+            return Message.ok(path, bytes(), req_id, msg.range(), codec), FileRange(body, length)
+
+        elif msg.is_have():
+            try:
+                missing = self._store.missing(self._digests.getvalue().decode().split())
+                return Message.ok(path, "\n".join(missing).encode(), req_id), None
+            except ValueError as e:
+                return Message.error(path, str(e).encode(), req_id), None
+
+        elif msg.is_put():
+            try:
+                self._writer.finish()
+                self._chunked.assemble(self._storage + path)
+                return Message.ok(path, bytes(), req_id), None
+            except OSError as e:
+                return Message.error(path, f"OSError raised: {e}".encode(), req_id), None
+            except ValueError as e:
+                return Message.error(path, str(e).encode(), req_id), None
+
+        elif msg.is_sigs():
+            try:
+                with open(self._storage + path, "rb") as f:
+                    return Message.ok(path, signature_of(f), req_id), None
+            except OSError:
+                return Message.error(path, b"The file does not exist", req_id), None
+
+        elif msg.is_delta():
+            try:
+                if self._error is not None:
+                    raise self._error
+
+                self._writer.finish()
+                self._delta.commit()
+                return Message.ok(path, bytes(), req_id), None
+            except OSError as e:
+                return Message.error(path, f"OSError raised: {e}".encode(), req_id), None
+            except ValueError as e:
+                self._delta.discard()
+                return Message.error(path, str(e).encode(), req_id), None
+
+        elif msg.is_stat():
+            try:
+                return Message.ok(path, FileStat.of(self._storage + path).encode(), req_id), None
+            except OSError:
+                return Message.error(path, b"The file does not exist", req_id), None
+
+        else:
+            return Message.error(path, b"Invalid request method", req_id), None
+
+    def _discard(self):
+        if self._spool is not None:
+            self._spool.discard()
+
+        if self._stripe is not None:
+            try:
+                self._stripe.close()
+            except OSError:
+                pass
+
+    def abort(self):
+        """
+        Keeps the data of an interrupted upload for a later one.
+        """
+        if self._delta is not None:
+            self._delta.discard()
+
+        if self._spool is not None:
+            self._spool.suspend()
+
+        if self._stripe is not None:
+            try:
+                self._stripe.close()
+            except OSError:
+                pass
+
+
+def handle_client(stream: RdpStream, storage: str, cache: Optional[FileCache],
+                  winsize: int, ackfreq: int, fastrtx: int):
+    """
+    Serves requests from the client one after the other until it
+    closes the connection.
+    """
+    while True:
+        request = Request(storage, cache)
         try:
-            with open(storage + path, "rb") as f:
-                response = Message.ok(path, f.read())
-        except OSError:
-            response = Message.error(path, b"The file does not exist")
+            stream.recv_into(request.writer(), winsize, ackfreq)
+        except Hangup:
+            request.abort()
+            break
 
-    else:
-        response = Message.error(path, b"Invalid request method")
+        response, body = request.respond()
 
-    try:
-        stream.send(response.encode(), winsize)
-    except Hangup:
-        pass
+        try:
+            stream.send_stream(response.reader(body), winsize, fastrtx)
+        except Hangup:
+            break
+        finally:
+            if body is not None:
+                body.close()
 
     stream.close()
 
 
-if __name__ == "__main__":
-    config = ServerConfig(argv)
+async def handle_client_async(stream: AsyncRdpStream, storage: str, cache: Optional[FileCache],
+                              winsize: int, ackfreq: int, fastrtx: int):
+    while True:
+        request = Request(storage, cache)
+        try:
+            await stream.recv_into(request.writer(), winsize, ackfreq)
+        except Hangup:
+            request.abort()
+            break
+
+        # Keep the rename and open off the event loop, the segment
+        # sized reads and writes of the transfer are cheap enough.
+        response, body = await asyncio.to_thread(request.respond)
+
+        try:
+            await stream.send_stream(response.reader(body), winsize, fastrtx)
+        except Hangup:
+            break
+        finally:
+            if body is not None:
+                body.close()
+
+    await stream.close()
+
+
+async def serve_async(config: ServerConfig, reuseport: bool, cache: Optional[FileCache]):
+    ip, port = config.addr()
+    listener = await AsyncRdpListener.bind(ip, port, log=config.verbose(), reuseport=reuseport,
+                                           mss=config.mss(), probe=config.probe(), winsize=config.winsize())
+    storage = config.storage()
+    winsize = config.winsize()
+    ackfreq = config.ackfreq()
+    fastrtx = config.fastrtx()
+    tasks = set()
+
+    try:
+        async for stream in listener:
+            task = asyncio.create_task(handle_client_async(stream, storage, cache, winsize, ackfreq, fastrtx))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        listener.close()
+
+
+def serve(config: ServerConfig, reuseport: bool):
+    cache = FileCache(config.cache()) if config.cache() > 0 else None
+    # `kill -USR1` prints the counters to tune the budget with.
+    signal.signal(signal.SIGUSR1, lambda sig, frame: print(f"[{os.getpid()}] cache: {cache or 'off'}", flush=True))
+
+    if config.aio():
+        try:
+            asyncio.run(serve_async(config, reuseport, cache))
+        except KeyboardInterrupt:
+            pass
+
+        return
 
     log = config.verbose()
     ip, port = config.addr()
-    listener = RdpListener.bind(ip, port, log=log)
+    listener = RdpListener.bind(ip, port, log=log, demux=config.demux(), reuseport=reuseport,
+                                batch=config.batch(), mss=config.mss(), probe=config.probe(),
+                                winsize=config.winsize())
     threads = []
 
     def close_listener(sig, frame):
@@ -62,8 +316,52 @@ if __name__ == "__main__":
     signal.signal(signal.SIGINT, close_listener)
     storage = config.storage()
     winsize = config.winsize()
+    ackfreq = config.ackfreq()
+    fastrtx = config.fastrtx()
 
     for stream in listener:
-        thread = Thread(target=handle_client, args=(stream, storage, winsize))
+        thread = Thread(target=handle_client, args=(stream, storage, cache, winsize, ackfreq, fastrtx))
         threads.append(thread)
         thread.start()
+
+
+def serve_workers(config: ServerConfig):
+    """
+    Forks one server process per worker, all bound to the same address
+    with SO_REUSEPORT so that the kernel spreads peers among them.
+    """
+    pids = []
+    for _ in range(config.workers()):
+        pid = os.fork()
+        if pid == 0:
+            serve(config, reuseport=True)
+            os._exit(0)
+
+        pids.append(pid)
+
+    def signal_workers(sig: int):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    # A Ctrl-C from the terminal already reaches every worker, while
+    # a SIGTERM to this process is relayed to them as a SIGINT.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda sig, frame: signal_workers(signal.SIGINT))
+    signal.signal(signal.SIGUSR1, lambda sig, frame: signal_workers(signal.SIGUSR1))
+    while True:
+        try:
+            os.wait()
+        except ChildProcessError:
+            break
+
+
+if __name__ == "__main__":
+    config = ServerConfig(argv)
+
+    if config.workers() > 1:
+        serve_workers(config)
+    else:
+        serve(config, reuseport=False)
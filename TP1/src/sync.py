@@ -0,0 +1,61 @@
+from lib.rdp.socket import RdpStream, Hangup
+from lib.session import Session
+from lib.config import SyncConfig
+from lib.codec import codec_for
+from sys import argv
+import os
+
+
+def walk(src: str) -> list[str]:
+    """
+    Returns the paths of every file under `src`, relative to it.
+    """
+    paths = []
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        for name in sorted(files):
+            paths.append(os.path.relpath(os.path.join(root, name), src))
+
+    return paths
+
+
+if __name__ == "__main__":
+    config = SyncConfig(argv)
+
+    src = config.src()
+    dst = config.dst().rstrip("/")
+    log = config.verbose()
+    ip, port = config.addr()
+
+    stream = RdpStream.connect(ip, port, log=log, batch=config.batch(),
+                               mss=config.mss(), probe=config.probe(), winsize=config.winsize())
+    # Every file goes through the same connection, paying
+    # for a single handshake and close.
+    session = Session(stream, config.winsize(), config.ackfreq(), config.fastrtx())
+    failed = 0
+
+    try:
+        for path in walk(src):
+            with open(os.path.join(src, path), "rb") as f:
+                # Decided per file, logs shrink but archives do not.
+                codec = codec_for(f, config.codec())
+                name = dst + "/" + path.replace(os.sep, "/")
+                if config.dedup():
+                    res = session.upload_dedup(name, f, codec)
+                elif config.delta():
+                    res = session.upload_delta(name, f, codec)
+                else:
+                    res = session.upload(name, f, codec=codec)
+
+            if res.is_error():
+                failed += 1
+                print(f"{path}: {res.unwrap().decode()}")
+    except Hangup as e:
+        failed += 1
+        print(e)
+    except KeyboardInterrupt:
+        pass
+
+    session.close()
+    if failed:
+        exit(1)
@@ -0,0 +1,46 @@
+from lib.config import UploadConfig, ServerConfig, InvalidArgs
+import unittest
+
+ARGS = ["upload.py", "-H", "127.0.0.1", "-s", "src", "-n", "file"]
+SERVER_ARGS = ["server.py", "-H", "127.0.0.1"]
+
+
+class ConfigTest(unittest.TestCase):
+    def test_defaults_are_valid(self):
+        config = UploadConfig(ARGS)
+        self.assertGreaterEqual(config.ackfreq(), 1)
+        self.assertGreaterEqual(config.fastrtx(), 1)
+
+    def test_fastrtx_must_be_positive(self):
+        for value in ("0", "-1"):
+            with self.assertRaises(InvalidArgs):
+                UploadConfig(ARGS + ["-f", value])
+
+        self.assertEqual(UploadConfig(ARGS + ["-f", "1"]).fastrtx(), 1)
+
+    def test_ackfreq_must_be_positive(self):
+        for value in ("0", "-1"):
+            with self.assertRaises(InvalidArgs):
+                UploadConfig(ARGS + ["-a", value])
+
+        self.assertEqual(UploadConfig(ARGS + ["-a", "4"]).ackfreq(), 4)
+
+    def test_aio_rejects_demux_and_batch(self):
+        for flag in ("-D", "-b"):
+            with self.assertRaises(InvalidArgs):
+                ServerConfig(SERVER_ARGS + ["-A", flag])
+
+            self.assertFalse(ServerConfig(SERVER_ARGS + [flag]).aio())
+
+        self.assertTrue(ServerConfig(SERVER_ARGS + ["-A"]).aio())
+
+    def test_workers_must_be_positive(self):
+        for value in ("0", "-3"):
+            with self.assertRaises(InvalidArgs):
+                ServerConfig(SERVER_ARGS + ["-W", value])
+
+        self.assertEqual(ServerConfig(SERVER_ARGS + ["-W", "2"]).workers(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+from lib.delta import DeltaReader, DeltaUpload, Signature, signature_of, delta_ops, MIN_BLOCK_SIZE
+from lib.spool import FileSpool
+import tempfile
+import unittest
+import hashlib
+import random
+import io
+import os
+
+BLOCK = MIN_BLOCK_SIZE
+
+
+def random_bytes(size: int, seed: int) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def ops(self, old: bytes, new: bytes) -> list[tuple[str, int, int]]:
+        return delta_ops(new, Signature.from_bytes(signature_of(io.BytesIO(old))))
+
+    def upload(self, old: bytes, new: bytes, chunk: int = 1000) -> bytes:
+        """
+        Sends `new` as a delta against `old` through `DeltaUpload`, `chunk`
+        bytes at a time, and returns the rebuilt file.
+        """
+        path = os.path.join(self._dir.name, "file")
+        with open(path, "wb") as f:
+            f.write(old)
+
+        sig = Signature.from_bytes(signature_of(io.BytesIO(old)))
+        sha256 = hashlib.sha256(new).hexdigest()
+        reader = DeltaReader(new, sha256, sig.block_size(), delta_ops(new, sig))
+        upload = DeltaUpload(open(path, "rb"), FileSpool(path))
+        while data := reader.read(chunk):
+            upload.write(data)
+
+        upload.commit()
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_unchanged_file_is_one_run_of_blocks(self):
+        old = random_bytes(10 * BLOCK, 0)
+        self.assertEqual(self.ops(old, old), [("B", 0, 10)])
+
+    def test_inserted_bytes(self):
+        old = random_bytes(4 * BLOCK, 1)
+        new = old[:BLOCK + 100] + b"inserted" + old[BLOCK + 100:]
+        self.assertEqual(self.ops(old, new), [("B", 0, 1), ("L", BLOCK, BLOCK + 8), ("B", 2, 2)])
+
+    def test_deleted_bytes(self):
+        old = random_bytes(4 * BLOCK, 2)
+        new = old[:2 * BLOCK] + old[2 * BLOCK + 10:]
+        self.assertEqual(self.ops(old, new), [("B", 0, 2), ("L", 2 * BLOCK, BLOCK - 10), ("B", 3, 1)])
+
+    def test_short_trailing_block(self):
+        old = random_bytes(3 * BLOCK + 100, 3)
+        self.assertEqual(self.ops(old, old), [("B", 0, 4)])
+
+    def test_short_block_only_matches_the_end(self):
+        old = random_bytes(2 * BLOCK + 100, 4)
+        tail = old[2 * BLOCK:]
+        new = tail + old[:2 * BLOCK]
+        self.assertEqual(self.ops(old, new), [("L", 0, 100), ("B", 0, 2)])
+
+    def test_base_smaller_than_a_block(self):
+        old = random_bytes(100, 5)
+        self.assertEqual(self.ops(old, old), [("B", 0, 1)])
+        self.assertEqual(self.ops(old, old + b"more"), [("L", 0, 104)])
+
+    def test_new_file_smaller_than_a_block(self):
+        old = random_bytes(2 * BLOCK, 6)
+        self.assertEqual(self.ops(old, b"short"), [("L", 0, 5)])
+
+    def test_round_trip(self):
+        old = random_bytes(6 * BLOCK + 300, 7)
+        new = b"head" + old[:3 * BLOCK] + random_bytes(500, 8) + old[4 * BLOCK:] + b"tail"
+        self.assertEqual(self.upload(old, new), new)
+
+    def test_round_trip_a_byte_at_a_time(self):
+        old = random_bytes(3 * BLOCK + 10, 9)
+        new = old[BLOCK:] + b"\n" * 20 + old[:BLOCK]
+        self.assertEqual(self.upload(old, new, chunk=1), new)
+
+    def test_round_trip_from_an_empty_base(self):
+        new = random_bytes(BLOCK + 1, 10)
+        self.assertEqual(self.upload(b"", new), new)
+
+    def test_digest_mismatch_is_rejected(self):
+        old = random_bytes(2 * BLOCK, 11)
+        path = os.path.join(self._dir.name, "file")
+        with open(path, "wb") as f:
+            f.write(old)
+
+        upload = DeltaUpload(open(path, "rb"), FileSpool(path))
+        upload.write(f"sha256 {'0' * 64}\nblock {BLOCK}\nB 0 2\n".encode())
+        with self.assertRaises(ValueError):
+            upload.commit()
+
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), old)
+
+    def test_invalid_instruction_is_rejected(self):
+        path = os.path.join(self._dir.name, "file")
+        open(path, "wb").close()
+        upload = DeltaUpload(open(path, "rb"), FileSpool(path))
+        upload.write(b"X 1 2\n")
+        with self.assertRaises(ValueError):
+            upload.commit()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+from lib.filecache import FileCache
+import tempfile
+import unittest
+import os
+
+
+class FileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self._dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+
+        return path
+
+    def test_hits_and_misses(self):
+        cache = FileCache(1 << 20)
+        path = self.write("a", b"a" * 100)
+        self.assertEqual(cache.get(path), b"a" * 100)
+        self.assertEqual(cache.get(path), b"a" * 100)
+        self.assertEqual((cache.hits(), cache.misses(), cache.bypassed()), (1, 1, 0))
+
+    def test_large_files_bypass_the_counters(self):
+        cache = FileCache(1000)
+        path = self.write("big", bytes(1000))
+        self.assertIsNone(cache.get(path))
+        self.assertIsNone(cache.get(path))
+        self.assertEqual((cache.hits(), cache.misses(), cache.bypassed()), (0, 0, 2))
+        self.assertEqual(cache.size(), 0)
+
+    def test_modified_files_are_read_again(self):
+        cache = FileCache(1 << 20)
+        path = self.write("a", b"old")
+        cache.get(path)
+        path = self.write("a", b"newer")
+        self.assertEqual(cache.get(path), b"newer")
+        self.assertEqual(cache.size(), len(b"newer"))
+
+    def test_grown_files_are_dropped(self):
+        cache = FileCache(1000)
+        path = self.write("a", bytes(10))
+        cache.get(path)
+        self.write("a", bytes(1000))
+        self.assertIsNone(cache.get(path))
+        self.assertEqual(cache.size(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+from lib.rdp.connection import Connection
+from lib.rdp.mtu import MtuProber
+from lib.rdp.segment import Segment
+import unittest
+import errno
+
+PEER = ("127.0.0.1", 9)
+
+
+class LoopbackEndpoint:
+    """
+    Refuses datagrams larger than `mtu` like a socket with the DF bit set.
+    """
+
+    def __init__(self, mtu: int):
+        self.mtu = mtu
+        self.sent = []
+
+    def sendseg(self, seg: Segment, addr: tuple[str, int]):
+        if len(seg.encode()) > self.mtu:
+            raise OSError(errno.EMSGSIZE, "Message too long")
+
+        self.sent.append(seg)
+
+    def sendsegs(self, segs: list[Segment], addr: tuple[str, int]):
+        for seg in segs:
+            self.sendseg(seg, addr)
+
+    def dont_fragment(self):
+        pass
+
+
+class MtuProberTest(unittest.TestCase):
+    def test_refused_probe_lowers_the_limit(self):
+        prober = MtuProber(1000, 9000, True)
+        self.assertEqual(len(prober.poll(0, 1).encode()), 5000)
+        prober.on_too_big()
+        # The next probe goes out right away, below the refused size.
+        self.assertEqual(len(prober.poll(0, 1).encode()), 3000)
+
+    def test_refusal_without_pending_probe_is_ignored(self):
+        prober = MtuProber(1000, 1000, True)
+        prober.on_too_big()
+        self.assertIsNone(prober.poll(0, 1))
+        self.assertEqual(prober.size(), 1000)
+
+    def test_send_survives_probes_too_large_for_the_host(self):
+        endpoint = LoopbackEndpoint(1500)
+        conn = Connection(endpoint, PEER, False, probe=True)
+        conn._mtu = MtuProber(1000, 9000, True)
+
+        data = Segment.builder().seq_num(0).lst(True).data(b"data").build()
+        step = conn._send_segs([data], 8, 3)
+        next(step)
+        self.assertEqual(bytes(endpoint.sent[0].unwrap()), b"data")
+
+        with self.assertRaises(StopIteration):
+            step.send((Segment.ack_seg(0).encode(), PEER))
+
+        # The refused probe was taken as too large, not as an error.
+        self.assertFalse(any(seg.is_prb() for seg in endpoint.sent))
+        self.assertEqual(len(conn._mtu.poll(0, 1).encode()), 3000)
+
+
+if __name__ == "__main__":
+    unittest.main()
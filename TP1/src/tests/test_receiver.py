@@ -0,0 +1,68 @@
+from lib.rdp.segment import Segment, MAX_SEQ_NUM, MAX_SACK_BLOCKS
+from lib.rdp.receiver import Receiver
+from lib.rdp.seq import seq_add
+import unittest
+import io
+
+
+def data_seg(seq_num: int, lst: bool = False) -> Segment:
+    return Segment.builder().seq_num(seq_num).lst(lst).data(seq_num.to_bytes(3, "big")).build()
+
+
+class ReceiverTest(unittest.TestCase):
+    def receive(self, receiver: Receiver, seq_nums: list[int]) -> Segment:
+        ack = None
+        for seq_num in seq_nums:
+            ack = receiver.on_segment(data_seg(seq_num), 0)
+
+        return ack
+
+    def test_blocks_past_the_first_hole(self):
+        receiver = Receiver(100, 64, 1)
+        ack = self.receive(receiver, [100, 103, 105, 104, 108, 102])
+        self.assertTrue(ack.is_ack() and ack.is_sac())
+        self.assertEqual(ack.seq_num(), 100)
+        self.assertEqual(ack.sack_blocks(), [(102, 105), (108, 108)])
+
+    def test_filling_the_hole_delivers_the_first_block(self):
+        receiver = Receiver(0, 64, 1, io.BytesIO())
+        self.receive(receiver, [2, 3, 6])
+        ack = self.receive(receiver, [0, 1])
+        self.assertEqual(ack.seq_num(), 3)
+        self.assertEqual(ack.sack_blocks(), [(6, 6)])
+
+        ack = self.receive(receiver, [4, 5])
+        self.assertFalse(ack.is_sac())
+        self.assertEqual(ack.seq_num(), 6)
+
+    def test_duplicates_change_nothing(self):
+        receiver = Receiver(0, 64, 1)
+        ack = self.receive(receiver, [3, 3, 5, 3])
+        self.assertEqual(ack.sack_blocks(), [(3, 3), (5, 5)])
+
+    def test_blocks_across_wraparound(self):
+        top = MAX_SEQ_NUM - 1
+        receiver = Receiver(top - 1, 64, 1)
+        ack = self.receive(receiver, [top, 0, 1, 3])
+        self.assertEqual(ack.seq_num(), top - 2)
+        self.assertEqual(ack.sack_blocks(), [(top, 1), (3, 3)])
+
+    def test_blocks_are_capped(self):
+        receiver = Receiver(0, 1024, 1)
+        ack = self.receive(receiver, list(range(1, 200, 2)))
+        blocks = ack.sack_blocks()
+        self.assertEqual(len(blocks), MAX_SACK_BLOCKS)
+        self.assertEqual(blocks[0], (1, 1))
+        self.assertEqual(blocks[-1], (seq_add(1, 2 * (MAX_SACK_BLOCKS - 1)),) * 2)
+
+    def test_data_is_written_in_order(self):
+        sink = io.BytesIO()
+        receiver = Receiver(0, 64, 1, sink)
+        self.receive(receiver, [1, 2, 0])
+        receiver.on_segment(data_seg(3, lst=True), 0)
+        self.assertTrue(receiver.done())
+        self.assertEqual(sink.getvalue(), b"".join(i.to_bytes(3, "big") for i in range(4)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+from lib.rdp.segment import Segment
+import unittest
+
+
+class SegmentTest(unittest.TestCase):
+    def test_round_trip(self):
+        seg = Segment.builder().lst(True).seq_num(1234).data(b"data").build()
+        decoded = Segment.from_bytes(seg.encode())
+        self.assertTrue(decoded.is_lst())
+        self.assertEqual(decoded.seq_num(), 1234)
+        self.assertEqual(decoded.unwrap(), b"data")
+
+    def test_header_only(self):
+        decoded = Segment.from_bytes(Segment.fin_seg(7).encode())
+        self.assertTrue(decoded.is_fin())
+        self.assertEqual(decoded.unwrap(), b"")
+
+    def test_short_datagrams_are_rejected(self):
+        for data in (b"", b"\x40", b"ab", b"abc"):
+            with self.assertRaises(ValueError):
+                Segment.from_bytes(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
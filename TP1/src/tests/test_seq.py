@@ -0,0 +1,104 @@
+from lib.rdp import seq, segment
+from lib.rdp.seq import seq_add, seq_diff, seq_lt
+from lib.rdp.segment import Segment
+from lib.rdp.sender import Sender
+from lib.rdp.receiver import Receiver
+from lib.rdp.rto import RtoEstimator
+from lib.rdp.cc.reno import RenoController
+from unittest import mock
+import unittest
+import io
+
+# Small enough for a transfer of a few thousand segments to wrap
+# around the sequence space many times.
+SMALL_SEQ_NUM = 256
+
+
+class SeqTest(unittest.TestCase):
+    def test_add_wraps(self):
+        top = segment.MAX_SEQ_NUM - 1
+        self.assertEqual(seq_add(top, 1), 0)
+        self.assertEqual(seq_add(0, -1), top)
+        self.assertEqual(seq_add(top, 10), 9)
+
+    def test_diff_across_wrap(self):
+        top = segment.MAX_SEQ_NUM - 1
+        self.assertEqual(seq_diff(2, top), 3)
+        self.assertEqual(seq_diff(top, 2), -3)
+        self.assertEqual(seq_diff(5, 5), 0)
+
+    def test_lt_across_wrap(self):
+        top = segment.MAX_SEQ_NUM - 1
+        self.assertTrue(seq_lt(top, 0))
+        self.assertFalse(seq_lt(0, top))
+        self.assertFalse(seq_lt(7, 7))
+
+    def test_diff_is_bounded_by_half_the_space(self):
+        half = segment.MAX_SEQ_NUM // 2
+        self.assertEqual(seq_diff(half - 1, 0), half - 1)
+        self.assertEqual(seq_diff(half, 0), -half)
+
+
+class WraparoundTest(unittest.TestCase):
+    """
+    Runs a Sender and a Receiver against each other in memory, with a
+    sequence space small enough for the transfer to wrap around it.
+    """
+
+    def setUp(self):
+        for module in (seq, segment):
+            patcher = mock.patch.object(module, "MAX_SEQ_NUM", SMALL_SEQ_NUM)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def transfer(self, count: int, seq_ofs: int, winsize: int, lost: frozenset[int] = frozenset()):
+        """
+        Sends `count` segments starting at `seq_ofs`, dropping the first
+        transmission of every segment whose distance from `seq_ofs`,
+        modulo the sequence space, is in `lost`.
+        """
+        data = bytes(i % 251 for i in range(count * 4))
+        sent = set()
+        sender = Sender(Segment.make_segments(data, seq_ofs, lambda: 4), seq_ofs, winsize,
+                        RtoEstimator(), RenoController())
+        sink = io.BytesIO()
+        receiver = Receiver(seq_ofs, winsize, 1, sink)
+
+        now = 0.0
+        for _ in range(count * 20):
+            if sender.done():
+                break
+
+            for seg in sender.poll(now):
+                pos = seq_diff(seg.seq_num(), seq_ofs) % SMALL_SEQ_NUM
+                key = seg.seq_num(), bytes(seg.unwrap())
+                if pos in lost and key not in sent:
+                    sent.add(key)
+                    continue
+
+                ack = receiver.on_segment(seg, now)
+                if ack is not None:
+                    sender.on_feedback(ack, now)
+
+            ack = receiver.poll(now)
+            if ack is not None:
+                sender.on_feedback(ack, now)
+
+            now += 0.05
+
+        self.assertTrue(sender.done())
+        self.assertTrue(receiver.done())
+        self.assertEqual(sink.getvalue(), data)
+
+    def test_transfer_longer_than_the_space(self):
+        self.transfer(1000, 0, 32)
+
+    def test_transfer_starting_near_the_top(self):
+        self.transfer(1000, SMALL_SEQ_NUM - 5, 32)
+
+    def test_transfer_with_losses_across_wraps(self):
+        self.transfer(1000, 200, 32, {0, 55, 56, 57, 127, 128, 255})
+
+
+if __name__ == "__main__":
+    unittest.main()
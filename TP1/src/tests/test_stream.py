@@ -0,0 +1,80 @@
+from lib.rdp.cc.controller import CongestionController
+from lib.rdp.socket import RdpStream, RdpListener
+from socket import socket, AF_INET, SOCK_DGRAM
+from threading import Thread
+import unittest
+
+
+class FixedController(CongestionController):
+    """
+    Keeps the window at a fixed size, counting the acknowledged segments.
+    """
+
+    def __init__(self, cwnd: int):
+        self._cwnd = cwnd
+        self.acked = 0
+
+    def on_ack(self, acked: int):
+        self.acked += acked
+
+    def on_loss(self):
+        pass
+
+    def on_timeout(self):
+        pass
+
+    def cwnd(self) -> int:
+        return self._cwnd
+
+
+def free_port() -> int:
+    with socket(AF_INET, SOCK_DGRAM) as skt:
+        skt.bind(("127.0.0.1", 0))
+        return skt.getsockname()[1]
+
+
+class ControllerTest(unittest.TestCase):
+    def test_controllers_must_implement_every_method(self):
+        class Partial(CongestionController):
+            def cwnd(self) -> int:
+                return 1
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+    def test_streams_use_the_given_controllers(self):
+        port = free_port()
+        made = []
+
+        def make() -> FixedController:
+            made.append(FixedController(4))
+            return made[-1]
+
+        listener = RdpListener.bind("127.0.0.1", port, cc=make)
+        received = []
+
+        def serve():
+            stream = listener.accept()
+            received.append(stream.recv(winsize=16))
+            stream.send(b"pong" * 1000, winsize=16)
+            stream.close()
+
+        server = Thread(target=serve)
+        server.start()
+        try:
+            stream = RdpStream.connect("127.0.0.1", port, cc=make)
+            stream.send(b"ping" * 1000, winsize=16)
+            self.assertEqual(stream.recv(winsize=16), b"pong" * 1000)
+            stream.close()
+        finally:
+            server.join(10)
+            listener.close()
+
+        self.assertEqual(received, [b"ping" * 1000])
+        self.assertEqual(len(made), 2)
+        self.assertTrue(all(cc.acked > 0 for cc in made))
+        self.assertTrue(all(cc.cwnd() == 4 for cc in made))
+
+
+if __name__ == "__main__":
+    unittest.main()
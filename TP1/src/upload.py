@@ -1,7 +1,25 @@
 from lib.rdp.socket import RdpStream
 from lib.config import UploadConfig
-from lib.message import Message
+from lib.filestat import FileStat
+from lib.session import Session
+from lib.spool import sha256_of
+from lib.striped import upload_striped
+from lib.codec import codec_for
 from sys import argv
+import os
+
+
+def resume_offset(session: Session, name: str, size: int) -> int:
+    """
+    Returns how many bytes of an interrupted upload of the file the
+    server kept, 0 if none or more than the file has.
+    """
+    res = session.stat(name)
+    if not res.is_ok():
+        return 0
+
+    partial = FileStat.from_bytes(res.unwrap()).partial()
+    return partial if partial <= size else 0
 
 
 if __name__ == "__main__":
@@ -9,23 +27,55 @@ if __name__ == "__main__":
 
     src = config.src()
     name = config.name()
-    with open(src + "/" + name, "rb") as f:
-        data = f.read()
+    path = src + "/" + name
 
     log = config.verbose()
     ip, port = config.addr()
 
-    stream = RdpStream.connect(ip, port, log=log)
+    def connect() -> Session:
+        stream = RdpStream.connect(ip, port, log=log, batch=config.batch(),
+                                   mss=config.mss(), probe=config.probe(), winsize=config.winsize())
+        return Session(stream, config.winsize(), config.ackfreq(), config.fastrtx())
+
+    # Deduplication and deltas work on whole files over a single connection.
+    if config.streams() > 1 and not config.dedup() and not config.delta():
+        try:
+            res = upload_striped(connect, path, name, config.streams(), config.codec())
+            if res.is_error():
+                print(res.unwrap().decode())
+        except KeyboardInterrupt:
+            pass
+
+        exit(0)
+
+    f = open(path, "rb")
+    # Already compressed files are sent as they are.
+    codec = codec_for(f, config.codec())
+
+    session = connect()
     try:
-        msg = Message.upload(name, data)
-        winsize = config.winsize()
-        stream.send(msg.encode(), winsize)
-        res = stream.recv(winsize)
-
-        msg = Message.from_bytes(res)
-        if msg.is_error():
-            print(msg.unwrap().decode())
+        if config.dedup():
+            res = session.upload_dedup(name, f, codec)
+        elif config.delta():
+            res = session.upload_delta(name, f, codec)
+        else:
+            offset = resume_offset(session, name, os.path.getsize(path)) if config.resume() else 0
+            f.seek(offset)
+            res = session.upload(name, f, offset, codec=codec)
+
+            if res.is_ok() and offset > 0:
+                # The kept bytes may belong to another version of
+                # the file, start over if the result differs.
+                stat = FileStat.from_bytes(session.stat(name).unwrap())
+                if stat.sha256() != sha256_of(path):
+                    f.seek(0)
+                    res = session.upload(name, f, codec=codec)
+
+        if res.is_error():
+            print(res.unwrap().decode())
     except KeyboardInterrupt:
         pass
+    finally:
+        f.close()
 
-    stream.close()
+    session.close()